@@ -7,6 +7,8 @@ import xml.etree.ElementTree as ET
 from LD.Schema.Elements import Variable, Type, Connection, ConnectionPointIn, ConnectionPointOut, RelPosition, Expression, OutVariable, InVariable, Block, LD, POU, Interface, Coil, Contact
 from LD.Utils.counter import get_value, set_value
 from LD.Variables.token import tokenize_literals
+from Utils.compression import find_input, open_input
+from Utils.lexicon import fold, fold_all
 import os
 from enum import Enum
 
@@ -75,31 +77,22 @@ class BlockCategory(Enum):
     TRIG = 4
     OTHER = 5
 
+# typeName (case-folded, see Utils/lexicon.py) -> category
+BLOCK_CATEGORIES = {
+    **{name: BlockCategory.CMP for name in fold_all(['GT', 'EQ', 'GE', 'LE', 'NE', 'LT'])},
+    **{name: BlockCategory.MATH for name in fold_all(['ADD', 'SUB', 'DIV', 'MUL', 'MOD', 'MOVE'])},
+    **{name: BlockCategory.TIMER for name in fold_all(['TON'])},
+    **{name: BlockCategory.TRIG for name in fold_all(['R_TRIG', 'F_TRIG'])},
+}
+
+def classify_type_name(type_name: str) -> BlockCategory:
+    return BLOCK_CATEGORIES.get(fold(type_name or ""), BlockCategory.OTHER)
+
 def classify_block(block: Block) -> BlockCategory:
-    t = block.typeName.upper()
-    if t in ['GT', 'EQ', 'GE', 'LE', 'NE', 'LT']:
-        return BlockCategory.CMP
-    elif t in ['ADD', 'SUB', 'DIV', 'MUL', 'MOD', 'MOVE']:
-        return BlockCategory.MATH
-    elif t == "TON":
-        return BlockCategory.TIMER
-    elif t in ['R_TRIG', 'F_TRIG']:
-        return BlockCategory.TRIG
-    else:
-        return BlockCategory.OTHER
+    return classify_type_name(block.typeName)
     
 def classify_block_element(elem: ET.Element) -> BlockCategory:
-    t = elem.get('typeName')
-    if t in ['GT', 'EQ', 'GE', 'LE', 'NE', 'LT']:
-        return BlockCategory.CMP
-    elif t in ['ADD', 'SUB', 'DIV', 'MUL', 'MOD', 'MOVE']:
-        return BlockCategory.MATH
-    elif t == "TON":
-        return BlockCategory.TIMER
-    elif t in ['R_TRIG', 'F_TRIG']:
-        return BlockCategory.TRIG
-    else:
-        return BlockCategory.OTHER
+    return classify_type_name(elem.get('typeName'))
 
 def addOutVariable(block: Block):
     global nextID
@@ -186,8 +179,8 @@ def process_xml(input_file, output_file):
     missing_vars = [var for var in all_vars if var not in exist_vars]
     logger.debug(f"Missing vars: {missing_vars}")
     if missing_vars:
-        with open(gvars_path, 'r', encoding='utf-8') as f:
-            gvars_string = f.read()
+        with open_input(find_input(gvars_path)) as f:
+            gvars_string = f.read().decode('utf-8')
         gvars_root = ET.fromstring(gvars_string.strip())
         for gvs in gvars_root:
             if gvs.tag != 'globalVars':
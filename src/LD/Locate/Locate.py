@@ -3,20 +3,19 @@ sys.path.append("..")
 sys.path.append("../..")
 
 import xml.etree.ElementTree as ET
-import collections
 from Logs.colorLogger import get_color_logger
 from dataclasses import dataclass, field
-from typing import Dict, Set, List
+from typing import Dict, Set, List, Tuple
 from LD.Block.test import BlockCategory, classify_block_element
 
 # External module functions (assumed to be available)
-from .dim import get_dimensions, compute_block_port_y, DIMENSIONS
+from .dim import get_port_geometry, get_element_geometry, PortGeometry
+from .route import ConnectionRouter
+from .layout import LayoutEngine, get_layout_engine, local_id_key, DEFAULT_LAYOUT
 
 # Constants for configuration
 # WARN - BASE_ID MAGIC NUMBER IS NOT JUSTIFIED
 LEFT_POWER_RAIL_BASE_ID = 20000
-HORIZONTAL_GAP = 90
-VERTICAL_GAP = 80
 
 # Setup logging
 
@@ -35,6 +34,7 @@ class Node:
     y: int = None
     layer: int = None
     story: int = 0
+    geometry: PortGeometry = None
 
 class Locator:
     """
@@ -44,10 +44,23 @@ class Locator:
       - Creating parent-child connections.
       - Assigning layers and positions.
       - Updating XML elements with computed positions.
+    Positions are computed by a pluggable layout engine ("draft" by default).
     """
-    def __init__(self, ld: ET.Element):
+    PHASES = (
+        "build_nodes",
+        "build_connections",
+        "assign_layers",
+        "assign_positions",
+        "update_xml_positions",
+        "add_line_positions",
+    )
+
+    def __init__(self, ld: ET.Element, layout: str | LayoutEngine = DEFAULT_LAYOUT):
         self.ld = ld
+        self.layout = layout if isinstance(layout, LayoutEngine) else get_layout_engine(layout)
         self.nodes: Dict[str, Node] = {}
+        self.router: ConnectionRouter = None
+        self.feedback_edges: List[Tuple[str, str]] = []
 
     def build_nodes(self) -> Dict[str, Node]:
         """
@@ -68,20 +81,18 @@ class Locator:
             if local_id is None or node.tag == "rightPowerRail":
                 continue
 
-            typename = node.attrib.get("typeName")
-            dims = get_dimensions(node.tag, typename)
-            width = dims.get("width", 0)
-            height = dims.get("height", 0)
-            node.set("width", str(width))
-            node.set("height", str(height))
+            geometry = get_element_geometry(node)
+            node.set("width", str(geometry.width))
+            node.set("height", str(geometry.height))
 
             self.nodes[local_id] = Node(
                 local_id=local_id,
                 tag=node.tag,
                 element=node,
-                width=width,
-                height=height,
-                story=story
+                width=geometry.width,
+                height=geometry.height,
+                story=story,
+                geometry=geometry
             )
         return self.nodes
 
@@ -115,7 +126,8 @@ class Locator:
             element=left_power_rail,
             width=10,
             height=100,
-            story=story
+            story=story,
+            geometry=get_port_geometry("leftPowerRail")
         )
 
     def build_connections(self) -> None:
@@ -133,91 +145,111 @@ class Locator:
                         self.nodes[local_id].parents.add(ref_local_id)
                         self.nodes[ref_local_id].children.add(local_id)
 
+    def _ordered_children(self, node_id: str) -> List[str]:
+        """
+        Children of a node in localId order, so traversals are deterministic.
+        """
+        return sorted(self.nodes[node_id].children, key=local_id_key)
+
+    def strongly_connected_components(self):
+        """
+        Compute strongly connected components with an iterative Tarjan's algorithm.
+        Returns the components in topological order of the condensed graph
+        (each component listed in DFS discovery order) and the discovery index of every node.
+        """
+        index: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        stack: List[str] = []
+        on_stack: Set[str] = set()
+        components: List[List[str]] = []
+
+        def discover(node_id: str) -> None:
+            index[node_id] = low[node_id] = len(index)
+            stack.append(node_id)
+            on_stack.add(node_id)
+
+        for root in self.nodes:
+            if root in index:
+                continue
+            discover(root)
+            work = [(root, iter(self._ordered_children(root)))]
+            while work:
+                v_id, children = work[-1]
+                descended = False
+                for w_id in children:
+                    if w_id not in index:
+                        discover(w_id)
+                        work.append((w_id, iter(self._ordered_children(w_id))))
+                        descended = True
+                        break
+                    if w_id in on_stack:
+                        low[v_id] = min(low[v_id], index[w_id])
+                if descended:
+                    continue
+                work.pop()
+                if work:
+                    u_id = work[-1][0]
+                    low[u_id] = min(low[u_id], low[v_id])
+                if low[v_id] == index[v_id]:
+                    component = []
+                    while True:
+                        w_id = stack.pop()
+                        on_stack.discard(w_id)
+                        component.append(w_id)
+                        if w_id == v_id:
+                            break
+                    # popped in reverse discovery order
+                    component.reverse()
+                    components.append(component)
+        # Tarjan emits components in reverse topological order
+        components.reverse()
+        return components, index
+
     def assign_layers(self) -> None:
         """
-        Assign layer numbers using topological sort (Kahn's algorithm).
-        Layer represents the longest path from a source node (layer 0 or 1).
+        Assign layer numbers as the longest path from a source node (layer 0 or 1).
         leftPowerRail nodes are fixed at layer 0.
         Other nodes without parents start at layer 1.
+        Feedback loops are handled by condensing strongly connected components:
+        components are layered in topological order, and inside a component an edge
+        pointing back to an earlier discovered node is treated as a feedback edge
+        and ignored for layering. Runs in O(nodes + edges).
         """
-        in_degree: Dict[str, int] = {nid: 0 for nid in self.nodes}
-        # Initialize layers to None before calculation
+        components, discovery = self.strongly_connected_components()
+        component_of: Dict[str, int] = {}
+        for comp_idx, component in enumerate(components):
+            for node_id in component:
+                component_of[node_id] = comp_idx
+
+        self.feedback_edges = []
         for node in self.nodes.values():
             node.layer = None
-
-        queue = collections.deque()
-
-        # 1. Initialize layers for source nodes and calculate in-degrees
-        for node_id, node in self.nodes.items():
-            in_degree[node_id] = len(node.parents)
-            if node.tag == "leftPowerRail":
-                if node.layer is None: # Assign only if not already set
-                    node.layer = 0
-                    queue.append(node_id)
-            elif in_degree[node_id] == 0:
-                # Other nodes with no parents start at layer 1
-                if node.layer is None:
-                    node.layer = 1
-                    queue.append(node_id)
-
-        processed_count = 0
-        # 2. Process nodes layer by layer using Kahn's algorithm
-        while queue:
-            u_id = queue.popleft()
-            processed_count += 1
-            u_node = self.nodes[u_id]
-
-            # Ensure the dequeued node has a layer (should be guaranteed by initialization)
-            if u_node.layer is None:
-                 logger.error(f"CRITICAL: Node {u_id} dequeued but has no layer!")
-                 # Attempt recovery: Assign based on parents if possible, else default
-                 parent_layers = [self.nodes[p].layer for p in u_node.parents if p in self.nodes and self.nodes[p].layer is not None]
-                 u_node.layer = (max(parent_layers) + 1) if parent_layers else (1 if u_node.tag != "leftPowerRail" else 0)
-                 logger.warning(f"Recovered layer for {u_id} set to {u_node.layer}")
-
-            # Process children
-            for v_id in u_node.children:
+        for component in components:
+            for v_id in component:
                 v_node = self.nodes[v_id]
-                in_degree[v_id] -= 1
-                if in_degree[v_id] == 0:
-                    # All parents processed, calculate layer for v_node
-                    parent_layers = [self.nodes[p].layer for p in v_node.parents if p in self.nodes and self.nodes[p].layer is not None]
-                    if not parent_layers:
-                         # This means a node's parents weren't processed or don't exist in the map,
-                         # or it's connected to something outside the processed set.
-                         # If it truly has parents, this indicates an issue.
-                         # If it has no parents (in_degree was initially 0), it should have been handled already.
-                         # Assign layer based on the current node u_node as a fallback.
-                         logger.warning(f"Node {v_id} has 0 in-degree but no valid parent layers found. Assigning layer based on predecessor {u_id}.")
-                         v_node.layer = u_node.layer + 1
-                    else:
-                        # Assign layer as max of parents' layers + 1
-                        v_node.layer = max(parent_layers) + 1
-
-                    queue.append(v_id)
-                elif in_degree[v_id] < 0:
-                     logger.error(f"In-degree for node {v_id} became negative. Graph connection issue?")
-
-
-        # 3. Check for cycles or unprocessed nodes
-        if processed_count != len(self.nodes):
-            unprocessed_nodes = [nid for nid, node in self.nodes.items() if node.layer is None]
-            logger.warning(f"Topological sort completed with potential issues.")
-            logger.warning(f"Processed {processed_count}/{len(self.nodes)} nodes.")
-            if unprocessed_nodes:
-                 logger.warning(f"Unprocessed nodes (potential cycle members): {unprocessed_nodes}")
-                 # Assign a default high layer to unprocessed nodes to prevent errors later
-                 default_layer = max((node.layer for node in self.nodes.values() if node.layer is not None), default=-1) + 1
-                 for node_id in unprocessed_nodes:
-                     self.nodes[node_id].layer = default_layer
-                     logger.warning(f"Assigned default layer {default_layer} to unprocessed node {node_id}")
+                parent_layers = []
+                for p_id in v_node.parents:
+                    if component_of[p_id] == component_of[v_id] and discovery[p_id] >= discovery[v_id]:
+                        self.feedback_edges.append((p_id, v_id))
+                        continue
+                    parent_layers.append(self.nodes[p_id].layer)
+                if v_node.tag == "leftPowerRail":
+                    v_node.layer = 0
+                elif parent_layers:
+                    v_node.layer = max(parent_layers) + 1
+                else:
+                    v_node.layer = 1
+
+        if self.feedback_edges:
+            self.feedback_edges.sort(key=lambda edge: (local_id_key(edge[0]), local_id_key(edge[1])))
+            logger.info("Placed %d feedback edge(s) after SCC condensation: %s", len(self.feedback_edges), self.feedback_edges)
 
         # 4. Post-processing: Scale layers (original logic: layer * 2 - 1)
         # Ensure all nodes have a layer assigned before scaling
         max_initial_layer = 0
         for node in self.nodes.values():
             if node.layer is None:
-                # This should only happen if cycle detection failed to assign default
+                # Invariant guard: the SCC condensation above gives every node a layer
                 logger.error(f"Critical error: Node {node.local_id} has no layer after topological sort and cycle check. Assigning default layer 1.")
                 node.layer = 1 # Assign a fallback
             max_initial_layer = max(max_initial_layer, node.layer)
@@ -260,39 +292,9 @@ class Locator:
     def assign_positions(self) -> None:
         """
         Assign x and y positions based on layers and story groups.
+        The actual placement is delegated to the configured layout engine.
         """
-        # Set horizontal positions based on layer.
-        for node in self.nodes.values():
-            if node.tag == "leftPowerRail":
-                node.x = 10
-                node.y = 10
-            else:
-                node.x = HORIZONTAL_GAP * node.layer
-
-        # Group nodes by story.
-        stories: Dict[int, List[Node]] = {}
-        for node in self.nodes.values():
-            stories.setdefault(node.story, []).append(node)
-        sorted_stories = sorted(stories.keys())
-
-        offset = 0  # initial y offset
-        for s in sorted_stories:
-            if s == 0:
-                continue
-            story_nodes = sorted(stories[s], key=lambda n: int(n.local_id))
-            story_start = offset + 20
-            max_y = story_start
-            # Group nodes within the story by layer.
-            layers: Dict[int, List[Node]] = {}
-            logger.debug("Story %d nodes: %s", s, story_nodes)
-            for node in story_nodes:
-                layers.setdefault(node.layer, []).append(node)
-            for layer_nodes in layers.values():
-                for i, node in enumerate(layer_nodes):
-                    node.y = story_start + i * VERTICAL_GAP
-                    logger.debug("Assigning y=%d for node %s (layer %d)", node.y, node.local_id, node.layer)
-                    max_y = max(max_y, node.y + node.height)
-            offset = max_y
+        self.layout.assign_positions(self.nodes)
 
     def update_xml_positions(self) -> None:
         """
@@ -315,12 +317,12 @@ class Locator:
     def update_block_node(self, el: ET.Element, node: Node) -> None:
         """
         Update connection points for a block node, evenly spacing ports.
+        Port offsets come from the node's precomputed geometry table.
         """
+        port_y = node.geometry.port_y
         input_vars = el.find("inputVariables")
         if input_vars is not None:
-            vars_list = input_vars.findall("variable")
-            count = len(vars_list)
-            for idx, var in enumerate(vars_list):
+            for idx, var in enumerate(input_vars.findall("variable")):
                 cp_in = var.find("connectionPointIn")
                 if cp_in is None:
                     cp_in = ET.SubElement(var, "connectionPointIn")
@@ -329,12 +331,10 @@ class Locator:
                     rel = ET.Element("relPosition")
                     cp_in.insert(0, rel)
                 rel.attrib["x"] = "0"
-                rel.attrib["y"] = str(compute_block_port_y(el, count, idx))
+                rel.attrib["y"] = str(port_y[idx])
         output_vars = el.find("outputVariables")
         if output_vars is not None:
-            vars_list = output_vars.findall("variable")
-            count = len(vars_list)
-            for idx, var in enumerate(vars_list):
+            for idx, var in enumerate(output_vars.findall("variable")):
                 cp_out = var.find("connectionPointOut")
                 if cp_out is None:
                     cp_out = ET.SubElement(var, "connectionPointOut")
@@ -343,7 +343,7 @@ class Locator:
                     rel = ET.Element("relPosition")
                     cp_out.insert(0, rel)
                 rel.attrib["x"] = str(node.width)
-                rel.attrib["y"] = str(compute_block_port_y(el, count, idx))
+                rel.attrib["y"] = str(port_y[idx])
 
     def update_non_block_node(self, el: ET.Element, node: Node) -> None:
         """
@@ -369,7 +369,12 @@ class Locator:
     def add_line_positions(self) -> None:
         """
         Add intermediate positions to connection lines between nodes.
+        Lines are routed around placed nodes with a grid-indexed router.
         """
+        self.router = ConnectionRouter()
+        for node in self.nodes.values():
+            if node.x is not None and node.y is not None:
+                self.router.add_block(node.local_id, node.x, node.y, node.width, node.height)
         for node in self.nodes.values():
             el = node.element
             if node.tag == "block":
@@ -422,45 +427,29 @@ class Locator:
         if formalParamater == None:
             end_y = node_end.y + node_end.height // 2
         else:
-            # find the node in DIMENSIONS
-            dim = get_dimensions(node_end.tag, node_end.element.attrib.get("typeName"))
-            if node_end.element.attrib.get("typeName") == 'Q':
-                logger.warning(f"Q type found in connection, tag is{node_end.tag}")
-
-            if formalParamater in dim:
-                end_y = node_end.y + dim[formalParamater]
-            else:
-                end_y = node_end.y + 30
-
-        mid1_x = (start_x + end_x) // 2
-        mid1_y = start_y
-        mid2_x = mid1_x
-        mid2_y = end_y
-
-        positions = [
-            {"x": start_x, "y": start_y},
-        ]
-        if start_y != end_y:
-            positions.append({"x": mid1_x, "y": mid1_y})
-            positions.append({"x": mid2_x, "y": mid2_y})
-        positions.append({"x": end_x, "y": end_y})
-        for pos in positions:
+            end_y = node_end.y + node_end.geometry.formal_parameter_y(formalParamater)
+
+        # wires leaving the same output port or entering the same node share one net and may overlap
+        positions = self.router.route(
+            (start_x, start_y),
+            (end_x, end_y),
+            source=(node_end.local_id, formalParamater),
+            sink=node_start.local_id,
+            exclude=(node_start.local_id, node_end.local_id)
+        )
+        for x, y in positions:
             pos_el = ET.Element("position")
-            pos_el.attrib["x"] = str(pos["x"])
-            pos_el.attrib["y"] = str(pos["y"])
+            pos_el.attrib["x"] = str(x)
+            pos_el.attrib["y"] = str(y)
             conn.append(pos_el)
 
     def locate(self) -> ET.Element:
         """
         Execute the complete process to compute node positions and update the XML.
+        Phases run in the order listed in PHASES.
         """
-        self.build_nodes()
-        self.build_connections()
-        self.assign_layers()
-        logger.debug("Nodes after layer assignment: %s", self.nodes)
-        self.assign_positions()
-        self.update_xml_positions()
-        self.add_line_positions()
+        for phase in self.PHASES:
+            getattr(self, phase)()
         return self.ld
 
 # Usage example:
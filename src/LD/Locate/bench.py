@@ -0,0 +1,145 @@
+import sys
+sys.path.append('..')
+sys.path.append('../..')
+import argparse
+import logging
+import random
+import time
+import xml.etree.ElementTree as ET
+
+from LD.Locate.Locate import Locator
+from LD.Locate.layout import LAYOUT_ENGINES
+
+DEFAULT_SIZES = [1000, 5000, 10000, 50000]
+DEFAULT_STORY_SIZE = 50
+DEFAULT_LAYERS = 6
+DEFAULT_SEED = 0
+
+def _connect(el: ET.Element, ref_local_id: int) -> None:
+    cp_in = el.find("connectionPointIn")
+    if cp_in is None:
+        cp_in = ET.SubElement(el, "connectionPointIn")
+    ET.SubElement(cp_in, "connection", refLocalId=str(ref_local_id))
+
+def generate_rungs(size: int, story_size: int = DEFAULT_STORY_SIZE, layers: int = DEFAULT_LAYERS, seed: int = DEFAULT_SEED) -> ET.Element:
+    """
+    Generate an <LD> body of about `size` contacts/coils, split into stories of
+    `story_size` elements. Each element is wired to one or two random elements of
+    the previous column, so the localId order produces many edge crossings.
+    """
+    rng = random.Random(seed)
+    ld = ET.Element("LD")
+    rail = ET.SubElement(ld, "leftPowerRail", localId="0")
+    ET.SubElement(rail, "connectionPointOut", formalParameter="")
+    next_id = 1
+    remaining = size
+    while remaining > 0:
+        count = min(story_size, remaining)
+        remaining -= count
+        ET.SubElement(ld, "comment", localId=str(next_id))
+        next_id += 1
+        per_layer = max(1, count // layers)
+        previous = [0]
+        created = 0
+        while created < count:
+            column = []
+            for _ in range(min(per_layer, count - created)):
+                tag = "coil" if created + len(column) >= count - per_layer else "contact"
+                el = ET.SubElement(ld, tag, localId=str(next_id))
+                for ref in rng.sample(previous, min(len(previous), rng.randint(1, 2))):
+                    _connect(el, ref)
+                ET.SubElement(el, "connectionPointOut")
+                column.append(next_id)
+                next_id += 1
+            rng.shuffle(column)
+            created += len(column)
+            previous = column
+    return ld
+
+def _count_inversions(values: list) -> int:
+    if len(values) < 2:
+        return 0
+    mid = len(values) // 2
+    left, right = values[:mid], values[mid:]
+    count = _count_inversions(left) + _count_inversions(right)
+    i = j = 0
+    for k in range(len(values)):
+        if j >= len(right) or (i < len(left) and left[i] <= right[j]):
+            values[k] = left[i]
+            i += 1
+        else:
+            values[k] = right[j]
+            count += len(left) - i
+            j += 1
+    return count
+
+def count_crossings(locator: Locator) -> int:
+    """
+    Count crossings between edges that join the same pair of layers in one story.
+    O(E log E) through inversion counting.
+    """
+    groups = {}
+    for node in locator.nodes.values():
+        for p_id in node.parents:
+            parent = locator.nodes[p_id]
+            if parent.story != node.story or parent.y is None or node.y is None:
+                continue
+            groups.setdefault((node.story, parent.layer, node.layer), []).append((parent.y, node.y))
+    crossings = 0
+    for edges in groups.values():
+        edges.sort()
+        crossings += _count_inversions([end for _, end in edges])
+    return crossings
+
+def run(size: int, layout: str, seed: int = DEFAULT_SEED) -> dict:
+    ld = generate_rungs(size, seed=seed)
+    locator = Locator(ld, layout=layout)
+    locator.build_nodes()
+    locator.build_connections()
+    locator.assign_layers()
+    start = time.perf_counter()
+    locator.assign_positions()
+    layout_time = time.perf_counter() - start
+    return {
+        "size": size,
+        "layout": layout,
+        "seconds": layout_time,
+        "crossings": count_crossings(locator),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark LD layout engines on synthetic rungs (time and edge crossings)."
+    )
+    parser.add_argument(
+        '-s', '--sizes',
+        type=int,
+        nargs='+',
+        default=DEFAULT_SIZES,
+        help='Number of LD elements per run (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-l', '--layouts',
+        nargs='+',
+        default=sorted(LAYOUT_ENGINES),
+        choices=sorted(LAYOUT_ENGINES),
+        help='Layout engines to compare (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=DEFAULT_SEED,
+        help='Random seed of the rung generator (default: %(default)s)'
+    )
+    args = parser.parse_args()
+    # keep the per-node debug output of the locator out of the measurements
+    for name in ("LD.Locate.Locate", "LD.Locate.layout"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    print(f"{'size':>8} {'layout':>10} {'seconds':>10} {'crossings':>10}")
+    for size in args.sizes:
+        for layout in args.layouts:
+            result = run(size, layout, args.seed)
+            print(f"{result['size']:>8} {result['layout']:>10} {result['seconds']:>10.4f} {result['crossings']:>10}")
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,14 @@
 # This module defines dimensions and port settings (relative positions) for various element types.
 # Each key is a tuple (tag, typename) where typename can be None.
 import xml.etree.ElementTree as ET
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+# Non-port keys of a DIMENSIONS entry.
+GEOMETRY_KEYS = ("width", "height", "port")
+DEFAULT_PORT_HEIGHT = 60
+DEFAULT_FORMAL_Y = 30
 
 DIMENSIONS = {
     ("leftPowerRail", None): {
@@ -174,16 +182,53 @@ def get_port_positions(node):
         out_port = {"x": dims.get("width", 30), "y_factor": 0.5}
     return in_port, out_port
 
-def compute_block_port_y(element: ET.Element, count, index) -> int:
+class PortGeometry(NamedTuple):
     """
-    Compute the y position for a block's port given the node height,
-    the total number of ports (count), and the zero-based index of the port.
+    Immutable port offset table for one (tag, typename, port count).
+    port_y[i] is the y offset of the i-th input/output port,
+    formal_y maps a formalParameter to its y offset.
     """
-    key = (element.tag, element.attrib.get("typeName"))
-    default_height = 60
-    if key in DIMENSIONS:
-        if index in DIMENSIONS[key]:
-            return DIMENSIONS[key][index]
-    return default_height // (index + 1)
-    
-        
+    width: int
+    height: int
+    port_y: Tuple[int, ...]
+    formal_y: Mapping[str, int]
+
+    def formal_parameter_y(self, formal_parameter: str) -> int:
+        return self.formal_y.get(formal_parameter, DEFAULT_FORMAL_Y)
+
+@lru_cache(maxsize=None)
+def get_port_geometry(tag: str, typename: Optional[str] = None, count: int = 0) -> PortGeometry:
+    """
+    Build (once) the port geometry table for an element kind.
+    The offset of the port at zero-based index i is DIMENSIONS[(tag, typename)][i]
+    when given, else DEFAULT_PORT_HEIGHT // (i + 1); formalParameter offsets
+    follow the string keys of get_dimensions.
+    """
+    dims = get_dimensions(tag, typename)
+    exact = DIMENSIONS.get((tag, typename), {})
+    port_y = tuple(
+        exact[index] if index in exact else DEFAULT_PORT_HEIGHT // (index + 1)
+        for index in range(count)
+    )
+    formal_y = MappingProxyType({
+        key: value for key, value in dims.items()
+        if isinstance(key, str) and key not in GEOMETRY_KEYS
+    })
+    return PortGeometry(
+        width=dims.get("width", 0),
+        height=dims.get("height", 0),
+        port_y=port_y,
+        formal_y=formal_y,
+    )
+
+def get_element_geometry(element: ET.Element) -> PortGeometry:
+    """
+    Look up the port geometry of an element, sized to its largest port list.
+    """
+    count = 0
+    if element.tag == "block":
+        for section in ("inputVariables", "outputVariables"):
+            vars_el = element.find(section)
+            if vars_el is not None:
+                count = max(count, len(vars_el.findall("variable")))
+    return get_port_geometry(element.tag, element.attrib.get("typeName"), count)
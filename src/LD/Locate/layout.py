@@ -0,0 +1,181 @@
+# layout.py
+# This module holds the layout engines that turn layered LD nodes into x/y positions.
+# Engines are looked up by name, "draft" is the fast default used by the pipeline.
+from abc import ABC, abstractmethod
+from typing import Dict, List
+
+from Logs.colorLogger import get_color_logger
+
+HORIZONTAL_GAP = 90
+VERTICAL_GAP = 80
+# Minimum free space between two nodes of one layer in compact mode.
+COMPACT_ROW_GAP = 20
+STORY_MARGIN = 20
+LEFT_POWER_RAIL_X = 10
+LEFT_POWER_RAIL_Y = 10
+
+DEFAULT_LAYOUT = "draft"
+DEFAULT_MAX_SWEEPS = 4
+
+logger = get_color_logger(__name__)
+
+def local_id_key(local_id: str):
+    """Sort key for localIds: numeric ids in numeric order, others after them."""
+    return (0, int(local_id), "") if local_id.isdigit() else (1, 0, local_id)
+
+def group_by_story(nodes: Dict) -> Dict[int, List]:
+    """
+    Group nodes by story, each story sorted by localId.
+    """
+    stories: Dict[int, List] = {}
+    for node in nodes.values():
+        stories.setdefault(node.story, []).append(node)
+    return {s: sorted(stories[s], key=lambda n: local_id_key(n.local_id)) for s in sorted(stories)}
+
+def assign_x(nodes: Dict) -> None:
+    """
+    Set horizontal positions based on layer.
+    """
+    for node in nodes.values():
+        if node.tag == "leftPowerRail":
+            node.x = LEFT_POWER_RAIL_X
+            node.y = LEFT_POWER_RAIL_Y
+        else:
+            node.x = HORIZONTAL_GAP * node.layer
+
+class LayoutEngine(ABC):
+    """
+    Base class of layout engines. An engine receives the layered nodes of a
+    Locator and sets node.x and node.y.
+    """
+    name = None
+
+    @abstractmethod
+    def assign_positions(self, nodes: Dict) -> None:
+        ...
+
+class DraftLayout(LayoutEngine):
+    """
+    Fast layout: nodes of a layer are stacked in localId order.
+    """
+    name = "draft"
+
+    def assign_positions(self, nodes: Dict) -> None:
+        assign_x(nodes)
+        offset = 0  # initial y offset
+        for s, story_nodes in group_by_story(nodes).items():
+            if s == 0:
+                continue
+            story_start = offset + STORY_MARGIN
+            max_y = story_start
+            # Group nodes within the story by layer.
+            layers: Dict[int, List] = {}
+            logger.debug("Story %d nodes: %s", s, story_nodes)
+            for node in story_nodes:
+                layers.setdefault(node.layer, []).append(node)
+            for layer_nodes in layers.values():
+                for i, node in enumerate(layer_nodes):
+                    node.y = story_start + i * VERTICAL_GAP
+                    logger.debug("Assigning y=%d for node %s (layer %d)", node.y, node.local_id, node.layer)
+                    max_y = max(max_y, node.y + node.height)
+            offset = max_y
+
+class SugiyamaLayout(LayoutEngine):
+    """
+    Sugiyama-style layout: the order of nodes inside each layer is improved by
+    alternating down/up sweeps (barycenter or median of the neighbours' ranks)
+    to reduce edge crossings, then nodes are placed compactly, each as close as
+    possible to the mean y of its already placed parents.
+    Each sweep is O(E + V log V) and the number of sweeps is bounded by max_sweeps.
+    """
+    name = "sugiyama"
+
+    def __init__(self, heuristic: str = "barycenter", max_sweeps: int = DEFAULT_MAX_SWEEPS):
+        if heuristic not in ("barycenter", "median"):
+            raise ValueError(f"Unknown crossing reduction heuristic '{heuristic}'")
+        self.heuristic = heuristic
+        self.max_sweeps = max_sweeps
+
+    def _weight(self, ranks: List[int]) -> float:
+        if self.heuristic == "median":
+            ranks = sorted(ranks)
+            mid = len(ranks) // 2
+            if len(ranks) % 2:
+                return ranks[mid]
+            return (ranks[mid - 1] + ranks[mid]) / 2
+        return sum(ranks) / len(ranks)
+
+    def _sweep(self, ordered_layers: List[List], rank: Dict[str, int], nodes: Dict, downward: bool) -> bool:
+        """
+        Reorder every layer by the weight of its neighbours on the previous side.
+        Returns True if any layer changed its order.
+        """
+        changed = False
+        sequence = ordered_layers if downward else list(reversed(ordered_layers))
+        for layer_nodes in sequence[1:]:
+            layer = layer_nodes[0].layer
+            weights = {}
+            for node in layer_nodes:
+                neighbours = node.parents if downward else node.children
+                ranks = [
+                    rank[n_id] for n_id in neighbours
+                    if n_id in rank and (nodes[n_id].layer < layer if downward else nodes[n_id].layer > layer)
+                ]
+                weights[node.local_id] = self._weight(ranks) if ranks else rank[node.local_id]
+            reordered = sorted(layer_nodes, key=lambda n: weights[n.local_id])
+            if any(a is not b for a, b in zip(reordered, layer_nodes)):
+                changed = True
+                layer_nodes[:] = reordered
+                for i, node in enumerate(layer_nodes):
+                    rank[node.local_id] = i
+        return changed
+
+    def order_layers(self, story_nodes: List, nodes: Dict) -> List[List]:
+        """
+        Return the story's layers (in ascending layer order) with crossing-reduced node order.
+        """
+        layers: Dict[int, List] = {}
+        for node in story_nodes:
+            layers.setdefault(node.layer, []).append(node)
+        ordered_layers = [layers[layer] for layer in sorted(layers)]
+        rank = {node.local_id: i for layer_nodes in ordered_layers for i, node in enumerate(layer_nodes)}
+        for sweep in range(self.max_sweeps):
+            changed = self._sweep(ordered_layers, rank, nodes, downward=True)
+            changed = self._sweep(ordered_layers, rank, nodes, downward=False) or changed
+            if not changed:
+                logger.debug("Crossing reduction converged after %d sweep(s)", sweep + 1)
+                break
+        return ordered_layers
+
+    def assign_positions(self, nodes: Dict) -> None:
+        assign_x(nodes)
+        offset = 0
+        for s, story_nodes in group_by_story(nodes).items():
+            if s == 0:
+                continue
+            story_start = offset + STORY_MARGIN
+            max_y = story_start
+            placed = set()
+            for layer_nodes in self.order_layers(story_nodes, nodes):
+                next_free = story_start
+                for node in layer_nodes:
+                    parent_ys = [nodes[p].y for p in node.parents if p in placed]
+                    desired = sum(parent_ys) // len(parent_ys) if parent_ys else next_free
+                    node.y = max(desired, next_free)
+                    next_free = node.y + node.height + COMPACT_ROW_GAP
+                    placed.add(node.local_id)
+                    max_y = max(max_y, node.y + node.height)
+            offset = max_y
+
+LAYOUT_ENGINES = {
+    DraftLayout.name: DraftLayout,
+    SugiyamaLayout.name: SugiyamaLayout,
+}
+
+def get_layout_engine(name: str = DEFAULT_LAYOUT, **options) -> LayoutEngine:
+    """
+    Instantiate a layout engine by name.
+    """
+    if name not in LAYOUT_ENGINES:
+        raise ValueError(f"Unknown layout engine '{name}', expected one of {sorted(LAYOUT_ENGINES)}")
+    return LAYOUT_ENGINES[name](**options)
@@ -0,0 +1,135 @@
+# normalize.py
+# This module enforces the PLCopen structure of located LD elements.
+# REQUIRED_SPEC describes, per element tag, the required attributes (with
+# defaults), the required children and the schema order of the children.
+# It is compiled once into a SchemaNormalizer that fixes a whole POU in one pass.
+import xml.etree.ElementTree as ET
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from Logs.colorLogger import get_color_logger
+logger = get_color_logger("Locate/normalize.py")
+
+def _leaf():
+    return {'attributes': {}, 'children': {}}
+
+REQUIRED_SPEC = {
+    'block': {
+        'attributes': {
+            'typeName': 'undefined',
+            'localId': 'undefined'
+        },
+        'children': {
+            'position': _leaf(),
+            'inputVariables': _leaf(),
+            'inOutVariables': _leaf(),
+            'outputVariables': _leaf()
+        },
+        'order': ['position', 'inputVariables', 'inOutVariables', 'outputVariables', 'addData', 'documentation']
+    },
+    'contact': {
+        'attributes': {'localId': 'undefined'},
+        'children': {'position': _leaf()},
+        'order': ['position', 'connectionPointIn', 'connectionPointOut', 'variable', 'addData', 'documentation']
+    },
+    'coil': {
+        'attributes': {'localId': 'undefined'},
+        'children': {'position': _leaf()},
+        'order': ['position', 'connectionPointIn', 'connectionPointOut', 'variable', 'addData', 'documentation']
+    },
+    'inVariable': {
+        'attributes': {'localId': 'undefined'},
+        'children': {'position': _leaf()},
+        'order': ['position', 'connectionPointOut', 'expression', 'addData', 'documentation']
+    },
+    'outVariable': {
+        'attributes': {'localId': 'undefined'},
+        'children': {'position': _leaf()},
+        'order': ['position', 'connectionPointIn', 'expression', 'addData', 'documentation']
+    },
+    'leftPowerRail': {
+        'attributes': {'localId': 'undefined'},
+        'children': {'position': _leaf()},
+        'order': ['position', 'connectionPointOut', 'addData', 'documentation']
+    },
+    'rightPowerRail': {
+        'attributes': {'localId': 'undefined'},
+        'children': {'position': _leaf()},
+        'order': ['position', 'connectionPointIn', 'addData', 'documentation']
+    },
+}
+
+# Children removed from <LD> while normalizing.
+# WARN: temporary solution, should have another function doing post-processing job
+DROPPED_LD_CHILDREN = ("comment",)
+
+class CompiledSpec(NamedTuple):
+    attributes: Tuple[Tuple[str, str], ...]
+    # (tag, default attributes, compiled spec of the child)
+    children: Tuple[Tuple[str, Tuple[Tuple[str, str], ...], "CompiledSpec"], ...]
+    order: Dict[str, int]
+
+def compile_spec(spec: dict) -> CompiledSpec:
+    """
+    Compile one spec entry: attributes and children become tuples, the
+    child order becomes a tag -> rank map. Tags missing from 'order' rank
+    after all listed tags, in their original order.
+    """
+    children = tuple(
+        (tag, tuple(child_spec.get('attributes', {}).items()), compile_spec(child_spec))
+        for tag, child_spec in spec.get('children', {}).items()
+    )
+    order = spec.get('order', list(spec.get('children', {})))
+    return CompiledSpec(
+        attributes=tuple(spec.get('attributes', {}).items()),
+        children=children,
+        order={tag: rank for rank, tag in enumerate(order)},
+    )
+
+class SchemaNormalizer:
+    """
+    Normalize a POU tree against REQUIRED_SPEC in a single iterative pass:
+    missing attributes and children are added, children are put in schema
+    order with one index-based sort per element, and comments are dropped
+    from <LD>.
+    """
+    def __init__(self, spec_map: dict = REQUIRED_SPEC):
+        self.specs: Dict[str, CompiledSpec] = {tag: compile_spec(spec) for tag, spec in spec_map.items()}
+
+    def _apply(self, elem: ET.Element, spec: CompiledSpec) -> None:
+        for attr, default_val in spec.attributes:
+            if attr not in elem.attrib:
+                logger.debug(f"Adding missing attribute '{attr}' to <{elem.tag}> with default value '{default_val}'.")
+                elem.attrib[attr] = default_val
+
+        if not spec.children and not spec.order:
+            return
+        present = {child.tag for child in elem}
+        for tag, attributes, _ in spec.children:
+            if tag not in present:
+                logger.debug(f"Adding missing child <{tag}> to <{elem.tag}>.")
+                elem.append(ET.Element(tag, dict(attributes)))
+
+        order = spec.order
+        unranked = len(order)
+        ranks = [order.get(child.tag, unranked) for child in elem]
+        if any(a > b for a, b in zip(ranks, ranks[1:])):
+            # sorted() is stable, so unranked children keep their relative order
+            elem[:] = [child for _, _, child in sorted(zip(ranks, range(len(ranks)), list(elem)))]
+
+    def normalize(self, root: ET.Element) -> ET.Element:
+        stack: List[Tuple[ET.Element, Optional[CompiledSpec]]] = [(root, None)]
+        while stack:
+            elem, spec = stack.pop()
+            if elem.tag == 'LD':
+                kept = [child for child in elem if child.tag not in DROPPED_LD_CHILDREN]
+                if len(kept) != len(elem):
+                    elem[:] = kept
+            if spec is None:
+                spec = self.specs.get(elem.tag)
+            child_specs = {}
+            if spec is not None:
+                self._apply(elem, spec)
+                child_specs = {tag: child_spec for tag, _, child_spec in spec.children}
+            for child in elem:
+                stack.append((child, child_specs.get(child.tag)))
+        return root
@@ -0,0 +1,228 @@
+# route.py
+# This module routes LD connection lines orthogonally.
+# Every route is made of vertical and horizontal segments, so all collision
+# queries are along one grid line. Wire segments are kept per x (vertical)
+# and per y (horizontal) and blocks per grid column and row of cells, each
+# sorted by start: a query bisects into the entries of its line instead of
+# scanning them, however long its span is.
+import bisect
+import collections
+from typing import Dict, Hashable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+GRID_CELL_SIZE = 40
+# Distance between two candidate vertical channels.
+ROUTE_STEP = 10
+# Upper bound of vertical channels tried per connection.
+MAX_ROUTE_CANDIDATES = 9
+# Intervals longer than this are kept aside in a Line, the few of them are
+# checked by every query and the others are searched by bisection.
+LONG_SPAN = 4 * GRID_CELL_SIZE
+
+Point = Tuple[int, int]
+
+class Rect(NamedTuple):
+    key: Hashable
+    x0: int
+    y0: int
+    x1: int
+    y1: int
+
+class Wire:
+    """
+    Wire segments of one net along one grid line, merged into lo..hi.
+    Segments sharing a source port or a sink node belong to the same net
+    and are merged when they overlap.
+    """
+    __slots__ = ("sources", "sinks", "lo", "hi")
+
+    def __init__(self, source: Hashable, sink: Hashable, lo: int, hi: int):
+        self.sources = {source}
+        self.sinks = {sink}
+        self.lo = lo
+        self.hi = hi
+
+    def related(self, source: Hashable, sink: Hashable) -> bool:
+        return source in self.sources or sink in self.sinks
+
+    def merge(self, other: "Wire") -> None:
+        self.sources.update(other.sources)
+        self.sinks.update(other.sinks)
+        self.lo = min(self.lo, other.lo)
+        self.hi = max(self.hi, other.hi)
+
+def _ordered(a: int, b: int) -> Tuple[int, int]:
+    return (a, b) if a <= b else (b, a)
+
+class Line:
+    """
+    Intervals lo..hi of items along one grid line. Those up to LONG_SPAN long
+    are sorted by lo, one overlapping lo..hi starts in lo - LONG_SPAN..hi,
+    which is found by bisection. Longer ones are kept in a short list.
+    """
+    def __init__(self):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        self.items: List = []
+        self.long: List[Tuple[int, int, object]] = []
+
+    def insert(self, lo: int, hi: int, item) -> None:
+        if hi - lo > LONG_SPAN:
+            self.long.append((lo, hi, item))
+            return
+        i = bisect.bisect_right(self.starts, lo)
+        self.starts.insert(i, lo)
+        self.ends.insert(i, hi)
+        self.items.insert(i, item)
+
+    def remove(self, lo: int, hi: int, item) -> None:
+        if hi - lo > LONG_SPAN:
+            self.long = [entry for entry in self.long if entry[2] is not item]
+            return
+        i = bisect.bisect_left(self.starts, lo)
+        while self.items[i] is not item:
+            i += 1
+        del self.starts[i], self.ends[i], self.items[i]
+
+    def overlapping(self, lo: int, hi: int) -> Iterator:
+        first = bisect.bisect_left(self.starts, lo - LONG_SPAN)
+        last = bisect.bisect_right(self.starts, hi)
+        ends = self.ends
+        items = self.items
+        for i in range(first, last):
+            if ends[i] >= lo:
+                yield items[i]
+        for start, end, item in self.long:
+            if start <= hi and end >= lo:
+                yield item
+
+class BlockIndex:
+    """
+    Blocks registered in every grid column and row of cells they touch. A
+    vertical query only looks at the column of its x, a horizontal one at
+    the row of its y.
+    """
+    def __init__(self, cell_size: int = GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.columns: Dict[int, Line] = collections.defaultdict(Line)
+        self.rows: Dict[int, Line] = collections.defaultdict(Line)
+
+    def insert(self, rect: Rect) -> None:
+        size = self.cell_size
+        for cx in range(rect.x0 // size, rect.x1 // size + 1):
+            self.columns[cx].insert(rect.y0, rect.y1, rect)
+        for cy in range(rect.y0 // size, rect.y1 // size + 1):
+            self.rows[cy].insert(rect.x0, rect.x1, rect)
+
+    def vertical(self, x: int, y0: int, y1: int) -> Iterator[Rect]:
+        line = self.columns.get(x // self.cell_size)
+        return line.overlapping(y0, y1) if line is not None else iter(())
+
+    def horizontal(self, y: int, x0: int, x1: int) -> Iterator[Rect]:
+        line = self.rows.get(y // self.cell_size)
+        return line.overlapping(x0, x1) if line is not None else iter(())
+
+class ConnectionRouter:
+    """
+    Route connections as start -> (x, start_y) -> (x, end_y) -> end and pick
+    the vertical channel x closest to the midpoint that neither crosses a
+    block nor runs along a segment of another net, or else the one with the
+    fewest such hits.
+    """
+    def __init__(self, cell_size: int = GRID_CELL_SIZE):
+        self.blocks = BlockIndex(cell_size)
+        self.columns: Dict[int, Line] = collections.defaultdict(Line)
+        self.rows: Dict[int, Line] = collections.defaultdict(Line)
+
+    def add_block(self, key: Hashable, x: int, y: int, width: int, height: int) -> None:
+        self.blocks.insert(Rect(key, x, y, x + width, y + height))
+
+    @staticmethod
+    def _add_wire(lines: Dict[int, Line], at: int, source: Hashable, sink: Hashable, lo: int, hi: int) -> None:
+        line = lines[at]
+        wire = Wire(source, sink, lo, hi)
+        # the wires of the same net it overlaps become one, queries then skip a net at once
+        related = [w for w in line.overlapping(lo, hi) if w.related(source, sink)]
+        if related:
+            # grow the largest net, its sets are not copied
+            related.sort(key=lambda w: len(w.sources) + len(w.sinks), reverse=True)
+            for other in related:
+                line.remove(other.lo, other.hi, other)
+            base = related[0]
+            for other in related[1:] + [wire]:
+                base.merge(other)
+            wire = base
+        line.insert(wire.lo, wire.hi, wire)
+
+    def add_segment(self, source: Hashable, sink: Hashable, x: int, y0: int, y1: int) -> None:
+        """Register the vertical segment x, y0..y1."""
+        y0, y1 = _ordered(y0, y1)
+        self._add_wire(self.columns, x, source, sink, y0, y1)
+
+    def add_horizontal_segment(self, source: Hashable, sink: Hashable, y: int, x0: int, x1: int) -> None:
+        """Register the horizontal segment y, x0..x1."""
+        x0, x1 = _ordered(x0, x1)
+        if x0 != x1:
+            self._add_wire(self.rows, y, source, sink, x0, x1)
+
+    @staticmethod
+    def _wire_hits(lines: Dict[int, Line], at: int, lo: int, hi: int, source: Hashable, sink: Hashable) -> int:
+        line = lines.get(at)
+        if line is None:
+            return 0
+        return sum(1 for wire in line.overlapping(lo, hi) if not wire.related(source, sink))
+
+    def _hits(self, x: int, start: Point, end: Point, source: Hashable, sink: Hashable, exclude,
+              limit: Optional[int] = None) -> int:
+        """
+        Blocks crossed and wires of other nets run along by the route through
+        channel x, counting stops at limit.
+        """
+        y0, y1 = _ordered(start[1], end[1])
+        count = self._wire_hits(self.columns, x, y0, y1, source, sink)
+        blocks: Set[Rect] = set()
+        for rect in self.blocks.vertical(x, y0, y1):
+            if rect.key not in exclude and rect.x0 < x < rect.x1 and y0 < rect.y1 and rect.y0 < y1:
+                blocks.add(rect)
+        for px, py in (start, end):
+            if limit is not None and count + len(blocks) >= limit:
+                break
+            h0, h1 = _ordered(px, x)
+            if h0 == h1:
+                continue
+            count += self._wire_hits(self.rows, py, h0, h1, source, sink)
+            for rect in self.blocks.horizontal(py, h0, h1):
+                if rect.key not in exclude and h0 < rect.x1 and rect.x0 < h1 and rect.y0 < py < rect.y1:
+                    blocks.add(rect)
+        return count + len(blocks)
+
+    def _candidates(self, start_x: int, end_x: int):
+        mid = (start_x + end_x) // 2
+        low, high = _ordered(start_x, end_x)
+        yield mid
+        for k in range(1, MAX_ROUTE_CANDIDATES):
+            offset = (k + 1) // 2 * ROUTE_STEP * (1 if k % 2 else -1)
+            x = mid + offset
+            if low < x < high:
+                yield x
+
+    def route(self, start: Point, end: Point, source: Hashable = None, sink: Hashable = None, exclude=()) -> List[Point]:
+        """
+        Compute the polyline from start to end and register its segments.
+        When every candidate collides, the one with the fewest hits is used,
+        the one closest to the midpoint among equals.
+        """
+        if start[1] == end[1]:
+            self.add_horizontal_segment(source, sink, start[1], start[0], end[0])
+            return [start, end]
+        channel = None
+        fewest = None
+        for x in self._candidates(start[0], end[0]):
+            hits = self._hits(x, start, end, source, sink, exclude, fewest)
+            if fewest is None or hits < fewest:
+                channel, fewest = x, hits
+                if hits == 0:
+                    break
+        self.add_segment(source, sink, channel, start[1], end[1])
+        self.add_horizontal_segment(source, sink, start[1], start[0], channel)
+        self.add_horizontal_segment(source, sink, end[1], channel, end[0])
+        return [start, (channel, start[1]), (channel, end[1]), end]
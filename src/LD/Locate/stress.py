@@ -0,0 +1,241 @@
+"""
+Stress benchmark for LD.Locate: drives Locator phase by phase on generated
+LD bodies of a given shape and records time and peak memory per phase.
+"""
+import sys
+sys.path.append('..')
+sys.path.append('../..')
+import argparse
+import gc
+import logging
+import math
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+from LD.Locate.Locate import Locator
+from LD.Locate.bench import generate_rungs
+from LD.Locate.layout import LAYOUT_ENGINES, DEFAULT_LAYOUT
+
+DEFAULT_SIZES = [1000, 2000, 4000, 8000]
+DEFAULT_REPEAT = 3
+# Growth exponent above which a phase is reported as super-linear.
+DEFAULT_MAX_EXPONENT = 1.5
+FEEDBACK_PERIOD = 10
+BLOCK_TYPES = ["ADD", "MOVE", "TON", "GT"]
+
+class BodyBuilder:
+    """
+    Small helper that appends LD elements with increasing localIds.
+    """
+    def __init__(self):
+        self.ld = ET.Element("LD")
+        rail = ET.SubElement(self.ld, "leftPowerRail", localId="0")
+        ET.SubElement(rail, "connectionPointOut", formalParameter="")
+        self.next_id = 1
+        self.elements = {}
+
+    def _new_id(self) -> int:
+        local_id = self.next_id
+        self.next_id += 1
+        return local_id
+
+    def story(self) -> None:
+        ET.SubElement(self.ld, "comment", localId=str(self._new_id()))
+
+    def element(self, tag: str, refs=(), formal_parameter=None) -> int:
+        local_id = self._new_id()
+        el = ET.SubElement(self.ld, tag, localId=str(local_id))
+        self.elements[local_id] = el
+        if refs:
+            cp_in = ET.SubElement(el, "connectionPointIn")
+            for ref in refs:
+                conn = ET.SubElement(cp_in, "connection", refLocalId=str(ref))
+                if formal_parameter is not None:
+                    conn.set("formalParameter", formal_parameter)
+        if tag != "outVariable":
+            ET.SubElement(el, "connectionPointOut")
+        return local_id
+
+    def connect(self, local_id: int, ref: int) -> None:
+        el = self.elements[local_id]
+        ET.SubElement(el.find("connectionPointIn"), "connection", refLocalId=str(ref))
+
+    def block(self, type_name: str, inputs: dict) -> int:
+        local_id = self._new_id()
+        el = ET.SubElement(self.ld, "block", localId=str(local_id), typeName=type_name)
+        in_vars = ET.SubElement(el, "inputVariables")
+        for formal_parameter, ref in inputs.items():
+            var = ET.SubElement(in_vars, "variable", formalParameter=formal_parameter)
+            cp_in = ET.SubElement(var, "connectionPointIn")
+            ET.SubElement(cp_in, "connection", refLocalId=str(ref))
+        ET.SubElement(el, "inOutVariables")
+        out_vars = ET.SubElement(el, "outputVariables")
+        for formal_parameter in ("ENO", "OUT"):
+            var = ET.SubElement(out_vars, "variable", formalParameter=formal_parameter)
+            ET.SubElement(var, "connectionPointOut")
+        return local_id
+
+def deep_chain(size: int) -> ET.Element:
+    """One rung of `size` contacts in series ending in a coil."""
+    body = BodyBuilder()
+    body.story()
+    prev = 0
+    for _ in range(size - 1):
+        prev = body.element("contact", [prev])
+    body.element("coil", [prev])
+    return body.ld
+
+def wide_parallel(size: int) -> ET.Element:
+    """One rung of size/2 parallel two-contact branches joined into one coil."""
+    body = BodyBuilder()
+    body.story()
+    ends = []
+    for _ in range(max(1, (size - 1) // 2)):
+        first = body.element("contact", [0])
+        ends.append(body.element("contact", [first]))
+    body.element("coil", ends)
+    return body.ld
+
+def many_stories(size: int) -> ET.Element:
+    """Many small rungs (10 elements per story)."""
+    return generate_rungs(size, story_size=10, layers=3)
+
+def feedback_loops(size: int) -> ET.Element:
+    """A contact chain with a back edge every FEEDBACK_PERIOD elements (seal-in style loops)."""
+    body = BodyBuilder()
+    body.story()
+    prev = 0
+    loop_start = None
+    for i in range(size - 1):
+        prev = body.element("contact", [prev])
+        if i % FEEDBACK_PERIOD == 0:
+            loop_start = prev
+        elif i % FEEDBACK_PERIOD == FEEDBACK_PERIOD - 1:
+            body.connect(loop_start, prev)
+    body.element("coil", [prev])
+    return body.ld
+
+def block_heavy(size: int) -> ET.Element:
+    """Rungs of contact -> block (fed by two inVariables) -> coil + outVariable."""
+    body = BodyBuilder()
+    for i in range(max(1, size // 6)):
+        body.story()
+        contact = body.element("contact", [0])
+        in1 = body.element("inVariable")
+        in2 = body.element("inVariable")
+        block = body.block(BLOCK_TYPES[i % len(BLOCK_TYPES)], {"EN": contact, "IN1": in1, "IN2": in2})
+        body.element("coil", [block], formal_parameter="ENO")
+        body.element("outVariable", [block], formal_parameter="OUT")
+    return body.ld
+
+SHAPES = {
+    "chain": deep_chain,
+    "parallel": wide_parallel,
+    "stories": many_stories,
+    "feedback": feedback_loops,
+    "blocks": block_heavy,
+}
+
+def measure(shape: str, size: int, layout: str = DEFAULT_LAYOUT, repeat: int = DEFAULT_REPEAT) -> dict:
+    """
+    Run every Locator phase on a fresh body and return {phase: (seconds, peak_bytes)}.
+    Seconds are the best of `repeat` runs. Time and memory are measured in
+    separate runs, tracemalloc would skew the timings.
+    """
+    seconds = {phase: float("inf") for phase in Locator.PHASES}
+    for _ in range(repeat):
+        locator = Locator(SHAPES[shape](size), layout=layout)
+        gc.collect()
+        for phase in Locator.PHASES:
+            start = time.perf_counter()
+            getattr(locator, phase)()
+            seconds[phase] = min(seconds[phase], time.perf_counter() - start)
+
+    peaks = {}
+    locator = Locator(SHAPES[shape](size), layout=layout)
+    tracemalloc.start()
+    try:
+        for phase in Locator.PHASES:
+            tracemalloc.reset_peak()
+            base, _ = tracemalloc.get_traced_memory()
+            getattr(locator, phase)()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks[phase] = peak - base
+    finally:
+        tracemalloc.stop()
+    return {phase: (seconds[phase], peaks[phase]) for phase in Locator.PHASES}
+
+def growth_exponent(sizes: list, values: list) -> float:
+    """Empirical exponent k of t ~ n^k, least-squares slope in log-log space."""
+    points = [(math.log(n), math.log(v)) for n, v in zip(sizes, values) if v > 0]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if var_x == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stress LD.Locate with generated LD bodies and report time/memory per phase."
+    )
+    parser.add_argument(
+        '-s', '--sizes',
+        type=int,
+        nargs='+',
+        default=DEFAULT_SIZES,
+        help='Number of LD elements per run (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--shapes',
+        nargs='+',
+        default=list(SHAPES),
+        choices=list(SHAPES),
+        help='Body shapes to generate (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-l', '--layout',
+        default=DEFAULT_LAYOUT,
+        choices=sorted(LAYOUT_ENGINES),
+        help='Layout engine used by the locator (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--max-exponent',
+        type=float,
+        default=DEFAULT_MAX_EXPONENT,
+        help='Fail when a phase grows faster than n^k over the measured sizes (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help='Timing runs per size, the best one is reported (default: %(default)s)'
+    )
+    args = parser.parse_args()
+    for name in ("LD.Locate.Locate", "LD.Locate.layout"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    sizes = sorted(args.sizes)
+    regressions = []
+    print(f"{'shape':>9} {'phase':>21} " + " ".join(f"{f'n={n}':>18}" for n in sizes) + f" {'k':>6}")
+    for shape in args.shapes:
+        results = {size: measure(shape, size, args.layout, args.repeat) for size in sizes}
+        for phase in Locator.PHASES:
+            cells = " ".join(
+                f"{results[n][phase][0] * 1000:>8.2f}ms {results[n][phase][1] / 1024:>6.0f}K" for n in sizes
+            )
+            exponent = growth_exponent(sizes, [results[n][phase][0] for n in sizes])
+            flag = " !" if exponent > args.max_exponent else ""
+            print(f"{shape:>9} {phase:>21} {cells} {exponent:>6.2f}{flag}")
+            if flag:
+                regressions.append((shape, phase, exponent))
+    if regressions:
+        for shape, phase, exponent in regressions:
+            print(f"super-linear growth: {shape}/{phase} k={exponent:.2f}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
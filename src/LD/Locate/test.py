@@ -4,6 +4,9 @@ import argparse
 
 import xml.etree.ElementTree as ET
 from LD.Locate.Locate import Locator
+from LD.Locate.layout import LAYOUT_ENGINES, DEFAULT_LAYOUT
+from LD.Locate.normalize import REQUIRED_SPEC, SchemaNormalizer
+from Utils.plcxml import FRAGMENT_NAMESPACES, tostring
 
 DEFAULT_INPUT = 'LD/Inters/intermediate.xml'
 DEFAULT_OUTPUT = 'LD/Outputs/LD_CONVERTED.xml'
@@ -89,86 +92,7 @@ xml_string = '''<pou name="program0" pouType="program">
         </body>
       </pou>'''
 
-REQUIRED_SPEC = {
-    'block': {
-        'attributes': {
-            'typeName': 'undefined',
-            'localId': 'undefined'
-        },
-        'children': {
-            'position': {
-                'attributes': {},
-                'children': {}  # No required grandchildren in this example.
-            },
-            'inputVariables': {
-                'attributes': {},
-                'children': {}  # Could add default structure for variables if needed.
-            },
-            'inOutVariables': {
-                'attributes': {},
-                'children': {}
-            },
-            'outputVariables': {
-                'attributes': {},
-                'children': {}
-            }
-        },
-        'order': ['position', 'inputVariables', 'inOutVariables', 'outputVariables']
-    },
-    # You can add specs for other element types if needed.
-}
-
-def ensure_required_structure(elem: ET.Element, spec: dict):
-    """
-    Check an element against a specification (spec) and add missing attributes/children.
-    The spec is expected to be a dict with 'attributes' and 'children' keys.
-    """
-    # Ensure required attributes
-    required_attrs = spec.get('attributes', {})
-    for attr, default_val in required_attrs.items():
-        if attr not in elem.attrib:
-            logger.debug(f"Adding missing attribute '{attr}' to <{elem.tag}> with default value '{default_val}'.")
-            elem.attrib[attr] = default_val
-
-    # Ensure required children
-    # The logic below ensures that the children are in the correct order, UNDER THE assumption that every child in the 'order' ONLY APPEAR ONCE!
-    required_children = spec.get('children', {})
-    for child_tag, child_spec in required_children.items():
-        child = elem.find(child_tag)
-        if child is None:
-            logger.debug(f"Adding missing child <{child_tag}> to <{elem.tag}>.")
-            child = ET.Element(child_tag)
-            # get the index of current child
-            index = spec['order'].index(child_tag)
-            # Set default attributes for the new child.
-            for a, default_val in child_spec.get('attributes', {}).items():
-                child.attrib[a] = default_val
-            # insert the newly created child at suitable index
-            elem.insert(index, child)
-        # Recursively ensure the structure for the child element.
-        ensure_required_structure(child, child_spec)
-
-def patch_tree(root: ET.Element, spec_map: dict):
-    """
-    Recursively walk through the XML tree.
-    For every element whose tag appears in spec_map,
-    enforce the required structure.
-    """
-    # check if current element's tag is comment
-    # if so, remove current element
-    # WARN: temporary solution, should have another function doing post-processing job
-    if root.tag == 'LD':
-        for child in root:
-            if child.tag == 'comment':
-                root.remove(child)
-        
-
-    if root.tag in spec_map:
-        ensure_required_structure(root, spec_map[root.tag])
-    for child in root:
-        patch_tree(child, spec_map)
-
-def process_xml(input_file, output_file):
+def process_xml(input_file, output_file, layout=DEFAULT_LAYOUT):
     # Read the XML (either from a file or a string)
     
     with open(input_file, 'r', encoding='utf-8') as f:
@@ -177,13 +101,13 @@ def process_xml(input_file, output_file):
     root = ET.fromstring(xml_string.strip())
     ld = root.find("body").find("LD")
     assert(ld is not None)
-    locator = Locator(ld)
+    locator = Locator(ld, layout=layout)
     locator.locate()
-    patch_tree(root, REQUIRED_SPEC)
+    SchemaNormalizer(REQUIRED_SPEC).normalize(root)
 
     # clear the file and write the new content
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(ET.tostring(root, encoding='unicode').strip())
+    with open(output_file, 'wb') as f:
+        f.write(tostring(root, FRAGMENT_NAMESPACES).strip())
 
 def main():
     parser = argparse.ArgumentParser(
@@ -199,11 +123,17 @@ def main():
         default=DEFAULT_OUTPUT,
         help='Output XML file path (default: %(default)s)'
     )
+    parser.add_argument(
+        '-l', '--layout',
+        default=DEFAULT_LAYOUT,
+        choices=sorted(LAYOUT_ENGINES),
+        help='Layout engine used to place LD elements (default: %(default)s)'
+    )
     args = parser.parse_args()
     if args.input != DEFAULT_INPUT and args.output == DEFAULT_OUTPUT:
         args.output = args.input.replace("_intermediate", "_out").replace("Inters", "Outputs")
         logger.debug(f"Output file path: {args.output}")
-    process_xml(args.input, args.output)
+    process_xml(args.input, args.output, args.layout)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
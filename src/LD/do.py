@@ -2,6 +2,9 @@ import os
 import sys
 import subprocess
 import glob
+from concurrent.futures import ThreadPoolExecutor
+
+from Utils.memory import cap_workers, current_rss, format_size, max_memory_from_env, peak_rss
 
 from Logs.colorLogger import get_color_logger
 logger = get_color_logger("LD")
@@ -10,25 +13,42 @@ logger = get_color_logger("LD")
 # Get the list of files in "LD/Inters" matching the pattern "T_*.xml"
 files = glob.glob("LD/Inputs/T_*.xml")
 
+def convert(full_path):
+  """Run the three LD steps of one POU, each in its own interpreter."""
+  # Extract just the filename (e.g., "T_xxxx.xml") from the full path
+  filename = os.path.basename(full_path)
+  logger.info(f"Processing {filename}")
+
+  # Step 1: Call LD/preprocess.py with argument --input T_xxxx.xml
+  subprocess.run([sys.executable, "LD/preprocess.py", "--input", full_path])
+
+  # Step 2: Call LD/Block/test.py with argument --input T_xxxx.xml
+  # path changed to "LD/Inters/T_xxxx_preprocess.xml"
+  path = full_path.replace("Inputs", "Inters").replace(".xml", "_preprocess.xml")
+  logger.debug(f"Calling Block/test.py with {path}")
+  subprocess.run([sys.executable, "LD/Block/test.py", "--input", path])
+
+  # Step 3: Call LD/Locate/test.py with argument --input T_xxxx.xml
+  # path changed to "LD/Inters/T_xxxx_intermediate.xml"
+  path = full_path.replace("Inputs", "Inters").replace(".xml", "_intermediate.xml")
+  logger.debug(f"Calling Locate/test.py with {path}")
+  subprocess.run([sys.executable, "LD/Locate/test.py", "--input", path])
+  # the last step writes the POU in its final form, Stage3 only concatenates it
+  return path.replace("_intermediate", "_out").replace("Inters", "Outputs")
+
 # Iterate over each file found
-def main():
-  for full_path in files:
-      # Extract just the filename (e.g., "T_xxxx.xml") from the full path
-      filename = os.path.basename(full_path)
-      logger.info(f"Processing {filename}")
-      
-      # Step 1: Call LD/preprocess.py with argument --input T_xxxx.xml
-      subprocess.run([sys.executable, "LD/preprocess.py", "--input", full_path])
-      
-      # Step 2: Call LD/Block/test.py with argument --input T_xxxx.xml
-      # path changed to "LD/Inters/T_xxxx_preprocess.xml"
-      path = full_path.replace("Inputs", "Inters").replace(".xml", "_preprocess.xml")
-      logger.debug(f"Calling Block/test.py with {path}")
-      subprocess.run([sys.executable, "LD/Block/test.py", "--input", path])
-      
-      # Step 3: Call LD/Locate/test.py with argument --input T_xxxx.xml
-      # path changed to "LD/Inters/T_xxxx_intermediate.xml"
-      path = full_path.replace("Inputs", "Inters").replace(".xml", "_intermediate.xml")
-      logger.debug(f"Calling Locate/test.py with {path}")
-      subprocess.run([sys.executable, "LD/Locate/test.py", "--input", path])
+def main(jobs=None, max_memory=None):
+  pending = files
+  max_memory = max_memory or max_memory_from_env()
+  if max_memory and pending:
+    # one POU alone first, its largest step is what every concurrent POU may need
+    convert(pending[0])
+    pending = pending[1:]
+    jobs = cap_workers(max_memory, current_rss(), peak_rss(children=True), jobs)
+    logger.info(f"Peak {format_size(peak_rss(children=True))} per POU, {jobs} concurrent POU(s) fit in {format_size(max_memory)}")
 
+  # POUs only share read-only inputs, their steps run concurrently; the work
+  # is done in the child interpreters, so threads are enough to drive them
+  with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+    for output in pool.map(convert, pending):
+      logger.debug(f"Converted {output}")
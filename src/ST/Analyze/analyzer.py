@@ -0,0 +1,228 @@
+# analyzer.py
+# Parse-tree analysis of POU bodies for ST/syntax.py: one LALR parse of the
+# body, then variables and calls are read off the tree instead of being
+# guessed from neighbouring tokens. Named POUs are reparsed incrementally:
+# only the top level statements that changed since the last run are parsed.
+import gc
+from contextlib import contextmanager
+from typing import Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from lark import Tree, Token as LarkToken
+from lark.exceptions import LarkError
+
+from data.Lex.keywords import ST_BLOCK_END_KEYWORDS
+from ST.Analyze.cache import TreeCache, body_key, chunk_key, index_key, pack_tree
+from ST.Analyze.parse import TypeAnnotator, get_st_parser
+from ST.lexer import Token, KEYWORD, PUNCT, SKIPPED, tokenize
+
+from Logs.colorLogger import get_color_logger
+logger = get_color_logger("ST_Analyze")
+
+# A POU body is a statement list, declarations live in the XML interface
+BODY_START = "statement_list"
+CALL_RULES = ("function_call", "function_block_invocation")
+# nesting that keeps a ';' inside one top level statement
+BLOCK_OPENERS = frozenset(end[len("END_"):] for end in ST_BLOCK_END_KEYWORDS)
+BLOCK_CLOSERS = frozenset(ST_BLOCK_END_KEYWORDS)
+
+class BodyAnalysis(NamedTuple):
+    variables: List[str]    # identifiers used as variables, in order of first use
+    calls: List[str]        # names called as functions/FBs, in order of first call
+    statements: int
+
+def normalize_body(tokens: Iterable[Token]) -> str:
+    """
+    Body text without comments and layout: every whitespace/comment run
+    becomes one space, so bodies that differ only there share a cache entry.
+    Parse tree positions refer to this text.
+    """
+    pieces = []
+    gap = False
+    for tok in tokens:
+        if tok.kind in SKIPPED:
+            gap = True
+            continue
+        if gap and pieces:
+            pieces.append(" ")
+        gap = False
+        pieces.append(tok.text)
+    return "".join(pieces)
+
+@contextmanager
+def gc_paused():
+    """
+    Lark trees hold no reference cycles, but every full collection during a
+    parse rescans the growing tree, which makes large bodies super-linear.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+def split_statements(tokens: Iterable[Token]) -> List[List[Token]]:
+    """
+    Split a token stream at top level statement boundaries, i.e. at every ';'
+    outside brackets and IF/CASE/FOR/WHILE/REPEAT blocks. Whitespace, comments
+    and empty statements before a statement belong to it, which keeps the
+    concatenated chunk trees equal to the tree of the whole body.
+    """
+    chunks, current = [], []
+    depth = 0
+    empty = True
+    for tok in tokens:
+        current.append(tok)
+        if tok.kind in SKIPPED:
+            continue
+        if tok.kind == KEYWORD:
+            word = tok.text.upper()
+            if word in BLOCK_OPENERS:
+                depth += 1
+            elif word in BLOCK_CLOSERS:
+                depth -= 1
+        elif tok.kind == PUNCT:
+            if tok.text in "([":
+                depth += 1
+            elif tok.text in ")]":
+                depth -= 1
+            elif tok.text == ";":
+                if depth == 0 and not empty:
+                    chunks.append(current)
+                    current = []
+                    empty = True
+                continue
+        empty = False
+    if any(tok.kind not in SKIPPED for tok in current):
+        chunks.append(current)
+    return chunks
+
+def merge_analyses(analyses: Iterable[BodyAnalysis]) -> BodyAnalysis:
+    """Analysis of consecutive statement lists, first-use order is kept across them."""
+    variables, calls = [], []
+    seen_vars, seen_calls = set(), set()
+    statements = 0
+    for analysis in analyses:
+        for name in analysis.variables:
+            _add(variables, seen_vars, name)
+        for name in analysis.calls:
+            _add(calls, seen_calls, name)
+        statements += analysis.statements
+    return BodyAnalysis(variables, calls, statements)
+
+def _normalized(code: Union[str, List[Token]]) -> str:
+    return normalize_body(tokenize(code) if isinstance(code, str) else code)
+
+def parse_body(code: Union[str, List[Token]]) -> Tree:
+    with gc_paused():
+        return get_st_parser().parse(_normalized(code), start=BODY_START)
+
+def annotate_body(code: Union[str, List[Token]], symbol_table) -> Tuple[Tree, TypeAnnotator]:
+    """Parse a POU body and annotate it in place against the POU's symbol table."""
+    tree = parse_body(code)
+    with gc_paused():
+        return tree, TypeAnnotator(symbol_table).annotate(tree)
+
+def _add(names: List[str], seen: set, name: str) -> None:
+    if name not in seen:
+        seen.add(name)
+        names.append(name)
+
+def analyze_tree(tree: Tree) -> BodyAnalysis:
+    """
+    Walk the tree once in source order. The root identifier of every
+    variable_access is a variable unless it is the plain name of a call,
+    member names (a.b), parameter names (p := x, q => y) are skipped.
+    """
+    variables, calls = [], []
+    seen_vars, seen_calls = set(), set()
+    statements = 0
+    stack = [(tree, None)]
+    while stack:
+        node, parent = stack.pop()
+        if node.data == "statement":
+            statements += 1
+        elif node.data == "variable_access":
+            root = node.children[0]
+            is_callee = parent is not None and parent.data in CALL_RULES and parent.children[0] is node
+            if is_callee and len(node.children) == 1:
+                _add(calls, seen_calls, root.value)
+            else:
+                _add(variables, seen_vars, root.value)
+        elif node.data in ("for_statement", "case_value"):
+            for child in node.children:
+                if isinstance(child, LarkToken) and child.type == "IDENTIFIER":
+                    _add(variables, seen_vars, child.value)
+        for child in reversed(node.children):
+            if isinstance(child, Tree):
+                stack.append((child, node))
+    return BodyAnalysis(variables, calls, statements)
+
+def analyze_chunks(tokens: List[Token], cache: TreeCache, name: str) -> Optional[Tuple[tuple, BodyAnalysis]]:
+    """
+    Incremental analysis of the body of POU `name`: the chunk index of the
+    previous run maps every top level statement (by hash) to its packed tree
+    and analysis, only new or edited statements are parsed. Returns the packed
+    tree of the whole body and its analysis, None if a statement does not
+    parse on its own.
+    """
+    chunks = split_statements(tokens)
+    with gc_paused():
+        previous = cache.get(index_key(name)) or {}
+        index = {}
+        statements = []
+        analyses = []
+        parsed = 0
+        for chunk in chunks:
+            normalized = normalize_body(chunk)
+            key = chunk_key(normalized)
+            entry = index.get(key) or previous.get(key)
+            if entry is None:
+                try:
+                    tree = get_st_parser().parse(normalized, start=BODY_START)
+                except LarkError:
+                    return None
+                entry = (pack_tree(tree), analyze_tree(tree))
+                parsed += 1
+            index[key] = entry
+            statements.extend(entry[0][1])
+            analyses.append(entry[1])
+        if parsed or index.keys() != previous.keys():
+            cache.put(index_key(name), index)
+    logger.debug(f"Parsed {parsed} of {len(chunks)} statements of {name}")
+    return (BODY_START, tuple(statements)), merge_analyses(analyses)
+
+def analyze_body(code: Union[str, List[Token]], cache: Optional[TreeCache] = None,
+                 name: Optional[str] = None) -> Optional[BodyAnalysis]:
+    """
+    Analyze a POU body, returns None when the body is outside the grammar so
+    the caller can fall back to the token based heuristics. With a cache the
+    analysis (or the parse failure) is looked up first and the packed tree is
+    stored next to it. With a POU name as well, the body is analyzed
+    incrementally against the chunk index of the previous run of that POU.
+    """
+    tokens = tokenize(code) if isinstance(code, str) else code
+    if cache is not None and name is not None:
+        result = analyze_chunks(tokens, cache, name)
+        if result is not None:
+            return result[1]
+    normalized = normalize_body(tokens)
+    key = body_key(normalized) if cache is not None else None
+    if key is not None:
+        with gc_paused():
+            cached = cache.get(key)
+        if cached is not None:
+            return cached[1]
+    try:
+        with gc_paused():
+            tree = get_st_parser().parse(normalized, start=BODY_START)
+    except LarkError as e:
+        logger.debug(f"Body not parsed: {str(e).splitlines()[0]}")
+        tree = analysis = None
+    else:
+        analysis = analyze_tree(tree)
+    if key is not None:
+        with gc_paused():
+            cache.put(key, (pack_tree(tree), analysis))
+    return analysis
@@ -0,0 +1,187 @@
+import sys
+sys.path.append('..')
+sys.path.append('../..')
+import argparse
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from lark import Transformer
+
+from ST.Analyze.analyzer import analyze_body, gc_paused, parse_body
+from ST.Analyze.cache import TreeCache
+from ST.Analyze.parse import ElementaryType, Symbol, SymbolTable, TypeAnnotator, parser_cache_path
+from ST.lexer import tokenize
+from ST.syntax import extract_variable_identifiers, find_non_standard_functions
+
+DEFAULT_SIZES = [1000, 10000, 50000]
+DEFAULT_SEED = 0
+DEFAULT_REPEAT = 3
+DEFAULT_MEMORY_SIZE = 10000
+
+# One statement per template, {v} are variables, {f} user functions, {b} FB instances
+STATEMENTS = [
+    "{v0} := {v1} + {v2} * 2;",
+    "{v0} := {f}({v1}, P := {v2});",
+    "IF {v0} > {v1} AND NOT {v2} THEN {v1} := {v0}; ELSE {v1} := 0; END_IF;",
+    "{b}(IN := {v0}, PT := T#100ms, Q => {v1});",
+    "{v0}.x := MAX({v1}, {v2}); (* member access *)",
+    "FOR {v0} := 0 TO 10 BY 2 DO {v1}[{v0}] := {v2}; END_FOR;",
+    "CASE {v0} OF 1: {v1} := 'on'; 2..5: {v1} := 'off'; END_CASE;",
+    "WHILE {v0} < {v1} DO {v0} := {v0} + 1; END_WHILE;",
+]
+
+def generate_body(size: int, seed: int = DEFAULT_SEED, names: int = 200) -> str:
+    """ST body of `size` top level statements built from STATEMENTS."""
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(size):
+        template = rng.choice(STATEMENTS)
+        v0, v1, v2 = (f"var{rng.randrange(names)}" for _ in range(3))
+        lines.append(template.format(
+            v0=v0, v1=v1, v2=v2,
+            f=f"func{rng.randrange(names // 10)}",
+            b=f"fb{rng.randrange(names // 10)}",
+        ))
+    return "\n".join(lines)
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def run(size: int, seed: int = DEFAULT_SEED, repeat: int = DEFAULT_REPEAT) -> dict:
+    code = generate_body(size, seed)
+
+    def tree_path():
+        return analyze_body(tokenize(code))
+
+    def token_path():
+        tokens = tokenize(code)
+        extract_variable_identifiers(tokens)
+        find_non_standard_functions(tokens)
+
+    analysis = tree_path()
+    if analysis is None:
+        raise RuntimeError("generated body is outside the grammar")
+    tree_seconds = _best(tree_path, repeat)
+    token_seconds = _best(token_path, repeat)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = TreeCache(cache_dir)
+        analyze_body(tokenize(code), cache)
+        cached_seconds = _best(lambda: analyze_body(tokenize(code), cache), repeat)
+        # incremental reparse of a POU after one top level statement was edited
+        analyze_body(tokenize(code), cache, "BENCH")
+        edits = iter(range(repeat))
+        edit_seconds = _best(lambda: analyze_body(tokenize(f"var0 := {next(edits)};\n" + code), cache, "BENCH"), repeat)
+    return {
+        "size": size,
+        "statements": analysis.statements,
+        "tree": analysis.statements / tree_seconds,
+        "cached": analysis.statements / cached_seconds,
+        "token": analysis.statements / token_seconds,
+        "edit": edit_seconds,
+    }
+
+# First use of the parser in a fresh process, as in one ST/syntax.py run per POU
+COLD_START_SCRIPT = (
+    "from ST.Analyze.parse import get_st_parser; "
+    "get_st_parser(cache={cache}).parse('a := 1;', start='statement_list')"
+)
+
+def cold_start(cache: bool, repeat: int = DEFAULT_REPEAT) -> float:
+    """Best wall time of a new interpreter importing the parser and parsing one statement."""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(os.path.abspath(p) for p in sys.path if p))
+    command = [sys.executable, "-c", COLD_START_SCRIPT.format(cache=cache)]
+    if cache:
+        # make sure the tables exist, the first cached run compiles them
+        subprocess.run(command, env=env, check=True)
+    return _best(lambda: subprocess.run(command, env=env, check=True), repeat)
+
+def _traced(fn):
+    """Result of fn and the peak memory it allocated on top of what was live before, in MiB."""
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    return result, (tracemalloc.get_traced_memory()[1] - before) / 2**20
+
+def memory(size: int = DEFAULT_MEMORY_SIZE, seed: int = DEFAULT_SEED, names: int = 200) -> dict:
+    """Peak memory of parsing a generated body, annotating it in place, and of a full tree copy."""
+    code = generate_body(size, seed, names)
+    symbols = SymbolTable().local("BENCH")
+    for i in range(names):
+        symbols.current_scope.add_symbol(Symbol(f"var{i}", ElementaryType("INT"), "variable"))
+    tracemalloc.start()
+    try:
+        tree, parse_mib = _traced(lambda: parse_body(code))
+        with gc_paused():
+            _, annotate_mib = _traced(lambda: TypeAnnotator(symbols).annotate(tree))
+            # what a Transformer based annotation allocates before doing any typing
+            _, copy_mib = _traced(lambda: Transformer().transform(tree))
+    finally:
+        tracemalloc.stop()
+    return {"size": size, "parse": parse_mib, "annotate": annotate_mib, "copy": copy_mib}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark ST body analysis (parse tree, cached parse tree, token heuristics) in statements per second."
+    )
+    parser.add_argument(
+        '-s', '--sizes',
+        type=int,
+        nargs='+',
+        default=DEFAULT_SIZES,
+        help='Top level statements per generated body (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=DEFAULT_SEED,
+        help='Random seed of the body generator (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-r', '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help='Timing runs per size, the best one is reported (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--cold-start',
+        action='store_true',
+        help='Also measure parser start-up in a fresh process, compiled grammar vs cached tables'
+    )
+    parser.add_argument(
+        '--memory',
+        type=int,
+        nargs='?',
+        const=DEFAULT_MEMORY_SIZE,
+        metavar='SIZE',
+        help=f'Also measure peak memory of parsing and annotating a SIZE statement body (default: {DEFAULT_MEMORY_SIZE})'
+    )
+    args = parser.parse_args()
+    if args.memory:
+        result = memory(args.memory, args.seed)
+        print(f"memory ({result['size']} statements): parse tree {result['parse']:.1f} MiB, "
+              f"in-place annotation +{result['annotate']:.1f} MiB, full tree copy +{result['copy']:.1f} MiB")
+    if args.cold_start:
+        baseline = _best(lambda: subprocess.run([sys.executable, "-c", "pass"], check=True), args.repeat)
+        compiled = cold_start(False, args.repeat)
+        cached = cold_start(True, args.repeat)
+        print(f"cold start (interpreter {baseline:.3f}s): compile {compiled:.3f}s, cached tables {cached:.3f}s")
+        print(f"table cache: {parser_cache_path()}")
+    for name in ("ST_Syntax", "ST_Analyze", "TOKEN"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    print(f"{'size':>8} {'statements':>11} {'tree stmt/s':>12} {'cached stmt/s':>14} {'token stmt/s':>13} {'one edit s':>11}")
+    for size in args.sizes:
+        result = run(size, args.seed, args.repeat)
+        print(f"{result['size']:>8} {result['statements']:>11} {result['tree']:>12.0f} {result['cached']:>14.0f} {result['token']:>13.0f} {result['edit']:>11.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+# cache.py
+# On-disk cache of ST body parses. Library FBs (MC_MoveVelocity, MC_Halt, ...)
+# come back in every project, so the parse tree and its analysis are stored
+# under a hash of the normalized body and the grammar version; a hit skips
+# the parser entirely. Trees are stored as nested tuples, which pickle an
+# order of magnitude smaller and faster than lark's Tree/Token objects.
+import glob
+import hashlib
+import os
+import pickle
+import tempfile
+import zlib
+from typing import Any, List, Optional, Tuple
+
+from lark import Tree, Token
+
+from ST.Analyze.parse import grammar_hash
+
+from Logs.colorLogger import get_color_logger
+logger = get_color_logger("ST_Cache")
+
+DEFAULT_CACHE_DIR = "../data/Inters/st_tree_cache"
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# pruning goes down to this share of max_bytes, so a full cache is not
+# scanned again on the next put
+PRUNE_TO = 0.9
+ENTRY_SUFFIX = ".tree"
+
+def body_key(normalized: str) -> str:
+    """Cache key of a normalized body, a grammar change invalidates every entry."""
+    digest = hashlib.sha256(grammar_hash().encode("ascii"))
+    digest.update(b"\0")
+    digest.update(normalized.encode("utf-8"))
+    return digest.hexdigest()
+
+def chunk_key(normalized: str) -> str:
+    """Key of one top level statement inside a chunk index, the index key carries the grammar."""
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def index_key(name: str) -> str:
+    """Cache key of the chunk index of a POU, used to reparse only its edited statements."""
+    return body_key("\0chunks\0" + name)
+
+def pack_tree(node: Optional[Tree]) -> Optional[Tuple]:
+    """(rule, children) for rules, (terminal type, text) for tokens, None for empty [optionals]."""
+    if isinstance(node, Tree):
+        return (node.data, tuple(pack_tree(child) for child in node.children))
+    if node is None:
+        return None
+    return (node.type, str(node))
+
+def unpack_tree(packed: Optional[Tuple]) -> Optional[Tree]:
+    """Inverse of pack_tree (token positions are not kept)."""
+    if packed is None:
+        return None
+    data, children = packed
+    if isinstance(children, str):
+        return Token(data, children)
+    return Tree(data, [unpack_tree(child) for child in children])
+
+class TreeCache:
+    """
+    One zlib-compressed pickle per body. The total size is bounded by
+    max_bytes, least recently used entries (by mtime, refreshed on every
+    hit) are evicted first. Entries are written atomically, so processes
+    can share the directory.
+    The size of the directory is read once and then kept up to date with
+    what this process writes and removes, the directory is only scanned
+    again when it goes over max_bytes. Entries written by other processes
+    are seen by that scan, a run over several processes prunes once more
+    at its end (ST/do.py).
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size: Optional[int] = None
+
+    def __repr__(self):
+        return f"TreeCache({self.path!r}, max_bytes={self.max_bytes}, hits={self.hits}, misses={self.misses})"
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.path, key + ENTRY_SUFFIX)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entry(key)
+        try:
+            with open(entry, "rb") as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+            os.utime(entry)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError, AttributeError) as e:
+            # truncated or written by an incompatible version, parse again
+            logger.debug(f"Dropping unreadable cache entry {entry}: {e}")
+            self._discard(entry)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if len(data) > self.max_bytes:
+            return
+        entry = self._entry(key)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self._scan())
+            try:
+                replaced = os.path.getsize(entry)
+            except FileNotFoundError:
+                replaced = 0
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, entry)
+        except OSError as e:
+            logger.warning(f"Could not write parse cache entry to {self.path}: {e}")
+            return
+        self.size += len(data) - replaced
+        if self.size > self.max_bytes:
+            self.prune()
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """(mtime, size, path) of every entry."""
+        entries = []
+        for entry in glob.glob(os.path.join(self.path, "*" + ENTRY_SUFFIX)):
+            try:
+                stat = os.stat(entry)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry))
+        return entries
+
+    def prune(self) -> None:
+        """Evict least recently used entries until the cache fits in PRUNE_TO of max_bytes."""
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            self.size = total
+            return
+        entries.sort()
+        for _, size, entry in entries:
+            if total <= self.max_bytes * PRUNE_TO:
+                break
+            self._remove(entry)
+            total -= size
+        self.size = total
+
+    def clear(self) -> None:
+        for entry in glob.glob(os.path.join(self.path, "*" + ENTRY_SUFFIX)):
+            self._remove(entry)
+        self.size = 0
+
+    def _discard(self, entry: str) -> None:
+        try:
+            size = os.path.getsize(entry)
+        except OSError:
+            return
+        self._remove(entry)
+        if self.size is not None:
+            self.size = max(0, self.size - size)
+
+    @staticmethod
+    def _remove(entry: str) -> None:
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
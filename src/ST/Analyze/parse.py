@@ -1,4 +1,11 @@
-from lark import Lark, Transformer, Visitor, Tree, Token
+import copy
+import glob
+import hashlib
+import os
+from functools import lru_cache
+
+import lark
+from lark import Lark, Visitor, Tree, Token
 from lark.visitors import v_args # For decorating visitor methods
 
 # Assume st_grammar_string contains the full Lark grammar for ST
@@ -49,24 +56,25 @@ function_declaration : FUNCTION_KW IDENTIFIER COLON type_specifier declaration_s
                | statement (SEMICOLON statement)* SEMICOLON? 
     statement : assignment_statement | if_statement | case_statement | for_statement | while_statement | repeat_statement | function_block_invocation | return_statement | exit_statement | null_statement
     assignment_statement : variable_access ASSIGN expression
-    if_statement : IF_KW expression THEN_KW statement_list (ELSIF_KW expression THEN_KW statement_list)* END_IF_KW 
-    case_statement : CASE_KW expression OF_KW case_element* END_CASE_KW 
+    if_statement : IF_KW expression THEN_KW statement_list (ELSIF_KW expression THEN_KW statement_list)* (ELSE_KW statement_list)? END_IF_KW
+    case_statement : CASE_KW expression OF_KW case_element* (ELSE_KW statement_list)? END_CASE_KW
     case_element : case_list COLON statement_list
     case_list : case_value (COMMA case_value)*
-    case_value : literal | IDENTIFIER | literal ".." literal
-    for_statement : FOR_KW IDENTIFIER ASSIGN expression TO_KW expression? DO_KW statement_list END_FOR_KW
+    case_value : literal | IDENTIFIER | literal DOUBLE_DOT literal
+    for_statement : FOR_KW IDENTIFIER ASSIGN expression TO_KW expression (BY_KW expression)? DO_KW statement_list END_FOR_KW
     while_statement : WHILE_KW expression DO_KW statement_list END_WHILE_KW
     repeat_statement : REPEAT_KW statement_list UNTIL_KW expression END_REPEAT_KW
     exit_statement : EXIT_KW
     return_statement : RETURN_KW
     null_statement : SEMICOLON
-    function_block_invocation : IDENTIFIER LPAREN [param_assignment_list] RPAREN
+    // callee is a variable_access so fb.Method() and arr[i]() are invocations too
+    function_block_invocation : variable_access LPAREN [param_assignment_list] RPAREN
 
     // --- Expressions ---
     expression : or_expression
     or_expression : xor_expression (OR_OP xor_expression)*
     xor_expression : and_expression (XOR_OP and_expression)*
-    and_expression : comparison_expression (AND_OP comparison_expression)* // Renamed to avoid conflict with 'comparison' terminal name if any
+    and_expression : comparison_expression ((AND_OP | AMPERSAND) comparison_expression)* // Renamed to avoid conflict with 'comparison' terminal name if any
     comparison_expression : equality_expression ( (EQ | NE) equality_expression )* // Renamed
     equality_expression : relational_expression ( (LT | GT | LE | GE) relational_expression )* // Renamed
     relational_expression : add_expression // Placeholder, was equ_expression
@@ -77,21 +85,19 @@ function_declaration : FUNCTION_KW IDENTIFIER COLON type_specifier declaration_s
     primary_expression : literal | variable_access | function_call | LPAREN expression RPAREN
 
     literal : typed_literal | untyped_literal
-    typed_literal : (SINT_KW | INT_KW | DINT_KW | LINT_KW | USINT_KW | UINT_KW | UDINT_KW | ULINT_KW) HASH SIGNED_NUMBER -> typed_integer_literal
-| (REAL_KW | LREAL_KW) HASH SIGNED_NUMBER -> typed_real_literal
-| (TIME_KW) HASH TIME_VALUE -> typed_time_literal
-| (DATE_KW) HASH DATE_VALUE -> typed_date_literal
-| (TOD_KW) HASH TOD_VALUE -> typed_tod_literal
-| (DT_KW) HASH DT_VALUE -> typed_dt_literal
-| (BYTE_KW | WORD_KW | DWORD_KW | LWORD_KW) HASH (HEX_INTEGER | BIN_INTEGER | OCT_INTEGER | SIGNED_NUMBER) -> typed_bitstring_literal
-
-    untyped_literal : SIGNED_NUMBER -> integer_or_real_literal // Context will differentiate INT/REAL or default to one
-| BOOLEAN_LITERAL
+    // typed literals are single tokens (T#1s, INT#5, DT#2020-01-01-12:00), the prefix is a keyword otherwise
+    typed_literal : TYPED_INTEGER -> typed_integer_literal
+| TYPED_REAL -> typed_real_literal
+| TYPED_TIME -> typed_time_literal
+| TYPED_DATE -> typed_date_literal
+| TYPED_TOD -> typed_tod_literal
+| TYPED_DT -> typed_dt_literal
+| TYPED_BITSTRING -> typed_bitstring_literal
+
+    untyped_literal : REAL_NUMBER -> integer_or_real_literal // Context will differentiate INT/REAL or default to one
+| INTEGER -> integer_or_real_literal
+| (TRUE_KW | FALSE_KW) -> boolean_literal
 | STRING_LITERAL
-| TIME_VALUE -> time_literal
-| DATE_VALUE -> date_literal
-| TOD_VALUE -> tod_literal
-| DT_VALUE -> dt_literal
 | HEX_INTEGER -> hex_literal
 | BIN_INTEGER -> bin_literal
 | OCT_INTEGER -> oct_literal
@@ -102,9 +108,10 @@ function_declaration : FUNCTION_KW IDENTIFIER COLON type_specifier declaration_s
     struct_member_accessor : DOT IDENTIFIER
     expression_list : expression (COMMA expression)*
 
-    function_call : IDENTIFIER LPAREN [param_assignment_list] RPAREN
+    function_call : variable_access LPAREN [param_assignment_list] RPAREN
     param_assignment_list : param_assignment (COMMA param_assignment)*
-    param_assignment : (IDENTIFIER ASSIGN)? expression 
+    param_assignment : (IDENTIFIER ASSIGN)? expression
+| NOT_OP? IDENTIFIER OUTPUT_ASSIGN variable_access -> output_assignment
 
     // --- Terminals ---
     PROGRAM_KW: "PROGRAM"i | "PROGRAMME"i
@@ -166,21 +173,23 @@ function_declaration : FUNCTION_KW IDENTIFIER COLON type_specifier declaration_s
     END_WHILE_KW: "END_WHILE"i
     REPEAT_KW: "REPEAT"i
     UNTIL_KW: "UNTIL"i
-    END_REPEAT_KW: "END_REPEAT_KW"i
+    END_REPEAT_KW: "END_REPEAT"i
     EXIT_KW: "EXIT"i
     RETURN_KW: "RETURN"i
 
     TRUE_KW: "TRUE"i
     FALSE_KW: "FALSE"i
-    BOOLEAN_LITERAL: TRUE_KW | FALSE_KW
 
     OR_OP: "OR"i
     XOR_OP: "XOR"i
-    AND_OP: "AND"i | "&"
+    // keywords must be plain strings, an alternation would lose against IDENTIFIER
+    AND_OP: "AND"i
+    AMPERSAND: "&"
     NOT_OP: "NOT"i
     MOD_OP: "MOD"i
 
     ASSIGN: ":="
+    OUTPUT_ASSIGN: "=>"
     ADD: "+"
     SUB: "-"
     MUL: "*"
@@ -204,22 +213,28 @@ function_declaration : FUNCTION_KW IDENTIFIER COLON type_specifier declaration_s
     HASH: "#"
     DOUBLE_DOT: ".." // For ranges like 1..10
 
-    %import common.SIGNED_NUMBER
-    %import common.ESCAPED_STRING -> STRING_LITERAL // Using alias for clarity
     %import common.WS
     %ignore WS
 
+    // IEC strings: '...' or "...", $ escapes the next character
+    STRING_LITERAL: /'(?:\$.|[^'$])*'|"(?:\$.|[^"$])*"/s
+
     IDENTIFIER: /[a-zA-Z_][a-zA-Z0-9_]*/
-    INTEGER_LITERAL: SIGNED_NUMBER // Lark's SIGNED_NUMBER can be int
+    // unsigned, the sign is a unary operator; no trailing '.' so 1..10 is a range
+    REAL_NUMBER: /[0-9][0-9_]*\.[0-9][0-9_]*(?:[eE][-+]?[0-9]+)?/
+    INTEGER: /[0-9][0-9_]*/
 
-TIME_VALUE: /(?:(?:[0-9]+)(?:[0-9]+[hH_])?(?:[0-9]+[mM_])?(?:[0-9]+)?(?:[0-9]+?)?|(?:[0-9]+[hH_])(?:[0-9]+[mM_])?(?:[0-9]+)?(?:[0-9]+?)?|(?:[0-9]+[mM_])(?:[0-9]+)?(?:[0-9]+?)?|(?:[0-9]+)(?:[0-9]+?)?|(?:[0-9]+?))/
-    DATE_VALUE: /[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}/
-    TOD_VALUE:  /[0-9]{1,2}:[0-9]{1,2}(:[0-9]{1,2}(\.[0-9]+)?)?/
-    DT_VALUE:   DATE_VALUE "-" TOD_VALUE
+    TYPED_INTEGER.2: /(?:SINT|INT|DINT|LINT|USINT|UINT|UDINT|ULINT)#[-+]?(?:(?:2|8|16)#)?[0-9a-fA-F_]+/i
+    TYPED_REAL.2: /(?:REAL|LREAL)#[-+]?[0-9][0-9_]*(?:\.[0-9_]+)?(?:[eE][-+]?[0-9]+)?/i
+    TYPED_TIME.2: /(?:T|TIME|LTIME|LT)#[-+]?[0-9a-zA-Z_.]+/i
+    TYPED_DATE.2: /(?:D|DATE|LDATE)#[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}/i
+    TYPED_TOD.2: /(?:TOD|TIME_OF_DAY|LTOD)#[0-9]{1,2}:[0-9]{1,2}(?::[0-9]{1,2}(?:\.[0-9]+)?)?/i
+    TYPED_DT.2: /(?:DT|DATE_AND_TIME|LDT)#[0-9]{4}-[0-9]{1,2}-[0-9]{1,2}-[0-9]{1,2}:[0-9]{1,2}(?::[0-9]{1,2}(?:\.[0-9]+)?)?/i
+    TYPED_BITSTRING.2: /(?:BOOL|BYTE|WORD|DWORD|LWORD)#(?:(?:2|8|16)#)?[0-9a-zA-Z_]+/i
 
-    HEX_INTEGER: /16#[0-9a-fA-F_]+/i
-    OCT_INTEGER: /8#[0-7_]+/i
-    BIN_INTEGER: /2#[01_]+/i
+    HEX_INTEGER.2: /16#[0-9a-fA-F_]+/i
+    OCT_INTEGER.2: /8#[0-7_]+/i
+    BIN_INTEGER.2: /2#[01_]+/i
 
 
     COMMENT_SL: "//" /.*/
@@ -228,7 +243,59 @@ TIME_VALUE: /(?:(?:[0-9]+)(?:[0-9]+[hH_])?(?:[0-9]+[mM_])?(?:[0-9]+)?(?:[0-9]+?)
     %ignore COMMENT_ML
 """
 
-st_parser = Lark(st_grammar_string, start='start', parser='lalr', lexer='contextual', keep_all_tokens=False)
+# 'start' parses whole POU sources, 'statement_list' the bodies found in PLCopen XML
+PARSER_OPTIONS = {
+    'start': ['start', 'statement_list'],
+    'parser': 'lalr',
+    'lexer': 'contextual',
+    'keep_all_tokens': False,
+}
+# Serialized LALR tables, one file per grammar hash next to the bytecode cache
+PARSER_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+PARSER_CACHE_PREFIX = "st_parser_"
+
+@lru_cache(maxsize=None)
+def grammar_hash(grammar: str = st_grammar_string) -> str:
+    """
+    Key of the table cache: grammar text, parser options and lark version.
+    """
+    key = "\n".join([grammar, repr(sorted(PARSER_OPTIONS.items())), lark.__version__])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+def parser_cache_path(grammar: str = st_grammar_string) -> str:
+    return os.path.join(PARSER_CACHE_DIR, f"{PARSER_CACHE_PREFIX}{grammar_hash(grammar)}.lark")
+
+def _prune_parser_cache(keep: str) -> None:
+    for path in glob.glob(os.path.join(PARSER_CACHE_DIR, f"{PARSER_CACHE_PREFIX}*.lark")):
+        if path != keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+@lru_cache(maxsize=None)
+def get_st_parser(cache: bool = True) -> Lark:
+    """
+    Build the parser on first use. With cache, the LALR tables are compiled
+    once per grammar version and later processes only unpickle them.
+    """
+    if not cache:
+        return Lark(st_grammar_string, **PARSER_OPTIONS)
+    path = parser_cache_path()
+    if not os.path.exists(path):
+        try:
+            os.makedirs(PARSER_CACHE_DIR, exist_ok=True)
+            _prune_parser_cache(keep=path)
+        except OSError:
+            # read-only install, compile without cache
+            return Lark(st_grammar_string, **PARSER_OPTIONS)
+    return Lark(st_grammar_string, cache=path, **PARSER_OPTIONS)
+
+def __getattr__(name):
+    # st_parser used to be built at import, keep the name but build it lazily
+    if name == "st_parser":
+        return get_st_parser()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 
@@ -247,8 +314,11 @@ class Scope:
         self.parent = parent
         self.name = name
         self.symbols = {} # name: Symbol
+        self.frozen = False # a frozen scope is shared (e.g. by worker processes) and read-only
 
     def add_symbol(self, symbol):
+        if self.frozen:
+            raise TypeError(f"Cannot add '{symbol.name}' to frozen scope '{self.name}'")
         if symbol.name in self.symbols:
             # Simple overwrite, or could raise an error for re-declaration
             pass
@@ -285,6 +355,17 @@ class SymbolTable:
         else:
             # Cannot exit global scope, or handle as error
             pass
+
+    def freeze(self):
+        """Make the global scope read-only, POU scopes are then built on top with local()."""
+        self.global_scope.frozen = True
+        return self
+
+    def local(self, name):
+        """Table sharing this global scope with a fresh scope for one POU."""
+        table = copy.copy(self)
+        table.current_scope = Scope(parent=self.global_scope, name=name)
+        return table
         
 class StDataType: # Base class for structured type information
     def __init__(self, name):
@@ -315,7 +396,7 @@ class PouType(StDataType): # For FBs/Functions used as types or for their signat
         super().__init__(name)
         self.pou_kind = pou_kind # "FUNCTION", "FUNCTION_BLOCK", "PROGRAM"
         self.return_type = return_type # StDataType_object or None
-        self.params = params if params else "fuck"
+        self.params = params if params else []
 
 
 class SymbolTableBuilder(Visitor):
@@ -422,324 +503,223 @@ class SymbolTableBuilder(Visitor):
 
         self.st.global_scope.add_symbol(Symbol(type_name, actual_type, 'type', location=type_name_token))
 
-@v_args(meta=True) # Provides meta (line/col info)
-class TypeAnnotator(Transformer):
+# typed literal prefix (before '#') -> type name, other prefixes are type names already
+LITERAL_PREFIXES = {
+    "T": "TIME", "LT": "LTIME", "D": "DATE", "TIME_OF_DAY": "TOD", "LTOD": "LTOD", "DATE_AND_TIME": "DT",
+}
+
+@lru_cache(maxsize=None)
+def elementary_type(name):
+    """Shared ElementaryType instance per name, annotations of large bodies reuse a handful of types."""
+    return ElementaryType(name)
+
+class TypeAnnotator(Visitor):
+    """
+    Bottom-up type annotation of a parse tree. The tree is not rebuilt: types
+    go into a side table keyed by node id (kept valid by holding the tree),
+    so annotating costs one dict entry per typed node instead of a second
+    tree. Wrapper rules (expression -> or_expression -> ... -> term) get no
+    entry, they have the type of their single operand. An annotator holds
+    the symbol table of one POU, use one per POU.
+    """
     def __init__(self, symbol_table):
         self.st = symbol_table
-        super().__init__()
-
-    def _get_node_type(self, node):
-        return getattr(node, 'st_type', ElementaryType("UNKNOWN"))
+        self.tree = None
+        self.types = {} # id(node): StDataType
+        self.assignments = {} # id(assignment_statement): (lhs type, rhs type)
+
+    def annotate(self, tree):
+        """
+        Post-order walk with a stack of child iterators, memory stays in the
+        depth of the tree (Visitor.visit lists every subtree first).
+        """
+        self.tree = tree
+        stack = [(tree, iter(tree.children))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if isinstance(child, Tree):
+                    stack.append((child, iter(child.children)))
+                    break
+            else:
+                stack.pop()
+                getattr(self, node.data, self.__default__)(node)
+        return self
+
+    def type_of(self, node):
+        while True:
+            st_type = self.types.get(id(node))
+            if st_type is not None:
+                return st_type
+            if not isinstance(node, Tree) or len(node.children) != 1:
+                return elementary_type("UNKNOWN")
+            node = node.children[0]
+
+    def _set(self, tree, st_type):
+        self.types[id(tree)] = st_type
 
     # --- Literal Handling ---
-    def typed_integer_literal(self, items, meta):
-        # (SINT_KW | INT_KW...) HASH SIGNED_NUMBER
-        type_kw_token = items.children # e.g. INT_KW token
-        type_name = type_kw_token.type.replace("_KW", "")
-        # value_token = items # SIGNED_NUMBER
-        # actual_value = int(value_token.value)
-        tree = Tree("typed_literal", items, meta=meta)
-        tree.st_type = ElementaryType(type_name)
-        return tree
-
-    def integer_or_real_literal(self, items, meta):
-        # SIGNED_NUMBER
-        value_str = items.value
-        tree = Tree("literal_value", items, meta=meta)
+    def _typed_literal(self, tree):
+        # single token, e.g. INT#5, T#1s, DT#2020-01-01-12:00
+        prefix = tree.children[0].value.split("#", 1)[0].upper()
+        self._set(tree, elementary_type(LITERAL_PREFIXES.get(prefix, prefix)))
+
+    typed_integer_literal = typed_real_literal = typed_time_literal = _typed_literal
+    typed_date_literal = typed_tod_literal = typed_dt_literal = typed_bitstring_literal = _typed_literal
+
+    def integer_or_real_literal(self, tree):
+        value_str = tree.children[0].value
         if '.' in value_str or 'e' in value_str.lower():
-            tree.st_type = ElementaryType("REAL") # Default untyped float to REAL
+            self._set(tree, elementary_type("REAL")) # Default untyped float to REAL
         else:
-            tree.st_type = ElementaryType("INT") # Default untyped int to INT
-        return tree
+            self._set(tree, elementary_type("INT")) # Default untyped int to INT
+
+    def _integer_literal(self, tree):
+        self._set(tree, elementary_type("INT"))
+
+    hex_literal = bin_literal = oct_literal = _integer_literal
 
-    def boolean_literal(self, items, meta):
-        tree = Tree("literal_value", items, meta=meta)
-        tree.st_type = ElementaryType("BOOL")
-        return tree
+    def boolean_literal(self, tree):
+        self._set(tree, elementary_type("BOOL"))
 
-    def string_literal(self, items, meta):
-        tree = Tree("literal_value", items, meta=meta)
-        tree.st_type = ElementaryType("STRING") # Could be WSTRING based on quotes if grammar distinguishes
-        return tree
+    def untyped_literal(self, tree):
+        # the only untyped literal without its own rule is STRING_LITERAL
+        self._set(tree, elementary_type("STRING"))
 
     # --- Variable and Expression Handling ---
-    @v_args(inline=True) # Children passed as direct arguments
-    def variable_access(self, identifier_token, *accessors, meta):
+    def variable_access(self, tree):
         # IDENTIFIER (array_accessor | struct_member_accessor)*
+        identifier_token, accessors = tree.children[0], tree.children[1:]
         var_name = identifier_token.value
         current_type_sym = self.st.current_scope.lookup_symbol(var_name)
 
         if not current_type_sym:
             # Variable not found, assign UNKNOWN type
-            tree = Tree("variable_access", [identifier_token] + list(accessors), meta=meta)
-            tree.st_type = ElementaryType("UNKNOWN_VAR_" + var_name)
-            return tree
+            self._set(tree, elementary_type("UNKNOWN_VAR_" + var_name))
+            return
 
         current_type = current_type_sym.type # This is an StDataType object
 
         for acc in accessors: # acc is a Tree for array_accessor or struct_member_accessor
             if not isinstance(current_type, StDataType): # Should not happen if types are objects
-                 current_type = ElementaryType("ERROR_PREV_ACCESS")
-                 break
+                current_type = elementary_type("ERROR_PREV_ACCESS")
+                break
             if acc.data == "array_accessor":
                 if isinstance(current_type, ArrayType):
-                    # Type check indices in acc.children (expression_list)
-                    # For now, assume indices are valid
+                    # Indices are not type checked yet
                     current_type = current_type.element_type
                 else:
-                    current_type = ElementaryType("NOT_AN_ARRAY")
+                    current_type = elementary_type("NOT_AN_ARRAY")
                     break
             elif acc.data == "struct_member_accessor":
                 if isinstance(current_type, StructType):
-                    member_name = acc.children.value # IDENTIFIER token
-                    current_type = current_type.fields.get(member_name, ElementaryType("UNKNOWN_MEMBER"))
+                    member_name = acc.children[-1].value # DOT IDENTIFIER
+                    current_type = current_type.fields.get(member_name, elementary_type("UNKNOWN_MEMBER"))
                 elif isinstance(current_type, PouType) and current_type.pou_kind == "FUNCTION_BLOCK":
                     # Accessing output of an FB instance. This needs full FB type info.
-                    # fb_type_sym = self.st.global_scope.lookup_symbol(current_type.name)
-                    # if fb_type_sym and isinstance(fb_type_sym.type, StructType): # FB outputs as fields
-                    #    member_name = acc.children.value
-                    #    current_type = fb_type_sym.type.fields.get(member_name, ElementaryType("UNKNOWN_FB_OUTPUT"))
-                    # else:
-                    current_type = ElementaryType("FB_MEMBER_ACCESS_UNSUPPORTED") # Simplified
+                    current_type = elementary_type("FB_MEMBER_ACCESS_UNSUPPORTED") # Simplified
                     break
                 else:
-                    current_type = ElementaryType("NOT_A_STRUCT_OR_FB")
+                    current_type = elementary_type("NOT_A_STRUCT_OR_FB")
                     break
-        
-        # Create a new Tree for variable_access and attach the final type
-        # The children of variable_access in the original tree are IDENTIFIER and accessors
-        # We need to ensure these children are also transformed if they contain expressions (e.g., array index)
-        # Lark's Transformer processes children first. So 'identifier_token' might be a Token,
-        # and 'accessors' might be already transformed Trees.
-        
-        # Reconstruct the tree with potentially transformed children
-        transformed_children = [identifier_token] # Assuming identifier_token is not transformed further by itself
-        for acc_node in accessors:
-            transformed_children.append(acc_node) # acc_node is already a transformed Tree
-
-        tree = Tree("variable_access", transformed_children, meta=meta)
-        tree.st_type = current_type
-        return tree
-
+        self._set(tree, current_type)
 
-    def primary_expression(self, children, meta):
+    def primary_expression(self, tree):
         # literal | variable_access | function_call | LPAREN expression RPAREN
-        # Children are already transformed. The child (single) is the item.
-        child_node = children
-        # The type of primary_expression is the type of its child.
-        # Re-wrap to allow attaching type to primary_expression itself if needed,
-        # or just pass child_node up if primary_expression is inlined by '?'
-        # For explicit node:
-        tree = Tree("primary_expression", children, meta=meta)
-        tree.st_type = self._get_node_type(child_node)
-        return tree
-
-    def add_expression(self, children, meta):
+        child_node = next(child for child in tree.children if isinstance(child, Tree))
+        self._set(tree, self.type_of(child_node))
+
+    def add_expression(self, tree):
         # term ( (ADD | SUB) term )*
-        # Children are [term_node, op_token, term_node, op_token,...]
-        # The first child is the initial term
-        current_type = self._get_node_type(children)
+        children = tree.children
+        current_type = self.type_of(children[0])
 
         for i in range(1, len(children), 2):
-            # op = children[i] # Token for ADD or SUB
-            right_operand_type = self._get_node_type(children[i+1])
+            right_operand_type = self.type_of(children[i+1])
             # Simple type promotion: if either is REAL, result is REAL.
             # Otherwise, if both INT-like, result is INT-like.
             # This is a simplification. IEC61131-3 is strict about no implicit conversions.
-            if current_type == ElementaryType("REAL") or right_operand_type == ElementaryType("REAL"):
-                current_type = ElementaryType("REAL")
+            if current_type == elementary_type("REAL") or right_operand_type == elementary_type("REAL"):
+                current_type = elementary_type("REAL")
             elif current_type.name.endswith("INT") and right_operand_type.name.endswith("INT"): # crude check
-                # Determine largest int type if needed, for now, stick to INT/DINT etc.
-                # For simplicity, assume they result in a compatible integer type or DINT
-                current_type = ElementaryType("DINT") # Default for mixed int ops
+                current_type = elementary_type("DINT") # Default for mixed int ops
             else: # Type mismatch or non-numeric
-                current_type = ElementaryType("TYPE_ERROR_IN_ADD")
+                current_type = elementary_type("TYPE_ERROR_IN_ADD")
                 break
-        
-        tree = Tree("add_expression_typed", children, meta=meta)
-        tree.st_type = current_type
-        return tree
-    
+        self._set(tree, current_type)
+
     # Similar methods for mul_expression, comparison_expression, logical_expressions etc.
     # Each would implement its specific type logic.
 
-    def function_call(self, children, meta):
-        # IDENTIFIER LPAREN [param_assignment_list]? RPAREN
-        func_name_token = children
-        func_name = func_name_token.value
-        
+    def function_call(self, tree):
+        # variable_access LPAREN [param_assignment_list] RPAREN
+        func_name = tree.children[0].children[0].value
         func_sym = self.st.current_scope.lookup_symbol(func_name) # Or global for std functions
-        return_type = ElementaryType(f"UNKNOWN_FUNC_RET_{func_name}")
+        return_type = elementary_type(f"UNKNOWN_FUNC_RET_{func_name}")
 
-        if func_sym and (func_sym.kind == 'function' or (isinstance(func_sym.type, PouType) and func_sym.type.pou_kind == "FUNCTION")) :
+        if func_sym and (func_sym.kind == 'function' or (isinstance(func_sym.type, PouType) and func_sym.type.pou_kind == "FUNCTION")):
             if isinstance(func_sym.type, PouType) and func_sym.type.return_type:
-                 return_type = func_sym.type.return_type
-            # Parameter type checking would occur here by inspecting children (param_assignment_list)
-            # and comparing with func_sym.type.params
-        
-        tree = Tree("function_call_typed", children, meta=meta)
-        tree.st_type = return_type
-        return tree
+                return_type = func_sym.type.return_type
+            # Parameter type checking would occur here by comparing with func_sym.type.params
+        self._set(tree, return_type)
 
-    def assignment_statement(self, children, meta):
+    def assignment_statement(self, tree):
         # variable_access ASSIGN expression
-        # Children are already transformed
-        lhs_node = children # variable_access node with.st_type
-        rhs_node = children # expression node with.st_type
-
-        lhs_type = self._get_node_type(lhs_node)
-        rhs_type = self._get_node_type(rhs_node)
-
-        # Perform type compatibility check here if needed.
-        # For "no error handling", we just note the types.
-        # The assignment itself doesn't have a "type" in the same way an expression does.
-        # We can annotate the assignment statement with this info if desired.
-        tree = Tree("assignment_statement_typed", children, meta=meta)
-        setattr(tree, 'lhs_type', lhs_type)
-        setattr(tree, 'rhs_type', rhs_type)
-        # An assignment statement itself doesn't have a type, so no tree.st_type
-        return tree
-
-    def __default__(self, data, children, meta):
-        # Default behavior for rules not explicitly handled:
-        # Create a new tree, try to infer type from first child if sensible
-        new_tree = Tree(data, children, meta)
-        if children and hasattr(children, 'st_type'):
-            # Tentatively assign type of first child if rule is a simple wrapper
-            # This is a heuristic and might not always be correct.
-            # Specific rules should handle their types explicitly.
-            # setattr(new_tree, 'st_type', children.st_type)
-            pass # Better to be explicit for each rule
-        return new_tree
-
-# Global store for the final annotated AST
-annotated_ast_global = None
-
-def get_node_type(node):
-    global annotated_ast_global
-    if not annotated_ast_global:
-        return "AST not processed yet" # Or raise error
-
-    # This function would ideally search the specific node within the annotated_ast_global
-    # For simplicity, we assume 'node' itself is already an annotated node from the Transformer.
-    if hasattr(node, 'st_type'):
-        return node.st_type
-    elif isinstance(node, Token):
-        # Try to infer type for simple tokens if not wrapped by a rule that adds.st_type
-        if node.type == "IDENTIFIER":
-            # This needs context from symbol table, which get_node_type might not have directly
-            # This indicates IDENTIFIERs should always be processed by a rule like 'variable_access'
-            return ElementaryType("AMBIGUOUS_IDENTIFIER_TYPE")
-        # Other tokens (keywords, operators) don't have ST data types themselves
-        return ElementaryType("TOKEN_HAS_NO_ST_TYPE")
-    return ElementaryType("UNKNOWN_NODE_OR_TYPE_NOT_SET")
-
-
-st_code_example = """
-PROGRAM Main
-    VAR
-        myInt : INT;
-        myReal : REAL;
-        myBool : BOOL;
-        myArr : ARRAY [1..3] OF INT;
-    END_VAR
-
-    myReal := myInt + 20.5; // Type promotion/conversion might be an issue
-    myBool := myInt > 5;
-    myArr := myInt;
-    // CheckNode := myArr[myInt]; // Index is INT, value is INT
-END_PROGRAM
+        # The assignment itself has no type, the operand types are noted for checks
+        lhs_node, rhs_node = tree.children[0], tree.children[-1]
+        self.assignments[id(tree)] = (self.type_of(lhs_node), self.type_of(rhs_node))
+
+def get_node_type(node, annotator):
+    """Type of a node of the tree annotated by `annotator`."""
+    if isinstance(node, Tree):
+        return annotator.type_of(node)
+    if isinstance(node, Token) and node.type == "IDENTIFIER":
+        # IDENTIFIERs are typed through the rule that holds them, e.g. variable_access
+        return ElementaryType("AMBIGUOUS_IDENTIFIER_TYPE")
+    # Other tokens (keywords, operators) don't have ST data types themselves
+    return ElementaryType("TOKEN_HAS_NO_ST_TYPE")
+
+# the pipeline parses POU bodies as statement lists against a symbol table
+# built from their declarations, the demo does the same
+st_variables_example = {
+    "myInt": ElementaryType("INT"),
+    "myReal": ElementaryType("REAL"),
+    "myBool": ElementaryType("BOOL"),
+    "myArr": ArrayType(ElementaryType("INT"), [(1, 3)]),
+}
+
+st_body_example = """
+myReal := myInt + 20.5; (* Type promotion/conversion might be an issue *)
+myBool := myInt > 5;
+myArr := myInt;
+(* CheckNode := myArr[myInt]; Index is INT, value is INT *)
 """
 
-def main_parser_flow(code_to_parse):
-    global annotated_ast_global
-
+def main_parser_flow(code_to_parse, symbol_table=None, start='start'):
+    """
+    Parse POU sources and annotate them with types. Returns the tree and its
+    TypeAnnotator (see get_node_type); nothing is kept at module level, so
+    POUs can be processed concurrently. start is 'statement_list' for a bare
+    body, whose variables then come from symbol_table.
+    """
     # 1. Parse the ST code
-    raw_ast = st_parser.parse(code_to_parse)
-    # print("Raw AST:\n", raw_ast.pretty())
+    raw_ast = get_st_parser().parse(code_to_parse, start=start)
 
     # 2. Build Symbol Table
-    symbol_table_instance = SymbolTable()
-    symbol_builder = SymbolTableBuilder(symbol_table_instance)
-    symbol_builder.visit(raw_ast) # Populate symbol_table_instance
-
-    # print("\nSymbol Table:")
-    # scope = symbol_table_instance.global_scope
-    # while scope:
-    #     print(scope)
-    #     if scope.symbols:
-    #         for s_name, s_obj in scope.symbols.items():
-    #             print(f"  - {s_obj}")
-    #     # This doesn't show nested scopes correctly, need proper traversal
-    #     # For now, just print global and current (which will be last POU's scope)
-    #     if scope == symbol_table_instance.global_scope:
-    #         prog_scope_name = "PROGRAM_Main" # Hardcoded for example
-    #         prog_scope = next((s for s_child in symbol_table_instance.global_scope.symbols.values() if hasattr(s_child, 'name') and s_child.name == prog_scope_name), None)
-
-    #     scope = None # End loop for simple print
-
-
-    # 3. Annotate AST with Types
-    type_annotator = TypeAnnotator(symbol_table_instance)
-    annotated_ast = type_annotator.transform(raw_ast)
-    annotated_ast_global = annotated_ast # Store for get_node_type
-
-    # print("\nAnnotated AST:\n", annotated_ast.pretty())
-
-    # 4. Demonstrate get_node_type
-    # This requires finding specific nodes in the annotated_ast.
-    # Example: Find the node for 'myInt' in 'myReal := myInt + 20.5;'
-    # This is non-trivial without node IDs or more complex traversal.
-    # For demonstration, let's assume we can pick a node.
-    # We'll iterate and find a node we are interested in.
-    
-    # Example: Find the 'myInt' variable access node in an assignment
-    assignment_node = None
-    for pou in annotated_ast.children: # Assuming start rule produces list of POUs
-        if pou.data == "program_declaration":
-            stmt_list = pou.children[-2] # Heuristic: statement_list before END_PROGRAM_KW
-            if stmt_list and stmt_list.data == "statement_list":
-                for stmt in stmt_list.children:
-                    if isinstance(stmt, Tree) and stmt.data == "assignment_statement_typed":
-                        # myReal := myInt + 20.5;
-                        # lhs is variable_access for myReal
-                        # rhs is add_expression for myInt + 20.5
-                        # We want to find 'myInt' inside the add_expression
-                        rhs_expr = stmt.children # add_expression_typed
-                        if rhs_expr.data == "add_expression_typed":
-                            # children are [term_node, op_token, term_node]
-                            # first term_node -> power_expr -> unary_expr -> primary_expr -> variable_access for myInt
-                            term1 = rhs_expr.children # This is already a transformed node
-                            # Need to traverse down to find the variable_access for 'myInt'
-                            # This recursive search is for demonstration.
-                            
-                            def find_var_access_node(node, var_name):
-                                if isinstance(node, Tree):
-                                    if node.data == "variable_access" and \
-                                       isinstance(node.children, Token) and \
-                                       node.children.value == var_name:
-                                        return node
-                                    for child in node.children:
-                                        found = find_var_access_node(child, var_name)
-                                        if found: return found
-                                return None
-
-                            my_int_node_in_expr = find_var_access_node(term1, "myInt")
-                            if my_int_node_in_expr:
-                                print(f"\nType of 'myInt' in expression '{my_int_node_in_expr.children.value}': {get_node_type(my_int_node_in_expr)}")
-                            
-                            my_real_literal_node = find_var_access_node(rhs_expr.children, None) # Find a literal
-                            # This search is too naive for literals. Let's assume we found it.
-                            # Example: if rhs_expr.children was a literal node from transformer
-                            # print(f"Type of literal '20.5': {get_node_type(some_literal_node_for_20_5)}")
-                            break # Found one assignment
-
-    # Example: Get type of the assignment expression itself (rhs_node of myReal assignment)
-    # (Assuming we have 'assignment_node' from a more robust search)
-    # if assignment_node and len(assignment_node.children) > 2:
-    #    rhs_expression_node = assignment_node.children
-    #    print(f"Type of expression 'myInt + 20.5': {get_node_type(rhs_expression_node)}")
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+        SymbolTableBuilder(symbol_table).visit(raw_ast)
+
+    # 3. Annotate AST with Types, in place
+    annotator = TypeAnnotator(symbol_table).annotate(raw_ast)
+    return raw_ast, annotator
 
 
 if __name__ == '__main__':
-    main_parser_flow(st_code_example)
\ No newline at end of file
+    symbol_table = SymbolTable().local("Main")
+    for name, type_obj in st_variables_example.items():
+        symbol_table.current_scope.add_symbol(Symbol(name, type_obj, 'variable'))
+    tree, annotator = main_parser_flow(st_body_example, symbol_table, start='statement_list')
+    for stmt in tree.find_data("assignment_statement"):
+        lhs_type, rhs_type = annotator.assignments[id(stmt)]
+        print(f"{stmt.children[0].children[0]}: {lhs_type} := {rhs_type}")
@@ -0,0 +1,127 @@
+# symbols.py
+# Project-wide symbol table in the format of ST.Analyze.parse.SymbolTable:
+# global variables (vars.xml), data types and every POU signature. Stage1
+# builds it once and pickles it; ST workers load it once, freeze it and only
+# build the local scope of their own POU on top of it.
+import lzma
+import os
+import pickle
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from typing import Iterable, List, Optional
+
+from ST.Analyze.parse import (
+    SymbolTable, Symbol, StDataType, ElementaryType, ArrayType, StructType, PouType,
+)
+
+from Utils.compression import find_input, open_input, open_output
+
+from Logs.colorLogger import get_color_logger
+logger = get_color_logger("ST_Symbols")
+
+SYMBOLS_PATH = "../data/Inters/symbols.pickle"
+
+# PLCopen pouType -> (PouType kind, Symbol kind), kinds as in SymbolTableBuilder
+POU_KINDS = {
+    "program": ("PROGRAM", "program"),
+    "functionBlock": ("FUNCTION_BLOCK", "fb_type"),
+    "function": ("FUNCTION", "function"),
+}
+# interface section -> parameter Symbol kind
+PARAM_SECTIONS = {
+    "inputVars": "input",
+    "outputVars": "output",
+    "inOutVars": "in_out",
+}
+# PLCopen spells a few elementary types in lower case
+ELEMENTARY_ALIASES = {"string": "STRING", "wstring": "WSTRING"}
+
+def type_from_xml(type_el: Optional[ET.Element], table: SymbolTable) -> StDataType:
+    """StDataType of a PLCopen <type>/<baseType> element."""
+    if type_el is None or len(type_el) == 0:
+        return ElementaryType("UNKNOWN_TYPE_SPEC")
+    spec = type_el[0]
+    if spec.tag == "derived":
+        name = spec.get("name", "")
+        sym = table.global_scope.lookup_symbol(name)
+        if sym is not None and sym.kind in ("type", "fb_type"):
+            return sym.type
+        return ElementaryType(name)
+    if spec.tag == "array":
+        dimensions = [(dim.get("lower"), dim.get("upper")) for dim in spec.findall("dimension")]
+        return ArrayType(type_from_xml(spec.find("baseType"), table), dimensions)
+    if spec.tag == "struct":
+        fields = {var.get("name"): type_from_xml(var.find("type"), table) for var in spec.findall("variable")}
+        return StructType(None, fields)
+    return ElementaryType(ELEMENTARY_ALIASES.get(spec.tag, spec.tag))
+
+def add_global_vars(table: SymbolTable, vars_root: ET.Element) -> None:
+    """<resource><globalVars><variable/>... as written by Stage1, declarations kept as location."""
+    for gvs in vars_root.iter("globalVars"):
+        for var in gvs.findall("variable"):
+            if name := var.get("name"):
+                table.global_scope.add_symbol(Symbol(name, type_from_xml(var.find("type"), table), "variable", location=var))
+
+def add_data_types(table: SymbolTable, data_types: Iterable[ET.Element]) -> None:
+    for dt in data_types:
+        name = dt.get("name")
+        if not name:
+            continue
+        st_type = type_from_xml(dt.find("baseType"), table)
+        if isinstance(st_type, StructType):
+            st_type.name = name
+        table.global_scope.add_symbol(Symbol(name, st_type, "type", location=dt))
+
+def add_pou(table: SymbolTable, pou: ET.Element) -> None:
+    """Signature of a POU: kind, return type and its input/output/in-out parameters."""
+    name = pou.get("name")
+    kinds = POU_KINDS.get(pou.get("pouType"))
+    if not name or kinds is None:
+        return
+    pou_kind, symbol_kind = kinds
+    params = []
+    interface = pou.find("interface")
+    return_type = None
+    if interface is not None:
+        if interface.find("returnType") is not None:
+            return_type = type_from_xml(interface.find("returnType"), table)
+        for section, param_kind in PARAM_SECTIONS.items():
+            for block in interface.findall(section):
+                for var in block.findall("variable"):
+                    params.append(Symbol(var.get("name"), type_from_xml(var.find("type"), table), param_kind))
+    table.global_scope.add_symbol(Symbol(name, PouType(name, pou_kind, return_type, params), symbol_kind))
+
+def build_symbol_table(vars_root: Optional[ET.Element], data_types: Iterable[ET.Element],
+                       pous: Iterable[ET.Element]) -> SymbolTable:
+    """Frozen global table. Data types go first, so POU signatures and variables can refer to them."""
+    table = SymbolTable()
+    add_data_types(table, data_types)
+    for pou in pous:
+        add_pou(table, pou)
+    if vars_root is not None:
+        add_global_vars(table, vars_root)
+    return table.freeze()
+
+def save_symbol_table(table: SymbolTable, path: str = SYMBOLS_PATH) -> None:
+    # symbols.pickle.gz or .xz when Stage1 runs with --compress
+    with open_output(path) as f:
+        pickle.dump(table, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+@lru_cache(maxsize=None)
+def load_symbol_table(path: str = SYMBOLS_PATH) -> Optional[SymbolTable]:
+    """The table written by Stage1, None if Stage1 did not write one."""
+    path = find_input(path)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open_input(path) as f:
+            return pickle.load(f)
+    except (OSError, lzma.LZMAError, pickle.UnpicklingError, EOFError, AttributeError) as e:
+        logger.warning(f"Could not load the global symbol table {path}: {e}")
+        return None
+
+def pou_names(table: SymbolTable) -> List[str]:
+    return [sym.name for sym in table.global_scope.symbols.values() if isinstance(sym.type, PouType)]
+
+def global_variables(table: SymbolTable) -> List[Symbol]:
+    return [sym for sym in table.global_scope.symbols.values() if sym.kind == "variable"]
@@ -3,6 +3,8 @@
 import os
 import glob
 
+from Utils.manifest import clear_records
+
 from Logs.colorLogger import get_color_logger
 logger = get_color_logger("ST/clean.py")
 
@@ -17,6 +19,7 @@ def main():
     files = glob.glob("ST/Outputs/T_*.xml")
     for full_path in files:
         os.remove(full_path)
+    clear_records()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -2,6 +2,12 @@ import os
 import sys
 import subprocess
 import glob
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from Utils.manifest import clear_records
+from Utils.memory import cap_workers, current_rss, format_size, max_memory_from_env, peak_rss
 
 from Logs.colorLogger import get_color_logger
 logger = get_color_logger("ST")
@@ -9,28 +15,96 @@ logger = get_color_logger("ST")
 
 # Get the list of files in "ST/Inters" matching the pattern "T_*.xml"
 files = glob.glob("ST/Inputs/T_*.xml")
-# files to be created if not exist
-CHANGE_PATH = "ST/Outputs/change.txt"
 
+# Set in every worker by _init_worker: the frozen global symbol table and the parse tree cache
+_symbols = None
+_tree_cache = None
 
-# Iterate over each file found
-def main():
-  with open(CHANGE_PATH, "w") as f:
-    f.write("")
+def _init_worker(symbols) -> None:
+  global _symbols, _tree_cache
+  from ST.syntax import TreeCache
+  _symbols = symbols
+  _tree_cache = TreeCache() if TreeCache is not None else None
+
+def convert(full_path):
+  """Preprocess and convert one ST POU in this process, returns its manifest record."""
+  from ST import preprocess, syntax
+  logger.info(f"Processing {os.path.basename(full_path)}")
+  path = full_path.replace("Inputs", "Inters").replace(".xml", "_preprocess.xml")
+  preprocess.process_xml(full_path, path)
+  logger.debug(f"Converting {path}")
+  output = path.replace("_preprocess", "_out").replace("Inters", "Outputs")
+  return syntax.process_xml(path, output, _tree_cache, _symbols)
+
+def convert_or_skip(full_path):
+  """
+  convert, a POU that fails is logged and skipped (None) as when every POU ran
+  in its own interpreter, the other POUs are still converted and assembled.
+  """
+  try:
+    return convert(full_path)
+  except Exception as e:
+    logger.error(f"Skipping {os.path.basename(full_path)}: {type(e).__name__}: {e}")
+    logger.debug(traceback.format_exc())
+    return None
 
+def _pool_context():
+  # fork hands the symbol table to the workers without pickling it again
+  if "fork" in multiprocessing.get_all_start_methods():
+    return multiprocessing.get_context("fork")
+  return None
+
+def run_sequential():
+  # without the global symbol table every POU runs in its own interpreter, as before
   for full_path in files:
       # Extract just the filename (e.g., "T_xxxx.xml") from the full path
       filename = os.path.basename(full_path)
       logger.info(f"Processing {filename}")
-      
+
       # Step 1: Call ST/preprocess.py with argument --input T_xxxx.xml
       logger.debug(f"Calling ST/preprocess.py {full_path}")
       subprocess.run([sys.executable, "ST/preprocess.py", "--input", full_path])
-      
+
       path = full_path.replace("Inputs", "Inters").replace(".xml", "_preprocess.xml")
       logger.debug(f"Calling syntax.py with {path}")
       subprocess.run([sys.executable, "ST/syntax.py", "--input", path])
 
+# Iterate over each file found
+def main(jobs=None, max_memory=None):
+  for directory in ("ST/Inters", "ST/Outputs"):
+    os.makedirs(directory, exist_ok=True)
+  # every POU writes its own manifest record, drop the ones of the previous run
+  clear_records()
+
+  try:
+    from ST.Analyze.symbols import load_symbol_table
+    symbols = load_symbol_table()
+  except ImportError:
+    symbols = None
+  if symbols is None:
+    run_sequential()
+    return
+
+  pending = files
+  max_memory = max_memory or max_memory_from_env()
+  if max_memory and pending:
+    # convert one POU here first, a forked worker grows to about the peak it reaches
+    _init_worker(symbols)
+    convert_or_skip(pending[0])
+    pending = pending[1:]
+    jobs = cap_workers(max_memory, current_rss(), peak_rss(), jobs)
+    logger.info(f"Peak {format_size(peak_rss())} per worker, {jobs} worker(s) fit in {format_size(max_memory)}")
+
+  # POUs only share the frozen global table, so they are converted in parallel
+  with ProcessPoolExecutor(max_workers=jobs, mp_context=_pool_context(),
+                           initializer=_init_worker, initargs=(symbols,)) as pool:
+    for record in pool.map(convert_or_skip, pending):
+      if record is not None:
+        logger.debug(f"Converted {record['name']} to {record['output']}")
+  # each worker only tracks the cache entries it wrote, the run prunes once for all of them
+  from ST.syntax import TreeCache
+  if TreeCache is not None:
+    TreeCache().prune()
+
 if __name__ == "__main__":
     main()
-
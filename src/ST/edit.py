@@ -0,0 +1,57 @@
+# edit.py
+# Edit buffer for ST source rewrites. Rewrite rules record (span, replacement)
+# edits against the original text (usually token spans from ST/lexer.py) and
+# the buffer applies all of them in one linear list-join pass.
+from typing import List, NamedTuple
+
+from ST.lexer import Token
+
+class Edit(NamedTuple):
+    start: int
+    end: int
+    text: str
+    order: int
+
+class EditBuffer:
+    """
+    Collects edits against `source` and builds the rewritten text once.
+    Edits may not overlap, inserts at the same position are kept in the
+    order they were added.
+    """
+    def __init__(self, source: str):
+        self.source = source
+        self.edits: List[Edit] = []
+
+    def __len__(self) -> int:
+        return len(self.edits)
+
+    def replace(self, start: int, end: int, text: str) -> None:
+        if not 0 <= start <= end <= len(self.source):
+            raise ValueError(f"Edit span ({start}, {end}) is outside the source (length {len(self.source)})")
+        self.edits.append(Edit(start, end, text, len(self.edits)))
+
+    def insert(self, pos: int, text: str) -> None:
+        self.replace(pos, pos, text)
+
+    def delete(self, start: int, end: int) -> None:
+        self.replace(start, end, "")
+
+    def replace_token(self, tok: Token, text: str) -> None:
+        self.replace(tok.start, tok.end, text)
+
+    def apply(self) -> str:
+        """
+        Return the source with every edit applied. Raises ValueError on overlapping edits.
+        """
+        if not self.edits:
+            return self.source
+        pieces = []
+        pos = 0
+        for edit in sorted(self.edits, key=lambda e: (e.start, e.end, e.order)):
+            if edit.start < pos:
+                raise ValueError(f"Overlapping edit at ({edit.start}, {edit.end})")
+            pieces.append(self.source[pos:edit.start])
+            pieces.append(edit.text)
+            pos = edit.end
+        pieces.append(self.source[pos:])
+        return "".join(pieces)
@@ -0,0 +1,71 @@
+# lexer.py
+# ST front end: a POU body is tokenized once into a lossless token stream
+# (whitespace and comments included) and every analysis in ST/syntax.py
+# consumes that stream instead of re-scanning the code.
+import re
+from functools import lru_cache
+from typing import Iterable, Iterator, List, NamedTuple
+
+from Utils.token import tokenize_literals
+from Utils.lexicon import LEXICON
+
+IDENTIFIER_PATTERN = re.compile(
+    r"(?:[a-zA-Z]|_(?:[a-zA-Z]|[0-9]))(?:_?(?:[a-zA-Z]|[0-9]))*"
+)
+TOKEN_PATTERN = re.compile(r"""
+     (?P<ws>\s+)
+    |(?P<comment>\(\*.*?\*\)|/\*.*?\*/|//[^\n]*)
+    |(?P<string>'(?:\$.|[^'$\n])*'|"(?:\$.|[^"$\n])*")
+    |(?P<op>:=|=>)
+    |(?P<word>\w+)
+    |(?P<punct>[^\w\s])
+""", re.VERBOSE | re.DOTALL | re.UNICODE)
+
+# Token kinds. Words are split into keyword / identifier / literal (an
+# identifier-shaped literal such as TRUE) / word (numbers and other \w+ runs).
+WS = "ws"
+COMMENT = "comment"
+STRING = "string"
+OP = "op"
+PUNCT = "punct"
+KEYWORD = "keyword"
+IDENTIFIER = "identifier"
+LITERAL = "literal"
+WORD = "word"
+SKIPPED = (WS, COMMENT)
+NAME_KINDS = (IDENTIFIER, LITERAL)
+WORD_KINDS = (KEYWORD, IDENTIFIER, LITERAL, WORD)
+
+class Token(NamedTuple):
+    kind: str
+    text: str
+    start: int
+    end: int
+
+@lru_cache(maxsize=None)
+def classify_word(word: str) -> str:
+    """Kind of a \\w+ run, computed once per distinct word."""
+    if IDENTIFIER_PATTERN.fullmatch(word) is None:
+        return WORD
+    if LEXICON.is_keyword(word):
+        return KEYWORD
+    if tokenize_literals(word):
+        return LITERAL
+    return IDENTIFIER
+
+def tokenize(code: str) -> List[Token]:
+    """
+    Tokenize ST code in one pass. Concatenating the token texts gives back the code.
+    """
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(code):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "word":
+            kind = classify_word(text)
+        tokens.append(Token(kind, text, match.start(), match.end()))
+    return tokens
+
+def code_tokens(tokens: Iterable[Token]) -> Iterator[Token]:
+    """The tokens that matter to the analyses, without whitespace and comments."""
+    return (tok for tok in tokens if tok.kind not in SKIPPED)
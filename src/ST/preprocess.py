@@ -11,42 +11,175 @@ logger = get_color_logger("ST_Preprocess")
 DEFAULT_INPUT = 'ST/Inputs/fuck.xml'
 DEFAULT_OUTPUT = 'ST/Inters/T_test.xml'
 
-def process_xml(input_file, output_file):
-    # Reads input file, converts single-line // comments to Beremiz-style (* ... *),
-    # and writes the modified content to the output file.
-    # This function assumes input_file exists and output_file path is writable.
+# Scanner states
+TEXT = "text"                  # ST code / XML character data
+TAG = "tag"                    # inside <...>
+TAG_QUOTE = "tag_quote"        # inside a quoted attribute value
+XML_COMMENT = "xml_comment"    # inside <!-- ... -->
+STRING = "string"              # inside an ST string literal
+BLOCK_COMMENT = "block_comment"
+LINE_COMMENT = "line_comment"  # inside a // comment, being converted
+URL = "url"                    # inside http://..., copied up to the next space
 
-    def comment_replacer(match_obj):
-        # Helper function for re.sub.
-        # Takes a match object from a regex finding "//" comments.
-        # Group 1 is the content before "//".
-        # Group 2 is the comment text after "//".
-        # Returns the string formatted as "content_before(* comment_text_trimmed *)".
-        code_part = match_obj.group(1)
-        comment_text = match_obj.group(2)
-        return f"{code_part}(* {comment_text.strip()} *)"
+# Only these schemes start a URL (in documentation text), any other "label://"
+# is a CASE label followed by a comment.
+URL_SCHEMES = r"https?|ftp|file"
+# Next significant token of each state. No token (lookahead included) is longer
+# than 9 characters ("https://x"), so at most 8 characters have to be carried
+# over to the next chunk.
+TOKENS = {
+    TEXT: re.compile(rf"<!--|<|'|\"|(?<![A-Za-z0-9_])(?:{URL_SCHEMES})://(?=[^\s<])|//|\(\*|/\*"),
+    TAG: re.compile(r"[\"'>]"),
+    XML_COMMENT: re.compile(r"-->"),
+    STRING: re.compile(r"\$[^\n<]|['\"\n<]"),
+    BLOCK_COMMENT: re.compile(r"\*\)|\*/|<"),
+    LINE_COMMENT: re.compile(r"[\n<]"),
+    URL: re.compile(r"[\s<]"),
+}
+BLOCK_COMMENT_END = {"(*": "*)", "/*": "*/"}
+CARRY = 8
+CHUNK_SIZE = 1 << 16
 
-    with open(input_file, 'r', encoding='utf-8') as infile:
-        lines = infile.readlines()
+class CommentConverter:
+    """
+    Single-pass scanner converting ST // comments into Beremiz-style (* ... *).
+    It is fed chunks of the POU file and keeps track of XML markup, ST string
+    literals and block comments, so // inside strings, comments, attributes
+    or URLs is left alone. Only the converter state and an 8 character
+    carry-over are kept between chunks.
+    """
+    def __init__(self):
+        self.state = TEXT
+        self.quote = None           # quote char of TAG_QUOTE / STRING
+        self.block_end = None       # end token of BLOCK_COMMENT
+        self.comment_started = False
+        self.pending_space = ""     # whitespace that may trail a // comment
+        self.carry = ""
+        self.before = ""            # last character emitted, seen by the URL lookbehind
 
-    processed_lines = []
-    for line in lines:
-        original_line_content = line.rstrip('\n\r') # Remove trailing newline/CR for processing
-        
-        # Regex to find and capture parts of a // style comment:
-        # (.*?)  -> Group 1: Any characters before // (non-greedy).
-        # //     -> Matches the literal // comment marker.
-        # (.*)   -> Group 2: Any characters after // until the end of the line.
-        modified_line_content = re.sub(
-            r'(.*?)//(.*)', 
-            comment_replacer, 
-            original_line_content
-        )
-        processed_lines.append(modified_line_content + '\n') # Add newline back
+    def _comment_text(self, text: str, out: list) -> None:
+        # emit comment text stripped, without buffering the whole comment
+        if not self.comment_started:
+            text = text.lstrip()
+            if not text:
+                return
+            self.comment_started = True
+        body = text.rstrip()
+        if body:
+            out.append(self.pending_space)
+            out.append(body)
+            self.pending_space = text[len(body):]
+        else:
+            self.pending_space += text
+
+    def _end_line_comment(self, out: list) -> None:
+        out.append(" *)")
+        self.state = TEXT
+
+    def feed(self, data: str, final: bool = False) -> str:
+        buf = self.before + self.carry + data
+        limit = len(buf) if final else len(buf) - CARRY
+        out = []
+        pos = len(self.before)
+        while pos < limit:
+            state = self.state
+            if state == TAG_QUOTE:
+                end = buf.find(self.quote, pos)
+                if end == -1 or end >= limit:
+                    out.append(buf[pos:limit])
+                    pos = limit
+                    break
+                out.append(buf[pos:end + 1])
+                pos = end + 1
+                self.state = TAG
+                continue
+            match = TOKENS[state].search(buf, pos)
+            if match is None or match.start() >= limit:
+                if state == LINE_COMMENT:
+                    self._comment_text(buf[pos:limit], out)
+                else:
+                    out.append(buf[pos:limit])
+                pos = limit
+                break
+            token = match.group()
+            if state == LINE_COMMENT or state == URL:
+                if state == LINE_COMMENT:
+                    self._comment_text(buf[pos:match.start()], out)
+                    self._end_line_comment(out)
+                else:
+                    out.append(buf[pos:match.start()])
+                    self.state = TEXT
+                # the space, newline or '<' is scanned again as text
+                pos = match.start()
+                continue
+            out.append(buf[pos:match.start()])
+            pos = match.end()
+            if state == TEXT:
+                if token == "//":
+                    out.append("(* ")
+                    self.state = LINE_COMMENT
+                    self.comment_started = False
+                    self.pending_space = ""
+                    continue
+                out.append(token)
+                if token.endswith("://"):
+                    self.state = URL
+                elif token == "<!--":
+                    self.state = XML_COMMENT
+                elif token == "<":
+                    self.state = TAG
+                elif token in BLOCK_COMMENT_END:
+                    self.state = BLOCK_COMMENT
+                    self.block_end = BLOCK_COMMENT_END[token]
+                else:
+                    self.state = STRING
+                    self.quote = token
+            elif state == TAG:
+                out.append(token)
+                if token == ">":
+                    self.state = TEXT
+                else:
+                    self.state = TAG_QUOTE
+                    self.quote = token
+            elif state == XML_COMMENT:
+                out.append(token)
+                self.state = TEXT
+            elif state == STRING:
+                if token == "<" or token == "\n":
+                    # unterminated literal, the text node or the line ends it
+                    pos = match.start()
+                    self.state = TEXT
+                    continue
+                out.append(token)
+                if token == self.quote:
+                    self.state = TEXT
+            elif state == BLOCK_COMMENT:
+                if token == "<":
+                    pos = match.start()
+                    self.state = TEXT
+                    continue
+                out.append(token)
+                if token == self.block_end:
+                    self.state = TEXT
+        self.carry = buf[pos:]
+        self.before = buf[pos - 1:pos]
+        if final and self.state == LINE_COMMENT:
+            self._end_line_comment(out)
+        return "".join(out)
+
+def process_xml(input_file, output_file):
+    # Streams input file through CommentConverter, converting single-line
+    # // comments to Beremiz-style (* ... *), and writes the result chunk by chunk.
+    # This function assumes input_file exists and output_file path is writable.
+    converter = CommentConverter()
+    with open(input_file, 'r', encoding='utf-8') as infile, \
+            open(output_file, 'w', encoding='utf-8') as outfile:
+        while True:
+            chunk = infile.read(CHUNK_SIZE)
+            outfile.write(converter.feed(chunk, final=not chunk))
+            if not chunk:
+                break
 
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        outfile.writelines(processed_lines)
-    
     logger.info(f"Comment conversion complete for '{input_file}'. Output saved to '{output_file}'.")
     
 
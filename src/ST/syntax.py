@@ -1,24 +1,36 @@
 import sys
 sys.path.append('..')
 
-import re
 import argparse
 import xml.etree.ElementTree as ET
 import os
+from typing import List
 from LD.Schema.Elements import Variable, Type, POU, Interface
-from Utils.token import tokenize_literals
+from ST.edit import EditBuffer
+from ST.lexer import (
+    IDENTIFIER_PATTERN, Token, tokenize, code_tokens,
+    COMMENT, IDENTIFIER, NAME_KINDS, WORD_KINDS,
+)
 
-from data.Lex.functions import STANDARD_FUNCTIONS
-from data.Lex.keywords import ST_KEYWORDS
+from Utils.lexicon import LEXICON, Lexicon, load_lexicon, UNKNOWN
+from Utils.manifest import MANIFEST_DIR, make_record, write_record
+from Utils.compression import find_input, open_input
+from Utils.plcxml import CData, FRAGMENT_NAMESPACES, tostring
+try:
+    from ST.Analyze.analyzer import analyze_body
+    from ST.Analyze.cache import TreeCache
+    from ST.Analyze.parse import Symbol
+    from ST.Analyze.symbols import load_symbol_table, pou_names, global_variables
+except ImportError:
+    # lark is optional, the token heuristics below are used without it
+    analyze_body = TreeCache = load_symbol_table = None
 from Logs.colorLogger import get_color_logger
 logger = get_color_logger("ST_Syntax")
 
 gvars_path = '../data/Inters/vars.xml'
+DECLARED_SECTIONS = ['inputVars', 'localVars', 'outputVars', 'externalVars']
 DEFAULT_INPUT = 'ST/Inputs/fuck.xml'
 DEFAULT_OUTPUT = 'ST/Outputs/T_test.xml'
-IDENTIFIER_PATTERN = re.compile(
-    r"(?:[a-zA-Z]|_(?:[a-zA-Z]|[0-9]))(?:_?(?:[a-zA-Z]|[0-9]))*"
-)
 
 """example ST language XML
 <ST>s
@@ -41,7 +53,7 @@ class ST:
         st_element = ET.Element('ST')
         if self.xhtml is not None:
             xhtml_element = ET.Element('xhtml')
-            xhtml_element.text = "__LT_PLACEHOLDER__" + self.xhtml + "__GT_PLACEHOLDER__"
+            xhtml_element.text = CData(self.xhtml)
             st_element.append(xhtml_element)
         return st_element
     @classmethod
@@ -67,55 +79,54 @@ class Body:
 def get_declared_vars(interface: Interface) -> set:
     # init a empty set
     all_vars = set()
-    for var_section in ['inputVars', 'localVars', 'outputVars', 'externalVars']:
+    for var_section in DECLARED_SECTIONS:
         for var in getattr(interface, var_section):
             all_vars.add(var.name)
     return all_vars
 
-def find_non_standard_functions(st_string):
+def local_symbol_table(symbols, pou: POU):
+    """
+    Scope of one POU on top of the shared global table, only the POU's own
+    declarations are added.
+    """
+    table = symbols.local(pou.name)
+    for var_section in DECLARED_SECTIONS:
+        for var in getattr(pou.interface, var_section):
+            table.current_scope.add_symbol(Symbol(var.name, None, 'variable', location=var))
+    return table
+
+def _as_tokens(code) -> List[Token]:
+    return tokenize(code) if isinstance(code, str) else code
+
+def find_non_standard_functions(tokens, lexicon: Lexicon = LEXICON):
     """
-    Identify non-standard function calls in an ST language string.
+    Identify non-standard function calls in an ST token stream.
     
     Args:
-        st_string (str): The Structured Text string to analyze.
+        tokens (list[Token] | str): Token stream (or code) of the ST body.
+        lexicon (Lexicon): Keywords and standard functions (case-insensitive).
     
     Returns:
-        list: List of tuples (function_name, start_pos, end_pos) for non-standard calls.
+        list: Names of the non-standard functions called, in order of first call.
     """
-    # Convert standard function names to a set for O(1) lookups
-    standard_functions = set(STANDARD_FUNCTIONS + ST_KEYWORDS)
-    
-    # Define the pattern for a function call: word followed by parentheses with content
-    # \b ensures we match whole words
-    # (\w+) captures the function name
-    # \s* allows optional spaces before parentheses
-    # \([^)]*\) matches the parentheses and their contents
-    pattern = r'\b(\w+)\s*\([^)]*\)'
-    
-    # Find all function calls in the string
-    matches = re.finditer(pattern, st_string)
-    
-    # List to store non-standard function calls
+    # A call is a word followed by '(', member calls (fb.Method()) are not functions
     non_standard_calls = []
-    
-    # Check each match
-    for match in matches:
-        function_name = match.group(1)  # Extract the function name
-        if function_name not in standard_functions:
-            # Record the name and its position in the string
-            non_standard_calls.append(function_name)
-    
+    seen = set()
+    prev = None
+    prev_prev = None
+    for tok in code_tokens(_as_tokens(tokens)):
+        if tok.text == '(' and prev is not None and prev.kind in WORD_KINDS \
+                and not (prev_prev is not None and prev_prev.text == '.'):
+            if prev.text not in seen and not lexicon.is_reserved(prev.text):
+                seen.add(prev.text)
+                non_standard_calls.append(prev.text)
+        prev_prev, prev = prev, tok
+
     return non_standard_calls
 
 def tokenize_st_code(code):
     """Tokenize ST code into words, operators, and punctuation, treating ':=' and '=>' as single tokens."""
-    # Pattern explanation:
-    # :=|=>          : Match ':=' or '=>' as single tokens
-    # |\w+           : Match one or more word characters (letters, digits, underscores)
-    # |[^\w\s]       : Match any single non-word, non-space character
-    pattern = r':=|=>|\w+|[^\w\s]'
-    tokens = re.findall(pattern, code, re.UNICODE)
-    return tokens
+    return [tok.text for tok in code_tokens(_as_tokens(code))]
 
 def is_identifier(token):
     """Check if a token matches the variable identifier pattern."""
@@ -123,21 +134,20 @@ def is_identifier(token):
 
 def is_keyword(token):
     """Check if a token is an ST keyword (case-insensitive)."""
-    return token.upper() in ST_KEYWORDS
+    return LEXICON.is_keyword(token)
 
-def extract_variable_identifiers(code):
-    """Extract variable identifiers from ST code, including those in function arguments."""
-    tokens = tokenize_st_code(code)
-    logger.debug(f"Tokens: {tokens}")
+def extract_variable_identifiers(tokens):
+    """Extract variable identifiers from an ST token stream, including those in function arguments."""
+    tokens = list(code_tokens(_as_tokens(tokens)))
     variable_identifiers = []
     in_function_call = False
     function_call_depth = 0
     prev_token = None
 
-    for i, token in enumerate(tokens):
+    for i, tok in enumerate(tokens):
+        token = tok.text
         # Track function call context
-        logger.debug(f"current token: {token}, prev token: {prev_token}")
-        if token == '(' and prev_token and is_identifier(prev_token) and not is_keyword(prev_token):
+        if token == '(' and prev_token is not None and prev_token.kind in NAME_KINDS:
             in_function_call = True
             function_call_depth = 1
         elif token == '(':
@@ -150,29 +160,25 @@ def extract_variable_identifiers(code):
                     in_function_call = False
         
         # Process potential variable identifiers
-        if is_identifier(token) and not is_keyword(token) and not tokenize_literals(token):
-            # MODIFICATION: If prev_token was '.', then 'token' is an attribute, not a standalone variable.
-            if prev_token == '.':
-                logger.debug(f"Skipping attribute '{token}' as it follows '.'. prev_token='{prev_token}'")
+        if tok.kind == IDENTIFIER:
+            # If prev_token was '.', then 'token' is an attribute, not a standalone variable.
+            if prev_token is not None and prev_token.text == '.':
                 continue
-            # Original logic for identifying variables/parameters:
+            next_token = tokens[i + 1].text if i + 1 < len(tokens) else None
             if in_function_call:
                 # Case 1: Identifier after ':=' or '=>' is a variable
-                logger.debug(f"current token: {token}, prev token: {prev_token}")
-                if prev_token in [':=', '=>']:
+                if prev_token is not None and prev_token.text in [':=', '=>']:
                     variable_identifiers.append(token)
                 # Case 2: Identifier not followed by ':=', '=>', or '(' is a positional argument
-                elif i + 1 >= len(tokens) or tokens[i + 1] not in [':=', '=>', '(']:
+                elif next_token not in [':=', '=>', '(']:
                     variable_identifiers.append(token)
                 # Identifiers followed by ':=' or '=>' are parameter names and skipped
             else:
                 # Outside function calls, skip function names followed by '('
-                if i + 1 < len(tokens) and tokens[i + 1] == '(':
-                    prev_token = token
-                    continue
-                variable_identifiers.append(token)
+                if next_token != '(':
+                    variable_identifiers.append(token)
         
-        prev_token = token
+        prev_token = tok
 
     # Remove duplicates while preserving order
     seen = set()
@@ -202,20 +208,38 @@ def create_func_instance(interface: Interface, func_list = None) -> None:
         # add to interface
         interface.localVars.append(var)
 
-def modify_ST_func_call(st: ST, func_list = None) -> None:
+def modify_ST_func_call(st: ST, func_list = None, tokens: List[Token] = None, edits: EditBuffer = None) -> None:
     """
     Modify the function calls in the ST code to use the new function instances.
+    Every code occurrence of the names gets an '_FC' insert edit, comments and
+    string literals are left untouched. When `edits` is given the edits are only
+    recorded there and the caller applies them together with its other rewrites.
     """
-    for func in func_list:
-        st.xhtml = re.sub(r'\b' + func + r'\b', func + '_FC', st.xhtml)
+    if not func_list:
+        return
+    funcs = set(func_list)
+    tokens = tokenize(st.xhtml) if tokens is None else tokens
+    buffer = EditBuffer(st.xhtml) if edits is None else edits
+    for tok in tokens:
+        if tok.kind in WORD_KINDS and tok.text in funcs:
+            buffer.insert(tok.end, '_FC')
+    if edits is None:
+        st.xhtml = buffer.apply()
 
-def add_missing_vars(exist_vars, all_vars, interface: Interface):
+def add_missing_vars(exist_vars, all_vars, interface: Interface, symbols=None):
     missing_vars = [var for var in all_vars if var not in exist_vars]
     logger.debug(f"Missing vars: {missing_vars}")
 
-    if missing_vars:
-        with open(gvars_path, 'r', encoding='utf-8') as f:
-            gvars_string = f.read()
+    if missing_vars and symbols is not None:
+        # global declarations come from the shared table, vars.xml is not read again
+        missing = set(missing_vars)
+        for sym in global_variables(symbols):
+            if sym.name in missing:
+                logger.debug(f"Adding missing var '{sym.name}' to interface.")
+                interface.externalVars.append(Variable.parse(sym.location))
+    elif missing_vars:
+        with open_input(find_input(gvars_path)) as f:
+            gvars_string = f.read().decode('utf-8')
         gvars_root = ET.fromstring(gvars_string.strip())
         for gvs in gvars_root:
             if gvs.tag != 'globalVars':
@@ -229,16 +253,16 @@ def add_missing_vars(exist_vars, all_vars, interface: Interface):
                     logger.warning(f"Found variable without name: {var}")
 
 def remove_comments(code):
-    # Remove multi-line comments  (* ... *)
-    # The DOTALL flag makes '.' match newlines as well.
-    # Non-greedy '.*?' ensures it matches the shortest possible block.
-    code = re.sub(r'\(\*.*?\*\)', '', code, flags=re.DOTALL)
-    # Remove single-line comments // ...
-    code = re.sub(r'//.*', '', code)
-    return code
+    # Drop the (* ... *), /* ... */ and // ... comment tokens
+    return "".join(tok.text for tok in _as_tokens(code) if tok.kind != COMMENT)
 
 # Example usage
-def process_xml(input_file, output_file):
+def process_xml(input_file, output_file, tree_cache=None, symbols=None, manifest_dir=MANIFEST_DIR):
+    """
+    Convert one ST POU. `symbols` is the frozen global symbol table written by
+    Stage1 (vars.xml and the project's POUs are then not scanned again). The
+    manifest record of the POU is written to `manifest_dir` and returned.
+    """
     with open(input_file, 'r', encoding='utf-8') as f:
         xml_string = f.read()
     root = ET.fromstring(xml_string.strip())
@@ -257,40 +281,63 @@ def process_xml(input_file, output_file):
             pou.body = body
     repr(pou.body.ST)
     # get declared vars
-    exist_vars = get_declared_vars(pou.interface)
+    if symbols is not None:
+        exist_vars = set(local_symbol_table(symbols, pou).current_scope.symbols)
+        lexicon = load_lexicon(pou_paths=()).extend(project=pou_names(symbols))
+    else:
+        exist_vars = get_declared_vars(pou.interface)
+        lexicon = load_lexicon()
     logger.debug(f"Declared vars: {exist_vars}")
 
-    # Extract variable identifiers from the ST code
-    code = pou.body.ST.xhtml
-    code = remove_comments(code)
-    variable_identifiers = extract_variable_identifiers(code)
+    # Tokenize the ST code once, every analysis below reads this stream
+    tokens = tokenize(pou.body.ST.xhtml)
+    # Variables and calls come from the parse tree, the token heuristics are
+    # the fallback for bodies outside the grammar
+    analysis = analyze_body(tokens, tree_cache, pou.name) if analyze_body is not None else None
+    if analysis is not None:
+        variable_identifiers = analysis.variables
+        non_standard = [name for name in analysis.calls if not lexicon.is_reserved(name)]
+    else:
+        logger.debug("Falling back to token based analysis.")
+        variable_identifiers = extract_variable_identifiers(tokens)
+        non_standard = find_non_standard_functions(tokens, lexicon)
     logger.debug(f"Variable identifiers: {variable_identifiers}")
 
-    # Find non-standard function calls
-    non_standard = find_non_standard_functions(code)
     pou_to_change_type = []
     for func_name in non_standard:
         logger.debug(f"Non-standard function: {func_name}")
         if func_name not in exist_vars:
+            if lexicon.classify_call(func_name) == UNKNOWN:
+                logger.warning(f"Call to {func_name} which is neither a project nor a library POU")
             logger.debug(f"Creating function instance for {func_name}")
             pou_to_change_type.append(func_name)
     create_func_instance(pou.interface, pou_to_change_type)
-    modify_ST_func_call(pou.body.ST, pou_to_change_type)
-    # write pou_to_change_type to an output file
-    with open("ST/Outputs/change.txt", 'a', encoding='utf-8') as f:
-        f.write("\n".join(pou_to_change_type))
-    
+    # rewrites record edits against the token spans, applied once below
+    edits = EditBuffer(pou.body.ST.xhtml)
+    modify_ST_func_call(pou.body.ST, pou_to_change_type, tokens, edits)
+    pou.body.ST.xhtml = edits.apply()
     # add missing vars
     all_vars = variable_identifiers
     all_vars = sorted(all_vars)
     logger.debug(f"All vars: {all_vars}")
-    add_missing_vars(exist_vars, all_vars, pou.interface)
+    add_missing_vars(exist_vars, all_vars, pou.interface, symbols)
     
     # regenerate the XML
     pou_element = pou.to_xml()
-    xml_str = ET.tostring(pou_element, encoding='utf-8')
+    xml_str = tostring(pou_element, FRAGMENT_NAMESPACES)
     fd = os.open(output_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
     os.write(fd, xml_str)
+    os.close(fd)
+
+    # the POUs in pou_to_change_type become function blocks in Stage3
+    record = make_record(
+        pou.name, pou.pouType, "ST", output_file, xml_str,
+        globals_=[var.name for var in pou.interface.externalVars],
+        instances=pou_to_change_type,
+    )
+    if manifest_dir is not None:
+        write_record(record, manifest_dir)
+    return record
         
     
 
@@ -308,12 +355,19 @@ def main():
         default=DEFAULT_OUTPUT,
         help='Output XML file path (default: %(default)s)'
     )
-    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Always parse the body, do not read or write the parse tree cache'
+    )
+
     args = parser.parse_args()
     if args.input != DEFAULT_INPUT and args.output == DEFAULT_OUTPUT:
         args.output = args.input.replace("_preprocess", "_out").replace("Inters", "Outputs")
         logger.debug(f"Output file path: {args.output}")
-    process_xml(args.input, args.output)
+    tree_cache = None if args.no_cache or TreeCache is None else TreeCache()
+    symbols = load_symbol_table() if load_symbol_table is not None else None
+    process_xml(args.input, args.output, tree_cache, symbols)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,4 +1,5 @@
 import argparse
+import io
 import sys
 sys.path.append("../")
 import os
@@ -6,10 +7,23 @@ from LD.Schema.Elements import Type, Variable
 import xml.etree.ElementTree as ET
 
 from enum import Enum
+from typing import Callable, List, Optional
+
+from Utils.compression import (
+    COMPRESS_ENV, COMPRESSIONS, compressed_path, compression_from_env, find_input, open_input, open_output,
+    remove_variants,
+)
+from Utils.memory import MAX_MEMORY_ENV, format_size, max_memory_from_env, parse_size, peak_rss
 
 from Logs.colorLogger import get_color_logger
 logger = get_color_logger("PREPROCESS")
 
+try:
+    from ST.Analyze.symbols import build_symbol_table, save_symbol_table
+except ImportError:
+    # lark is optional, the ST stage then runs without the global symbol table
+    build_symbol_table = save_symbol_table = None
+
 # Define the elements to be removed
 # !!! WARNING: vendorElement maybe reinstated in the future !!!
 class LanCategory(Enum):
@@ -31,6 +45,7 @@ DEFAULT_INPUT = "../data/Inputs/PIDControl.xml"
 var_output = "../data/Inters/vars.xml"
 type_output = "Type/Inputs/types.xml"
 task_output = "Task/Inputs/tasks.xml"
+symbols_output = "../data/Inters/symbols.pickle"
 
 def extract_datatype_elements(root: ET.Element, output_dir = type_output):
     dts = ET.Element("dataTypes")
@@ -40,6 +55,43 @@ def extract_datatype_elements(root: ET.Element, output_dir = type_output):
     types.append(dts)
     ET.ElementTree(types).write(output_dir, encoding="utf-8", xml_declaration=False)
 
+def categorize(root: ET.Element) -> LanCategory:
+    body = root.find("body")
+    if body is None:
+        logger.error("Body element not found in XML tree.")
+        return None
+    lan_LD = body.find("LD")
+    if lan_LD is not None:
+        return LanCategory.LD
+    lan_ST = body.find("ST")
+    if lan_ST is not None:
+        return LanCategory.ST
+    return None
+
+def write_pou_element(pou: ET.Element, output_dir = None) -> None:
+    """Save one <pou> to T_<name>.xml in output_dir, or in the directory of its language."""
+    # Extract the name attribute
+    name = pou.get("name")
+    if not name:
+        return
+    category = categorize(pou)
+    target_dir = output_dir
+    if target_dir is None:
+        if category == LanCategory.LD:
+            target_dir = LD_OUTPUT_DIR
+        elif category == LanCategory.ST:
+            target_dir = ST_OUTPUT_DIR
+        else:
+            logger.error(f"Unknown language category for POU '{name}'. Skipping.")
+            return
+    # Create dir and output filename
+    os.makedirs(target_dir, exist_ok=True)
+    output_file = os.path.join(target_dir, f"T_{name}.xml")
+    pou_tree = ET.ElementTree(pou)
+    # Write to output file
+    pou_tree.write(output_file, encoding="utf-8", xml_declaration=False)
+    logger.debug(f"Extracted POU '{name}' to {output_file}")
+
 def extract_pou_elements(root: ET.Element, output_dir = None):
     """
     Extract all <pou> elements from an XML file and save them to separate files.
@@ -48,44 +100,11 @@ def extract_pou_elements(root: ET.Element, output_dir = None):
         input_file (str): Path to the input XML file
         output_dir (str): Directory to store the extracted POU files
     """
-    def categorize(root: ET.Element) -> LanCategory:
-        body = root.find("body")
-        if body is None:
-            logger.error("Body element not found in XML tree.")
-            return None
-        lan_LD = body.find("LD")
-        if lan_LD is not None:
-            return LanCategory.LD
-        lan_ST = body.find("ST")
-        if lan_ST is not None:
-            return LanCategory.ST
-        return None
-
-
     # Find all pou elements using XPath expression
     for pou in root.findall(".//pou"):
-        # Extract the name attribute
-        name = pou.get("name")
-        if name:
-            category = categorize(pou)
-            target_dir = output_dir
-            if target_dir is None:
-                if category == LanCategory.LD:
-                    target_dir = LD_OUTPUT_DIR
-                elif category == LanCategory.ST:
-                    target_dir = ST_OUTPUT_DIR
-                else:
-                    logger.error(f"Unknown language category for POU '{name}'. Skipping.")
-                    continue
-            # Create dir and output filename
-            os.makedirs(target_dir, exist_ok=True)
-            output_file = os.path.join(target_dir, f"T_{name}.xml")
-            pou_tree = ET.ElementTree(pou)
-            # Write to output file
-            pou_tree.write(output_file, encoding="utf-8", xml_declaration=False)
-            logger.debug(f"Extracted POU '{name}' to {output_file}")
-
-def deal_mixed_globalVars(root: ET.Element) -> None:
+        write_pou_element(pou, output_dir)
+
+def deal_mixed_globalVars(root: ET.Element, sink: Optional[Callable[[ET.Element], None]] = None) -> None:
     logger.debug("Processing MixedAttrsVarList.")
     if root.tag != "MixedAttrsVarList":
         logger.error(f"Root tag is {root.tag} NOT'MixedAttrsVarList'. Failed to process mixAttrList.")
@@ -94,7 +113,7 @@ def deal_mixed_globalVars(root: ET.Element) -> None:
     for gv in gvs:
         retain = gv.get("retain") == "true"
         constant = gv.get("constant") == "true"
-        deal_globalVars(gv, retain, constant)
+        deal_globalVars(gv, retain, constant, sink)
         
 
 
@@ -139,7 +158,8 @@ def deal_mixed_globalVars(root: ET.Element) -> None:
         </globalVars>
 '''
 
-def deal_globalVars(root: ET.Element, retain = False, constant = False) -> None:
+def deal_globalVars(root: ET.Element, retain = False, constant = False,
+                    sink: Optional[Callable[[ET.Element], None]] = None) -> None:
     if root.tag != "globalVars":
         logger.error("Root tag is not 'globalVars'. Failed to extract global vars.")
         return
@@ -153,7 +173,7 @@ def deal_globalVars(root: ET.Element, retain = False, constant = False) -> None:
                 mix = data.find("MixedAttrsVarList")
                 if mix is not None:
                     is_mixed = True
-                    deal_mixed_globalVars(mix)
+                    deal_mixed_globalVars(mix, sink)
     if is_mixed:
         return
     # construct the globalVars element based on the retain and constant attributes
@@ -169,8 +189,8 @@ def deal_globalVars(root: ET.Element, retain = False, constant = False) -> None:
             global_vars.append(var)
         else:
             pass
-    # append globalVars to the gv_root
-    gv_root.append(global_vars)
+    # append globalVars to the gv_root, or hand it to the streaming writer
+    (sink or gv_root.append)(global_vars)
                             
 def extract_global_vars(root: ET.Element) -> None:
     if root.tag != "project":
@@ -188,8 +208,24 @@ def extract_global_vars(root: ET.Element) -> None:
                         constant = gv.get("constant") == "true"
                         deal_globalVars(gv, retain, constant)
     # write the gv_root to file from the beginning
-    ET.ElementTree(gv_root).write(var_output, encoding='utf-8', xml_declaration=False)
+    with open_output(var_output) as f:
+        ET.ElementTree(gv_root).write(f, encoding='utf-8', xml_declaration=False)
+
 
+def extract_symbol_table(root: ET.Element, output_file = None) -> None:
+    """
+    Global symbol table (global vars, data types, POU signatures) for the ST
+    stage, built once here instead of once per POU.
+    """
+    output_file = output_file or symbols_output
+    if build_symbol_table is None:
+        logger.debug("lark is not installed, skipping the global symbol table.")
+        # never leave the table of a previous project behind
+        remove_variants(output_file)
+        return
+    table = build_symbol_table(gv_root, root.findall(".//dataType"), root.findall(".//pou"))
+    save_symbol_table(table, output_file)
+    logger.debug(f"Wrote {len(table.global_scope.symbols)} global symbols to {output_file}")
 
 def remove_unsupported_elements(parent):
     """Recursively remove unsupported elements from the XML tree."""
@@ -199,27 +235,34 @@ def remove_unsupported_elements(parent):
         else:
             remove_unsupported_elements(elem)  # Recursively check children
 
-def strip_namespace(root: ET.Element) -> str:
-    # Parse the XML string into an ElementTree object
+def local_name(tag: str) -> str:
+    # Check if the tag includes a namespace (indicated by '}')
+    if '}' in tag:
+        # Extract the local name by splitting at '}' and taking the part after it
+        return tag.split('}', 1)[1]
+    return tag
+
+def strip_namespace_tags(root: ET.Element) -> None:
     logger.debug("Stripping namespace from XML tree.")
-    
     # Iterate through all elements in the XML tree
     for elem in root.iter():
-        # Check if the tag includes a namespace (indicated by '}')
-        if '}' in elem.tag:
-            # Extract the local name by splitting at '}' and taking the part after it
-            elem.tag = elem.tag.split('}', 1)[1]
-    
+        elem.tag = local_name(elem.tag)
+
+def strip_namespace(root: ET.Element) -> str:
+    strip_namespace_tags(root)
     # Serialize the modified tree back to a string
     return ET.tostring(root, encoding='unicode')
 
 def deal_task(input_file = DEFAULT_TASK_INPUT):
+    # TASK.xml may also be given as TASK.xml.gz or TASK.xml.xz
+    input_file = find_input(input_file)
     # find if the input file exists
     if not os.path.exists(input_file):
         logger.warning(f"Input file {input_file} does not exist. Skipping task processing.")
         return
     
-    root = ET.parse(input_file).getroot()
+    with open_input(input_file) as f:
+        root = ET.parse(f).getroot()
     # strip the namespace
     modified_xml = strip_namespace(root)
     # write the modified XML to a file
@@ -277,21 +320,145 @@ def main_routine(input_file):
     tree = ET.parse(input_file)
     root = tree.getroot()
     
-    modified_xml = strip_namespace(root)
-    root = ET.fromstring(modified_xml)
+    # in place, serializing and parsing the tree again gives the same tree
+    strip_namespace_tags(root)
     # clear var_out file
-    with open(var_output, 'w', encoding='utf-8') as f:
-        f.write("")
+    with open_output(var_output):
+        pass
     # extract global vars
     extract_global_vars(root)
     # extract pou elements
     extract_pou_elements(root)
+    # build the global symbol table before the data types are moved out of root
+    extract_symbol_table(root)
     # extract data type elements
     extract_datatype_elements(root)
     # deal with task elements FROM ANOTHER FILE
     deal_task(DEFAULT_TASK_INPUT)
     # TBD: extract configuration elements           
 
+# Bounded memory mode: the export is read with iterparse and every POU,
+# dataType and global vars block is written out as soon as it is complete,
+# then dropped. What stays in memory is what the global symbol table needs:
+# the global vars, the data types and the POU interfaces (not their bodies).
+GLOBAL_VARS_PATH = ("project", "addData", "data", "resource", "globalVars")
+# subtrees that are kept until they are complete
+KEPT_TAGS = ("pou", "dataType", "globalVars")
+
+class StreamWriter:
+    """
+    Writes the children of one wrapper element to a file as they come, the
+    same bytes as ElementTree.write of the whole wrapper.
+    """
+    def __init__(self, path: str, open_tags: str, close_tags: str, empty: str):
+        self.path = path
+        self.open_tags = open_tags
+        self.close_tags = close_tags
+        self.empty = empty
+        self.f = io.TextIOWrapper(open_output(path), encoding="utf-8")
+        self.count = 0
+
+    def write(self, elem: ET.Element) -> None:
+        if self.count == 0:
+            self.f.write(self.open_tags)
+        self.f.write(ET.tostring(elem, encoding="unicode"))
+        self.count += 1
+
+    def close(self) -> None:
+        self.f.write(self.close_tags if self.count else self.empty)
+        self.f.close()
+
+def pou_signature(pou: ET.Element) -> ET.Element:
+    """The part of a POU the symbol table reads: its attributes and interface."""
+    signature = ET.Element("pou", pou.attrib)
+    interface = pou.find("interface")
+    if interface is not None:
+        signature.append(interface)
+    return signature
+
+def stream_routine(input_file, max_memory: Optional[int] = None):
+    keep_symbols = build_symbol_table is not None
+    gv_writer = StreamWriter(var_output, "<resource>", "</resource>", "<resource />")
+    dt_writer = StreamWriter(type_output, "<types><dataTypes>", "</dataTypes></types>", "<types><dataTypes /></types>")
+    global_vars: List[ET.Element] = []
+    data_types: List[ET.Element] = []
+    signatures: List[ET.Element] = []
+
+    def write_global_vars(elem: ET.Element) -> None:
+        gv_writer.write(elem)
+        if keep_symbols:
+            global_vars.append(elem)
+
+    def flush(kind: str, elem: ET.Element, parent: Optional[ET.Element], nested: bool) -> None:
+        # elem.tail is known now, the parser has moved past it
+        if kind == "pou":
+            write_pou_element(elem)
+            if keep_symbols:
+                signatures.append(pou_signature(elem))
+        else:
+            dt_writer.write(elem)
+            if keep_symbols:
+                data_types.append(elem)
+        if nested:
+            # part of a POU that is not written yet
+            return
+        if parent is not None:
+            parent.remove(elem)
+        if kind == "pou" or not keep_symbols:
+            elem.clear()
+
+    stack: List[ET.Element] = []
+    pending = []
+    kept = 0
+    try:
+        for event, elem in ET.iterparse(input_file, events=("start", "end")):
+            while pending:
+                flush(*pending.pop(0))
+            if event == "start":
+                elem.tag = local_name(elem.tag)
+                stack.append(elem)
+                if elem.tag in KEPT_TAGS:
+                    kept += 1
+                continue
+            stack.pop()
+            parent = stack[-1] if stack else None
+            tag = elem.tag
+            if tag in KEPT_TAGS:
+                kept -= 1
+            if tag in ("pou", "dataType"):
+                # the file of a POU and types.xml also hold the tail after it
+                pending.append((tag, elem, parent, kept > 0))
+            elif tag == "globalVars" and len(stack) == 4 and tuple(e.tag for e in stack) == GLOBAL_VARS_PATH[:-1]:
+                deal_globalVars(elem, elem.get("retain") == "true", elem.get("constant") == "true", write_global_vars)
+                parent.remove(elem)
+                elem.clear()
+            elif kept == 0 and parent is not None:
+                # nothing below elem is needed any more
+                parent.remove(elem)
+                elem.clear()
+        for item in pending:
+            flush(*item)
+    finally:
+        gv_writer.close()
+        dt_writer.close()
+
+    if keep_symbols:
+        vars_root = ET.Element("resource")
+        vars_root.extend(global_vars)
+        table = build_symbol_table(vars_root, data_types, signatures)
+        save_symbol_table(table, symbols_output)
+        logger.debug(f"Wrote {len(table.global_scope.symbols)} global symbols to {symbols_output}")
+    else:
+        extract_symbol_table(None)
+    # deal with task elements FROM ANOTHER FILE
+    deal_task(DEFAULT_TASK_INPUT)
+
+    peak = peak_rss()
+    if max_memory is not None and peak > max_memory:
+        logger.warning(f"Stage1 peaked at {format_size(peak)}, above --max-memory {format_size(max_memory)}")
+    else:
+        logger.debug(f"Stage1 peaked at {format_size(peak)}")
+
 def main():
     parser = argparse.ArgumentParser(
         description="Designate the source project file to convert."
@@ -299,7 +466,25 @@ def main():
     parser.add_argument(
         '-i', '--input',
         default=DEFAULT_INPUT,
-        help='Input source project file path (default: %(default)s)'
+        help='Input source project file path, plain or gzip, xz or zip compressed (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--member',
+        default=None,
+        help='XML file to read inside a zip input (default: its only .xml file)'
+    )
+    parser.add_argument(
+        '--compress',
+        choices=COMPRESSIONS,
+        default=compression_from_env(),
+        help=f'Write vars.xml and the symbol table in ../data/Inters compressed (default: ${COMPRESS_ENV}, else plain)'
+    )
+    parser.add_argument(
+        '--max-memory',
+        type=parse_size,
+        default=max_memory_from_env(),
+        metavar='SIZE',
+        help=f'Bounded memory mode: stream the export instead of loading it, e.g. 512M or 2G (default: ${MAX_MEMORY_ENV})'
     )
 
     args = parser.parse_args()
@@ -308,7 +493,24 @@ def main():
         logger.error(f"Input file {input_file} does not exist. Exiting.")
         sys.exit(1)
 
-    main_routine(input_file)
+    global var_output, symbols_output
+    var_output = compressed_path(var_output, args.compress)
+    symbols_output = compressed_path(symbols_output, args.compress)
+    # the readers take whichever variant exists, the one of a previous run must go
+    remove_variants(var_output, keep=var_output)
+    remove_variants(symbols_output, keep=symbols_output)
+
+    try:
+        source = open_input(input_file, args.member)
+    except ValueError as e:
+        logger.error(f"{e}. Exiting.")
+        sys.exit(1)
+    # compressed inputs are decompressed while the parser reads them
+    with source:
+        if args.max_memory is not None:
+            stream_routine(source, args.max_memory)
+        else:
+            main_routine(source)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""
+Memory check for the bounded memory mode of Stage1: generates an export of a
+given size, runs Stage1 on it with --max-memory in a child interpreter and
+fails if the peak RSS of that child goes above the ceiling.
+"""
+import sys
+sys.path.append('..')
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from Utils.memory import format_size, parse_size, peak_rss
+
+from Logs.colorLogger import get_color_logger
+logger = get_color_logger("STRESS")
+
+DEFAULT_SIZE = "1G"
+DEFAULT_CEILING = "256M"
+DEFAULT_POU_SIZE = "256K"
+DEFAULT_GLOBALS = 20000
+DEFAULT_TYPES = 2000
+STAGE1_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "preprocess.py")
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# directories Stage1 writes to, relative to the src directory it runs in
+OUTPUT_DIRS = ["LD/Inputs", "ST/Inputs", "Type/Inputs", "Task/Inputs", "../data/Inters"]
+
+HEADER = """<?xml version="1.0" encoding="utf-8"?>
+<project xmlns="http://www.plcopen.org/xml/tc6_0200">
+  <fileHeader companyName="stress" productName="stress" productVersion="1" creationDateTime="2025-01-01T00:00:00" />
+  <contentHeader name="stress.project" modificationDateTime="2025-01-01T00:00:00" />
+  <types>
+    <dataTypes />
+    <pous />
+  </types>
+  <instances>
+    <configurations />
+  </instances>
+  <addData>
+    <data name="http://www.3s-software.com/plcopenxml/application" handleUnknown="implementation">
+      <resource name="Application">
+"""
+FOOTER = """      </resource>
+    </data>
+  </addData>
+</project>
+"""
+GLOBAL_VAR = """          <variable name="g{index}">
+            <type>
+              <{type} />
+            </type>
+          </variable>
+"""
+DATA_TYPE = """            <dataType name="ST_Stress{index}">
+              <baseType>
+                <struct>
+                  <variable name="a">
+                    <type>
+                      <INT />
+                    </type>
+                  </variable>
+                  <variable name="b">
+                    <type>
+                      <REAL />
+                    </type>
+                  </variable>
+                </struct>
+              </baseType>
+            </dataType>
+"""
+POU_HEAD = """            <pou name="FB_Stress{index}" pouType="functionBlock">
+              <interface>
+                <inputVars>
+                  <variable name="x">
+                    <type>
+                      <INT />
+                    </type>
+                  </variable>
+                </inputVars>
+                <localVars>
+                  <variable name="y">
+                    <type>
+                      <INT />
+                    </type>
+                  </variable>
+                  <variable name="s">
+                    <type>
+                      <derived name="ST_Stress{type_index}" />
+                    </type>
+                  </variable>
+                </localVars>
+              </interface>
+              <body>
+                <ST>
+                  <xhtml xmlns="http://www.w3.org/1999/xhtml">"""
+POU_TAIL = """</xhtml>
+                </ST>
+              </body>
+              <addData />
+            </pou>
+"""
+# one line of an ST body, already escaped
+STATEMENTS = [
+    "IF x &gt; {n} AND g{g} THEN y := y + {n}; END_IF;\n",
+    "s.a := s.a * 2 + x; (* {n} *)\n",
+    "WHILE y &lt; {n} DO y := y + 1; END_WHILE;\n",
+]
+GLOBAL_TYPES = ["BOOL", "INT", "REAL", "DINT"]
+
+def write_body(f, index: int, pou_size: int, globals_count: int) -> None:
+    written = 0
+    n = 0
+    while written < pou_size:
+        line = STATEMENTS[n % len(STATEMENTS)].format(n=n, g=(index + n) % max(1, globals_count))
+        f.write(line)
+        written += len(line)
+        n += 1
+
+def generate_export(path: str, size: int, pou_size: int, globals_count: int, types_count: int) -> int:
+    """Write an export of about `size` bytes, mostly ST bodies; returns its POU count."""
+    pous = max(1, size // pou_size)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(HEADER)
+        f.write('        <globalVars name="GVL_Stress">\n')
+        for i in range(globals_count):
+            f.write(GLOBAL_VAR.format(index=i, type=GLOBAL_TYPES[i % len(GLOBAL_TYPES)]))
+        f.write("        </globalVars>\n")
+        f.write("        <addData>\n")
+        f.write('          <data name="http://www.3s-software.com/plcopenxml/datatype" handleUnknown="implementation">\n')
+        for i in range(types_count):
+            f.write(DATA_TYPE.format(index=i))
+        f.write("          </data>\n")
+        f.write('          <data name="http://www.3s-software.com/plcopenxml/pou" handleUnknown="implementation">\n')
+        for i in range(pous):
+            f.write(POU_HEAD.format(index=i, type_index=i % max(1, types_count)))
+            write_body(f, i, pou_size, globals_count)
+            f.write(POU_TAIL)
+        f.write("          </data>\n")
+        f.write("        </addData>\n")
+        f.write(FOOTER)
+    return pous
+
+def run_stage1(export: str, work_dir: str, max_memory: int) -> int:
+    """Run Stage1 in bounded mode from work_dir/src, returns the child's peak RSS."""
+    src = os.path.join(work_dir, "src")
+    for directory in OUTPUT_DIRS:
+        os.makedirs(os.path.join(src, directory), exist_ok=True)
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [SRC_DIR, env.get("PYTHONPATH")]))
+    result = subprocess.run(
+        [sys.executable, STAGE1_SCRIPT, "--input", export, "--max-memory", str(max_memory)],
+        cwd=src, env=env)
+    if result.returncode != 0:
+        logger.error(f"Stage1 exited with {result.returncode}")
+        sys.exit(result.returncode)
+    # the only child waited for, so the largest one
+    peak = peak_rss(children=True)
+    if peak == 0:
+        logger.error("The peak RSS of a child cannot be measured on this platform")
+        sys.exit(1)
+    return peak
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that Stage1 --max-memory converts a large generated export within a memory ceiling."
+    )
+    parser.add_argument(
+        '--size',
+        type=parse_size,
+        default=DEFAULT_SIZE,
+        help='Size of the generated export (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--ceiling',
+        type=parse_size,
+        default=DEFAULT_CEILING,
+        help='Peak RSS Stage1 must stay below, also passed as --max-memory (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--pou-size',
+        type=parse_size,
+        default=DEFAULT_POU_SIZE,
+        help='Size of the ST body of each POU (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--globals',
+        type=int,
+        default=DEFAULT_GLOBALS,
+        help='Number of global variables (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--types',
+        type=int,
+        default=DEFAULT_TYPES,
+        help='Number of data types (default: %(default)s)'
+    )
+    parser.add_argument(
+        '--work-dir',
+        default=None,
+        help='Directory for the export and Stage1 outputs (default: a temporary one, removed afterwards)'
+    )
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="stage1-stress-")
+    os.makedirs(work_dir, exist_ok=True)
+    export = os.path.join(work_dir, "export.xml")
+    try:
+        start = time.perf_counter()
+        pous = generate_export(export, args.size, args.pou_size, args.globals, args.types)
+        logger.info(f"Generated {format_size(os.path.getsize(export))} export with {pous} POUs, "
+                    f"{args.globals} globals and {args.types} types in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        peak = run_stage1(export, work_dir, args.ceiling)
+        elapsed = time.perf_counter() - start
+        written = len(os.listdir(os.path.join(work_dir, "src", "ST", "Inputs")))
+        if written != pous:
+            logger.error(f"Stage1 wrote {written} of {pous} POUs")
+            sys.exit(1)
+        if peak > args.ceiling:
+            logger.error(f"Stage1 peaked at {format_size(peak)} in {elapsed:.1f}s, above the {format_size(args.ceiling)} ceiling")
+            sys.exit(1)
+        logger.info(f"Stage1 peaked at {format_size(peak)} in {elapsed:.1f}s, within the {format_size(args.ceiling)} ceiling")
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,18 @@ sys.path.append("../")
 
 from LD.Schema.Elements import Type, Variable
 import xml.etree.ElementTree as ET
+import argparse
+import hashlib
+import json
 import os
 import glob
+import re
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape, unescape
+
+from Utils.compression import find_input, open_input
+from Utils.manifest import ManifestIndex, load_index, save_index
+from Utils.plcxml import PROJECT_NAMESPACES, tostring
 
 from Logs.colorLogger import get_color_logger
 logger = get_color_logger("ASSEMBLE")
@@ -13,27 +23,48 @@ logger = get_color_logger("ASSEMBLE")
 BASE_XML_PATH = "../data/Base/beremiz_base2.xml"
 OUTPUT_PATH = "../data/Outputs/plc.xml"
 VARS_PATH = "../data/Inters/vars.xml"
-POU_CHANGE_PATH = "ST/Outputs/change.txt"
 POUS_PATH = ["LD/Outputs", "ST/Outputs"]
 TASK_PATH = "Task/Outputs/tasks.xml"
 TYPE_PATH = "Type/Outputs/types.xml"
-# Parse the base XML
-base_root = ET.parse(BASE_XML_PATH).getroot()
-# Parse the vars XML
-gvars_root = ET.parse(VARS_PATH).getroot()
-# Parse the tasks XML
-tasks_root = None
-if os.path.exists(TASK_PATH):
-    tasks_root = ET.parse(TASK_PATH).getroot()
-# Parse the types XML
-types_root = None
-if os.path.exists(TYPE_PATH):
-    types_root = ET.parse(TYPE_PATH).getroot()
-# Insert global vars to the base XML
-# First, find the <resource> tag in base XML
+# Only the project skeleton (base, tasks, types) is built as a tree. It is
+# serialized with these markers where the POUs and the global vars go, and
+# those are streamed into the output one by one, so memory does not grow with
+# the project. The output is final: namespaces, <xhtml:p> and CDATA bodies
+# are written by Utils.plcxml, there is no postprocess rewrite.
+# The output only depends on the converted files: POUs are written in the
+# order of their file names, and plc.xml.sha256 holds the hash of plc.xml so
+# deployment can skip an unchanged project by comparing hashes.
+HASH_SUFFIX = ".sha256"
+# Offset and length of every POU and global vars block in the last plc.xml,
+# with the stat and sha256 of the file it came from. The next run copies the
+# unchanged ones from the old plc.xml: a file with the same stat is not read
+# at all, one rewritten by its converter with the same bytes (LD/do.py and
+# ST/do.py rewrite every output) is recognised by its sha256, taken from its
+# manifest record when it has one.
+ASSEMBLY_INDEX_PATH = "../data/Inters/plc_index.json"
+ASSEMBLY_INDEX_VERSION = 2
+POUS_MARK = "__STREAM_POUS__"
+GVARS_MARK = "__STREAM_GLOBAL_VARS__"
+CHUNK_SIZE = 1 << 20
+POU_START_TAG = re.compile(rb"<pou(?=[\s/>])[^>]*>")
+POU_ATTRIBUTE = re.compile(rb'\s([\w:.-]+)="([^"]*)"')
+POU_FILE_NAME = re.compile(r"^T_(.*?)(?:_out)?\.xml$")
+NAMESPACE_DECLARATION = re.compile(rb'\sxmlns(?::([\w.-]+))?="([^"]*)"')
+
+def parse_optional(path: str) -> Optional[ET.Element]:
+    if not os.path.exists(path):
+        return None
+    return ET.parse(path).getroot()
+
+def append_mark(parent: ET.Element, mark: str) -> None:
+    """Put mark right after the last child of parent, where appended elements would go."""
+    if len(parent):
+        parent[-1].tail = (parent[-1].tail or "") + mark
+    else:
+        parent.text = (parent.text or "") + mark
 
 # TBD: not supporting multiple configurations yet
-def deal_configuration(root: ET.Element) -> None:
+def deal_configuration(root: ET.Element, tasks_root: Optional[ET.Element]) -> None:
     logger.debug("Processing configuration.")
     if root.tag != "configuration":
         logger.error(f"Root tag is {root.tag} NOT'configuration'. Failed to process configuration.")
@@ -57,38 +88,22 @@ def deal_configuration(root: ET.Element) -> None:
         for task_element in task_elements:
             resource.append(task_element)
 
-    # insert global vars
-    for gvar in gvars_root:
-        resource.append(gvar)
+    # global vars are streamed after the tasks by write_global_vars
+    append_mark(resource, GVARS_MARK)
 
-def deal_pous(root: ET.Element) -> None:
+def deal_pous(root: ET.Element) -> Optional[ManifestIndex]:
     if root.tag != "pous":
         logger.error(f"Root tag is {root.tag} NOT 'pous'. Failed to process pous.")
-        return
-    
-    # read the list of pou changes separated by new line
-    with open(POU_CHANGE_PATH, "r") as f:
-        pou_changes = f.read().splitlines()
+        return None
 
-    # Insert the pou files from POUS_PATH
-    for cur_dir in POUS_PATH:
-        files = glob.glob(f"{cur_dir}/T_*.xml")
-        for file in files:
-            logger.debug(f"Inserting {file}")
-            pou_root = ET.parse(file).getroot()
-            if pou_root.tag != "pou":
-                logger.error(f"Root tag is {pou_root.tag} NOT 'pou'. Failed to process pou.")
-                continue
-            name = pou_root.get("name")
-            if name is None:
-                logger.error(f"Failed to get 'name' attribute of pou.")
-                continue
-            if name in pou_changes:
-                logger.debug(f"Changing {name}'s pouType")
-                pou_root.set("pouType", "functionBlock")
-            root.append(pou_root)
+    # manifest records of the converted POUs, merged into one index by name
+    index = load_index()
+    save_index(index)
+    # the pou files are streamed here by write_pou
+    append_mark(root, POUS_MARK)
+    return index
 
-def deal_types(root: ET.Element) -> None:
+def deal_types(root: ET.Element, types_root: Optional[ET.Element]) -> None:
     if root.tag != "types":
         logger.error("Not <types> element!")
 
@@ -108,8 +123,320 @@ def deal_types(root: ET.Element) -> None:
     # insert the new dataTypes to the base XML
     root.insert(0, dts)
 
+def pou_files() -> list:
+    files = []
+    for cur_dir in POUS_PATH:
+        files.extend(glob.glob(f"{cur_dir}/T_*.xml"))
+    # glob order depends on the file system, the POU name in T_<name>_out.xml is canonical
+    return sorted(files, key=lambda path: (POU_FILE_NAME.sub(r"\1", os.path.basename(path)), path))
+
+class HashingWriter:
+    """
+    Writes through to f, hashes everything written and counts its bytes.
+    Ranges copied from another file are read when something else is written,
+    so adjacent ranges are copied at once.
+    """
+    def __init__(self, f: BinaryIO):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.position = 0
+        self.source = None
+        self.start = self.end = 0
+
+    def _write(self, data: bytes) -> None:
+        self.sha256.update(data)
+        self.f.write(data)
+
+    def write(self, data: bytes) -> int:
+        self.flush()
+        self._write(data)
+        self.position += len(data)
+        return len(data)
+
+    def copy(self, source: BinaryIO, offset: int, length: int) -> None:
+        if source is not self.source or offset != self.end:
+            self.flush()
+            self.source = source
+            self.start = offset
+        self.end = offset + length
+        self.position += length
+
+    def flush(self) -> None:
+        if self.end == self.start:
+            return
+        self.source.seek(self.start)
+        remaining = self.end - self.start
+        self.start = self.end
+        while remaining > 0:
+            chunk = self.source.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise EOFError(f"{self.source.name} is shorter than its assembly index")
+            self._write(chunk)
+            remaining -= len(chunk)
+
+def fingerprint(path: str) -> List[int]:
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def file_sha256(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def recorded_digest(path: str, stat: List[int], index: ManifestIndex, name: Optional[str]) -> str:
+    """
+    sha256 of the converted pou file path, from its manifest record if the
+    file is still the one the record was made for.
+    """
+    record = index.get(name) if name is not None else None
+    if (record is not None and record.get("stat") == stat
+            and os.path.normpath(record["output"]) == os.path.normpath(path)):
+        return record["sha256"]
+    return file_sha256(path)
+
+class PreviousOutput:
+    """
+    Segments of the previous plc.xml by (kind, key), as recorded in the
+    assembly index. Only used while plc.xml is the file the index describes.
+    """
+    def __init__(self, output_path: str, segments: Optional[List[dict]] = None):
+        self.output_path = output_path
+        self.segments: Dict[Tuple[str, str], dict] = {(seg["kind"], seg["key"]): seg for seg in segments or ()}
+        self.f = None
+
+    def __enter__(self):
+        if self.segments:
+            self.f = open(self.output_path, "rb")
+        return self
+
+    def __exit__(self, *exc):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def find(self, kind: str, key: str, stat: List[int], digest: Callable[[dict], str]) -> Optional[dict]:
+        """
+        The segment of key if its file did not change: same stat, or else same
+        sha256, digest(seg) is only called then. The segment returned is a copy
+        carrying the current stat.
+        """
+        seg = self.segments.get((kind, key))
+        if seg is None:
+            return None
+        if seg["stat"] != stat and seg.get("sha256") != digest(seg):
+            return None
+        return dict(seg, stat=stat)
+
+    def copy(self, seg: dict, out: HashingWriter) -> None:
+        out.copy(self.f, seg["offset"], seg["length"])
+
+def load_assembly_index(output_path: str, index_path: str = ASSEMBLY_INDEX_PATH) -> Optional[dict]:
+    """The assembly index, None unless it describes output_path as it is now."""
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if (data.get("version") == ASSEMBLY_INDEX_VERSION
+                and data.get("output") == os.path.abspath(output_path)
+                and data.get("stat") == fingerprint(output_path)
+                and isinstance(data["segments"], list)):
+            return data
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def save_assembly_index(output_path: str, segments: List[dict], index_path: str = ASSEMBLY_INDEX_PATH) -> None:
+    data = {
+        "version": ASSEMBLY_INDEX_VERSION,
+        "output": os.path.abspath(output_path),
+        "stat": fingerprint(output_path),
+        "segments": segments,
+    }
+    with open(index_path, "w", encoding="utf-8") as f:
+        # dumps uses the C encoder, dump to a file does not
+        f.write(json.dumps(data, ensure_ascii=False))
+
+def hash_path(output_path: str) -> str:
+    return output_path + HASH_SUFFIX
+
+def read_hash(output_path: str) -> Optional[str]:
+    """Recorded sha256 of output_path, None if either file is missing."""
+    if not os.path.exists(output_path) or not os.path.exists(hash_path(output_path)):
+        return None
+    with open(hash_path(output_path), "r", encoding="ascii") as f:
+        fields = f.read().split()
+    return fields[0] if fields else None
+
+def write_hash(output_path: str, digest: str) -> None:
+    # sha256sum format, `sha256sum -c plc.xml.sha256` checks it
+    with open(hash_path(output_path), "w", encoding="ascii") as f:
+        f.write(f"{digest}  {os.path.basename(output_path)}\n")
+
+def strip_declarations(tag: bytes) -> bytes:
+    """Drop the namespace declarations of a pou start tag that <project> already makes."""
+    def drop(match: re.Match) -> bytes:
+        prefix = (match.group(1) or b"").decode()
+        return b"" if PROJECT_NAMESPACES.get(prefix) == match.group(2).decode() else match.group()
+    return NAMESPACE_DECLARATION.sub(drop, tag)
+
+def write_pou(file: str, out: BinaryIO, index: ManifestIndex) -> Optional[Tuple[str, Optional[str], str, str]]:
+    """
+    Stream one converted pou file into out without parsing it, only its
+    start tag is rewritten: the pouType when the manifest says so, and the
+    namespace declarations the project makes. Returns the POU name, its
+    pouType in the file, the one written and the sha256 of the file, None if
+    nothing was written.
+    """
+    sha256 = hashlib.sha256()
+    with open(file, "rb") as f:
+        head = f.read(CHUNK_SIZE)
+        while b">" not in head and (more := f.read(CHUNK_SIZE)):
+            head += more
+        start = POU_START_TAG.match(head)
+        if start is None:
+            logger.error(f"Root tag of {file} is NOT 'pou'. Failed to process pou.")
+            return None
+        attributes = {key.decode(): unescape(value.decode("utf-8"), {"&quot;": '"'})
+                      for key, value in POU_ATTRIBUTE.findall(start.group())}
+        name = attributes.get("name")
+        if name is None:
+            logger.error(f"Failed to get 'name' attribute of pou.")
+            return None
+        tag = strip_declarations(start.group())
+        pou_type = index.pou_type(name, attributes.get("pouType"))
+        if pou_type != attributes.get("pouType"):
+            logger.debug(f"Changing {name}'s pouType")
+            value = escape(pou_type, {'"': "&quot;"}).encode()
+            if "pouType" in attributes:
+                tag = re.sub(rb'(\spouType=")[^"]*"', lambda m: m.group(1) + value + b'"', tag, count=1)
+            else:
+                end = -2 if tag.endswith(b"/>") else -1
+                tag = tag[:end].rstrip() + b' pouType="' + value + b'"' + tag[end:]
+        out.write(tag)
+        out.write(head[start.end():])
+        sha256.update(head)
+        while chunk := f.read(CHUNK_SIZE):
+            sha256.update(chunk)
+            out.write(chunk)
+    return name, attributes.get("pouType"), pou_type, sha256.hexdigest()
+
+def write_global_vars(path: str, out: BinaryIO) -> None:
+    """
+    Stream the children of vars.xml (its <globalVars>) into out one by one,
+    each one is dropped as soon as it is written.
+    """
+    depth = 0
+    root = None
+    pending = None
+    # the tail of an element is only known once the parser reached the next element
+    with open_input(path) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                if depth == 0:
+                    root = elem
+                elif depth == 1 and pending is not None:
+                    out.write(tostring(pending))
+                    pending = None
+                    root.clear()
+                depth += 1
+                continue
+            depth -= 1
+            if depth == 1:
+                pending = elem
+    if pending is not None:
+        out.write(tostring(pending))
+
+def write_pous(out: HashingWriter, index: ManifestIndex, previous: PreviousOutput, segments: List[dict]) -> None:
+    reused = 0
+    files = pou_files()
+    for file in files:
+        stat = fingerprint(file)
+        start = out.position
+        seg = previous.find("pou", file, stat, lambda seg: recorded_digest(file, stat, index, seg["name"]))
+        # the pouType also depends on the other POUs, through the manifest
+        if seg is not None and index.pou_type(seg["name"], seg["pouType"]) == seg["writtenType"]:
+            previous.copy(seg, out)
+            reused += 1
+        else:
+            logger.debug(f"Inserting {file}")
+            written = write_pou(file, out, index)
+            if written is None:
+                continue
+            name, source_type, pou_type, digest = written
+            seg = {"kind": "pou", "key": file, "stat": stat, "sha256": digest,
+                   "name": name, "pouType": source_type, "writtenType": pou_type}
+        seg.update(offset=start, length=out.position - start)
+        segments.append(seg)
+    if reused:
+        logger.info(f"Reused {reused} of {len(files)} POU(s) from the previous output")
+
+def write_project(base_root: ET.Element, index: ManifestIndex, output_path: str = OUTPUT_PATH,
+                  index_path: str = ASSEMBLY_INDEX_PATH, full: bool = False) -> str:
+    """
+    Write the project to output_path and its hash next to it, returns the
+    hash. An unchanged project leaves both files (and their mtime) alone,
+    as long as output_path still has the stat the assembly index recorded:
+    a plc.xml edited since is replaced even if its hash file was kept.
+    Unless full, POUs and global vars whose files did not change since the
+    last run are copied from the previous output.
+    """
+    skeleton = tostring(base_root, PROJECT_NAMESPACES)
+    head, tail = skeleton.split(POUS_MARK.encode(), 1)
+    recorded = load_assembly_index(output_path, index_path)
+    previous = PreviousOutput(output_path, None if full or recorded is None else recorded["segments"])
+    segments = []
+    tmp = output_path + ".tmp"
+    with open(tmp, "wb") as f, previous:
+        out = HashingWriter(f)
+        out.write(head)
+        write_pous(out, index, previous, segments)
+        # global vars go to the resource of every configuration
+        parts = tail.split(GVARS_MARK.encode())
+        # vars.xml.gz or .xz when Stage1 ran with --compress
+        vars_path = find_input(VARS_PATH)
+        stat = fingerprint(vars_path) if len(parts) > 1 else None
+        # Stage1 rewrites vars.xml on every run, hashed once for all configurations
+        digests = []
+        def vars_digest(seg: Optional[dict] = None) -> str:
+            if not digests:
+                digests.append(file_sha256(vars_path))
+            return digests[0]
+        for i, part in enumerate(parts[:-1]):
+            out.write(part)
+            start = out.position
+            seg = previous.find("globalVars", str(i), stat, vars_digest)
+            if seg is not None:
+                previous.copy(seg, out)
+            else:
+                write_global_vars(vars_path, out)
+                seg = {"kind": "globalVars", "key": str(i), "stat": stat, "sha256": vars_digest()}
+            seg.update(offset=start, length=out.position - start)
+            segments.append(seg)
+        out.write(parts[-1])
+        out.flush()
+    digest = out.sha256.hexdigest()
+    if recorded is not None and digest == read_hash(output_path):
+        logger.info(f"{output_path} is unchanged ({digest})")
+        os.remove(tmp)
+    else:
+        os.replace(tmp, output_path)
+        write_hash(output_path, digest)
+    save_assembly_index(output_path, segments, index_path)
+    return digest
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Assemble the converted POUs, tasks, types and global vars into plc.xml."
+    )
+    parser.add_argument(
+        '-f', '--full',
+        action='store_true',
+        help='Rebuild plc.xml from scratch instead of reusing the unchanged parts of the previous one'
+    )
+    args = parser.parse_args()
+
+    base_root = ET.parse(BASE_XML_PATH).getroot()
     inst = base_root.find("instances")
     if inst is None:
         logger.error("Failed to find <instances> tag in the base XML.")
@@ -118,9 +445,10 @@ def main():
     if configurations is None:
         logger.error("Failed to find <configurations> tag in the base XML.")
         sys.exit(1)
+    tasks_root = parse_optional(TASK_PATH)
     for configuration in configurations:
         if configuration.tag == "configuration":
-            deal_configuration(configuration)
+            deal_configuration(configuration, tasks_root)
         else:
             logger.warning(f"Unknown tag: {configuration.tag}")
 
@@ -128,15 +456,17 @@ def main():
     if types is None:
         logger.error("Failed to find <types> tag in the base XML.")
         sys.exit(1)
-    deal_types(types)
+    deal_types(types, parse_optional(TYPE_PATH))
     pous = types.find("pous")
     if pous is None:
         logger.error("Failed to find <pous> tag in the base XML.")
         sys.exit(1)
-    deal_pous(pous)
+    index = deal_pous(pous)
+    if index is None:
+        sys.exit(1)
 
   # Write the output XML
-    ET.ElementTree(base_root).write(OUTPUT_PATH)
+    write_project(base_root, index, full=args.full)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
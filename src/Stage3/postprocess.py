@@ -1,11 +1,13 @@
 import sys
 sys.path.append("../")
 
-import re
-from LD.Schema.Elements import Type, Variable
-import xml.etree.ElementTree as ET
+import argparse
 import os
-import glob
+import shutil
+from typing import Optional
+
+from Stage3.assemble import CHUNK_SIZE, HashingWriter, file_sha256, hash_path, read_hash, write_hash
+from Utils.compression import compress_stream, path_compression
 
 from Logs.colorLogger import get_color_logger
 logger = get_color_logger("postprocess.py")
@@ -13,49 +15,66 @@ logger = get_color_logger("postprocess.py")
 
 FILE_PATH = "../data/Outputs/plc.xml"
 FINAL_PATH = "D:/PLCworks/result/plc.xml"
-REPLACE_TAG = {
-    "xhtml":"xhtml:p"
-}
-REPLACE_PLACEHOLDER = {
-    "__GT_PLACEHOLDER__":"]]>",
-    "__LT_PLACEHOLDER__":"<![CDATA[",
-    "&lt;":"<",
-    "&gt;":">"
-}
-
-def replace_placeholders(text):
-    # Combine both replacement dictionaries
-    replace_dict = {**REPLACE_TAG, **REPLACE_PLACEHOLDER}
-    # Create a regex pattern that matches any key
-    pattern = '|'.join(re.escape(key) for key in replace_dict.keys())
-    
-    # Define a function to return the replacement value for a match
-    def replacer(match):
-        return replace_dict[match.group(0)]
-    
-    # Perform all replacements in a single pass
-    return re.sub(pattern, replacer, text)
-            
-def add_namespaces(text):
-
-    """ xmlns="http://www.plcopen.org/xml/tc6_0201" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xhtml="http://www.w3.org/1999/xhtml" xmlns:ns1="http://www.plcopen.org/xml/tc6_0201"
+
+def is_current(output_file: str, digest: Optional[str]) -> bool:
+    """
+    output_file has the recorded hash digest. The file itself is hashed, one
+    edited after its hash file was written is not taken as current.
+    """
+    return digest is not None and digest == read_hash(output_file) and digest == file_sha256(output_file)
+
+def write_compressed(input_file: str, output_file: str) -> None:
+    """
+    Compress input_file into output_file (.gz or .xz) and record the hash of
+    the compressed bytes, an unchanged result leaves both files alone.
     """
-    # replace project with project with namespaces from the position of project
-    text_namespace = 'xmlns="http://www.plcopen.org/xml/tc6_0201" xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xhtml="http://www.w3.org/1999/xhtml" xmlns:ns1="http://www.plcopen.org/xml/tc6_0201"'
-    return re.sub(r'<project', f'<project {text_namespace}', text, count=1)
-    
-  
+    tmp = output_file + ".tmp"
+    with open(input_file, "rb") as src, open(tmp, "wb") as f:
+        out = HashingWriter(f)
+        with compress_stream(out, path_compression(output_file)) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+    digest = out.sha256.hexdigest()
+    if is_current(output_file, digest):
+        logger.info(f"{output_file} is up to date ({digest})")
+        os.remove(tmp)
+        return
+    os.replace(tmp, output_file)
+    write_hash(output_file, digest)
+    logger.info(f"Final result written to {output_file}")
+
 def main(input_file = FILE_PATH, output_file = FINAL_PATH):
-    # read input xml file as string
-    with open(input_file, "r") as f:
-        xml_str = f.read()
-    xml_str = replace_placeholders(xml_str)
-
-    xml_str = add_namespaces(xml_str)
-    # write the modified string to the output file
-    with open(output_file, "w") as f:
-        f.write(xml_str)
+    # Stage3/assemble.py already writes the namespaces, <xhtml:p> and the CDATA
+    # bodies (Utils/plcxml.py), the final result is a plain copy
+    if os.path.abspath(input_file) == os.path.abspath(output_file):
+        logger.info(f"Final result written to {output_file}")
+        return
+    if path_compression(output_file):
+        write_compressed(input_file, output_file)
+        return
+    digest = read_hash(input_file)
+    if is_current(output_file, digest):
+        logger.info(f"{output_file} is up to date ({digest})")
+        return
+    shutil.copyfile(input_file, output_file)
+    if digest is not None:
+        write_hash(output_file, digest)
+    elif os.path.exists(hash_path(output_file)):
+        os.remove(hash_path(output_file))
     logger.info(f"Final result written to {output_file}")
 
-if __name__ == "__main__":  
-    main()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Copy the assembled plc.xml to its final location."
+    )
+    parser.add_argument(
+        '-i', '--input',
+        default=FILE_PATH,
+        help='Assembled project (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default=FINAL_PATH,
+        help='Final project, gzip or xz compressed if it ends with .gz or .xz (default: %(default)s)'
+    )
+    args = parser.parse_args()
+    main(args.input, args.output)
@@ -0,0 +1,212 @@
+import sys
+sys.path.append("../")
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from lxml import etree
+
+from Utils.plcxml import PLCOPEN_NS, XHTML_NS
+
+from Logs.colorLogger import get_color_logger
+logger = get_color_logger("VALIDATE")
+
+# Optional stage: checks the converted POUs (before assembling) and the assembled
+# project against the PLCopen TC6 XML schema. The schema is not shipped with
+# the converter, put tc6_xml_v201.xsd at SCHEMA_PATH or pass --schema.
+SCHEMA_PATH = "../data/Schema/tc6_xml_v201.xsd"
+BASE_XML_PATH = "../data/Base/beremiz_base2.xml"
+PROJECT_PATH = "../data/Outputs/plc.xml"
+POUS_PATH = ["LD/Outputs", "ST/Outputs"]
+# POU content hashes of the last run, used by --fast
+STATE_PATH = "../data/Inters/validate_state.json"
+
+
+@lru_cache(maxsize=None)
+def load_schema(schema_path: str) -> etree.XMLSchema:
+    """
+    Compile the schema once per process.
+    """
+    logger.debug(f"Compiling schema {schema_path}")
+    return etree.XMLSchema(etree.parse(schema_path))
+
+@lru_cache(maxsize=None)
+def _base_project(base_path: str) -> bytes:
+    root = etree.parse(base_path).getroot()
+    for pous in root.iter("pous"):
+        pous.clear()
+    return etree.tostring(qualify(root))
+
+def qualify(root: etree._Element) -> etree._Element:
+    """
+    Put un-namespaced elements (the base project) into the PLCopen namespace,
+    the way Utils/plcxml.py writes them: <xhtml> becomes <xhtml:p>. Elements
+    already written with their namespace are left alone.
+    """
+    stack = [(root, False)]
+    while stack:
+        elem, in_xhtml = stack.pop()
+        if not isinstance(elem.tag, str) or elem.tag.startswith("{"):
+            continue
+        if elem.tag == "xhtml":
+            elem.tag = f"{{{XHTML_NS}}}p"
+            in_xhtml = True
+        else:
+            elem.tag = f"{{{XHTML_NS if in_xhtml else PLCOPEN_NS}}}{elem.tag}"
+        stack.extend((child, in_xhtml) for child in elem)
+    return root
+
+def wrap_pou(pou_path: str, base_path: str = BASE_XML_PATH) -> etree._ElementTree:
+    """
+    Embed one converted POU into the base project so it can be checked against
+    the project schema on its own.
+    """
+    project = etree.fromstring(_base_project(base_path))
+    pou = qualify(etree.parse(pou_path).getroot())
+    project.find(f"{{{PLCOPEN_NS}}}types/{{{PLCOPEN_NS}}}pous").append(pou)
+    return etree.ElementTree(project)
+
+def _errors(schema: etree.XMLSchema) -> List[str]:
+    return [f"line {e.line}: {e.message}" for e in schema.error_log]
+
+def validate_pou(pou_path: str, schema_path: str = SCHEMA_PATH) -> Tuple[str, List[str]]:
+    """
+    Validate one POU file, returns (path, errors).
+    """
+    schema = load_schema(schema_path)
+    try:
+        tree = wrap_pou(pou_path)
+    except etree.XMLSyntaxError as e:
+        return pou_path, [str(e)]
+    if schema.validate(tree):
+        return pou_path, []
+    return pou_path, _errors(schema)
+
+def validate_project(project_path: str = PROJECT_PATH, schema_path: str = SCHEMA_PATH) -> List[str]:
+    """
+    Validate the assembled project, Stage3/assemble.py output or its final copy.
+    """
+    schema = load_schema(schema_path)
+    try:
+        tree = etree.parse(project_path)
+    except etree.XMLSyntaxError as e:
+        return [str(e)]
+    qualify(tree.getroot())
+    if schema.validate(tree):
+        return []
+    return _errors(schema)
+
+def _init_worker(schema_path: str) -> None:
+    # compile in the worker initializer, every POU of this worker reuses it
+    load_schema(schema_path)
+
+def file_hash(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def load_state(state_path: str) -> Dict[str, str]:
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_state(state_path: str, state: Dict[str, str]) -> None:
+    os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+
+def validate_pous(pou_files: List[str], schema_path: str = SCHEMA_PATH, jobs: Optional[int] = None,
+                  state_path: Optional[str] = None) -> Dict[str, List[str]]:
+    """
+    Validate POU files in parallel and return {path: errors} of the invalid ones.
+    With a state_path only POUs whose content (or the schema) changed since the
+    last run are validated, the hashes of valid POUs are stored there.
+    """
+    schema_hash = file_hash(schema_path)
+    hashes = {path: hashlib.sha256((schema_hash + file_hash(path)).encode()).hexdigest() for path in pou_files}
+    state = load_state(state_path) if state_path else {}
+    pending = [path for path in pou_files if state.get(path) != hashes[path]]
+    logger.info(f"Validating {len(pending)} of {len(pou_files)} POU(s)")
+
+    invalid = {}
+    if len(pending) == 1 or jobs == 1:
+        results = [validate_pou(path, schema_path) for path in pending]
+    elif pending:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(schema_path,)) as pool:
+            results = list(pool.map(validate_pou, pending, [schema_path] * len(pending)))
+    else:
+        results = []
+    for path, errors in results:
+        if errors:
+            invalid[path] = errors
+            state.pop(path, None)
+        else:
+            state[path] = hashes[path]
+
+    if state_path:
+        # forget POUs that are no longer produced
+        save_state(state_path, {path: state[path] for path in pou_files if path in state})
+    return invalid
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Validate converted POUs and the assembled project against the PLCopen TC6 schema."
+    )
+    parser.add_argument(
+        '-s', '--schema',
+        default=SCHEMA_PATH,
+        help='Path to tc6_xml_v201.xsd (default: %(default)s)'
+    )
+    parser.add_argument(
+        '-p', '--project',
+        nargs='?',
+        const=PROJECT_PATH,
+        default=None,
+        help='Also validate the assembled project (default path: %(const)s)'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        default=None,
+        help='Number of worker processes (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--fast',
+        action='store_true',
+        help=f'Only validate POUs changed since the last run (state kept in {STATE_PATH})'
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.schema):
+        logger.warning(f"Schema {args.schema} not found, skipping validation.")
+        return
+
+    pou_files = sorted(path for pous_path in POUS_PATH for path in glob.glob(os.path.join(pous_path, "*.xml")))
+    invalid = validate_pous(pou_files, args.schema, args.jobs, STATE_PATH if args.fast else None)
+    for path, errors in invalid.items():
+        logger.error(f"{path} is not valid:")
+        for error in errors:
+            logger.error(f"  {error}")
+
+    if args.project:
+        errors = validate_project(args.project, args.schema)
+        if errors:
+            invalid[args.project] = errors
+            logger.error(f"{args.project} is not valid:")
+            for error in errors:
+                logger.error(f"  {error}")
+        else:
+            logger.info(f"{args.project} is valid.")
+
+    if invalid:
+        sys.exit(1)
+    logger.info("Validation passed.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# compression.py
+# gzip, xz and zip files read and written as streams: an input is recognised
+# by its magic bytes and decompressed while the parser reads it, an output is
+# compressed by the suffix of its path. Nothing is unpacked to disk.
+import gzip
+import lzma
+import os
+import zipfile
+from typing import BinaryIO, Optional
+
+GZIP = "gz"
+XZ = "xz"
+ZIP = "zip"
+# compressions an output (or a Stage1 intermediate) can be written with
+COMPRESSIONS = (GZIP, XZ)
+COMPRESS_ENV = "PLC_COMPRESS"
+MAGIC = {
+    GZIP: (b"\x1f\x8b",),
+    XZ: (b"\xfd7zXZ\x00",),
+    # an empty archive only has the end of central directory record
+    ZIP: (b"PK\x03\x04", b"PK\x05\x06"),
+}
+MAGIC_SIZE = max(len(magic) for magics in MAGIC.values() for magic in magics)
+
+def compression_from_env() -> Optional[str]:
+    value = os.environ.get(COMPRESS_ENV)
+    return value if value in COMPRESSIONS else None
+
+def sniff(path: str) -> Optional[str]:
+    """gz, xz or zip by the first bytes of path, None for a plain file."""
+    with open(path, "rb") as f:
+        head = f.read(MAGIC_SIZE)
+    for compression, magics in MAGIC.items():
+        if head.startswith(magics):
+            return compression
+    return None
+
+def zip_member(archive: zipfile.ZipFile, member: Optional[str] = None) -> str:
+    """member, or the only .xml file of the archive."""
+    if member is not None:
+        if member not in archive.namelist():
+            raise ValueError(f"{archive.filename} has no member {member}")
+        return member
+    members = [info.filename for info in archive.infolist()
+               if not info.is_dir() and info.filename.lower().endswith(".xml")]
+    if len(members) != 1:
+        found = ", ".join(members) if members else "none"
+        raise ValueError(f"{archive.filename} must hold exactly one .xml file (found {found}), choose one with --member")
+    return members[0]
+
+def open_input(path: str, member: Optional[str] = None) -> BinaryIO:
+    """
+    path opened for binary reading, decompressed on the fly if it is a gzip,
+    xz or zip file. member is the file to read inside a zip archive.
+    """
+    compression = sniff(path)
+    if compression == GZIP:
+        return gzip.open(path, "rb")
+    if compression == XZ:
+        return lzma.open(path, "rb")
+    if compression == ZIP:
+        with zipfile.ZipFile(path) as archive:
+            # the member keeps the archive file open until it is closed itself
+            return archive.open(zip_member(archive, member))
+    return open(path, "rb")
+
+def compressed_path(path: str, compression: Optional[str]) -> str:
+    return f"{path}.{compression}" if compression else path
+
+def path_compression(path: str) -> Optional[str]:
+    for compression in COMPRESSIONS:
+        if path.endswith("." + compression):
+            return compression
+    return None
+
+def find_input(path: str) -> str:
+    """path, or its compressed variant if only that one exists."""
+    if not os.path.exists(path):
+        for compression in COMPRESSIONS:
+            if os.path.exists(compressed_path(path, compression)):
+                return compressed_path(path, compression)
+    return path
+
+def remove_variants(path: str, keep: Optional[str] = None) -> None:
+    """Remove the plain and compressed variants of path, except keep."""
+    compression = path_compression(path)
+    plain = path[:-len(compression) - 1] if compression else path
+    for variant in [plain] + [compressed_path(plain, compression) for compression in COMPRESSIONS]:
+        if variant != keep and os.path.exists(variant):
+            os.remove(variant)
+
+def compress_stream(f: BinaryIO, compression: Optional[str]) -> BinaryIO:
+    """
+    A writer compressing into the already open f, closing it leaves f open.
+    gzip output carries no name and no timestamp, the same content always
+    gives the same bytes.
+    """
+    if compression == GZIP:
+        return gzip.GzipFile(filename="", mode="wb", fileobj=f, mtime=0)
+    if compression == XZ:
+        return lzma.LZMAFile(f, "wb")
+    raise ValueError(f"Unknown compression {compression!r}, expected one of {', '.join(COMPRESSIONS)}")
+
+def open_output(path: str) -> BinaryIO:
+    """path opened for binary writing, compressed if it ends with .gz or .xz."""
+    compression = path_compression(path)
+    if compression == GZIP:
+        return gzip.GzipFile(path, "wb", mtime=0)
+    if compression == XZ:
+        return lzma.open(path, "wb")
+    return open(path, "wb")
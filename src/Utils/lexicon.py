@@ -0,0 +1,114 @@
+# lexicon.py
+# Case-insensitive lexicon shared by LD and ST: ST keywords, standard
+# functions/FBs and known POU names (libraries in libs/ and the project's own
+# POUs), folded once into frozensets so every lookup is a single O(1) hash probe.
+import glob
+import os
+import xml.etree.ElementTree as ET
+from functools import lru_cache
+from typing import FrozenSet, Iterable
+
+from data.Lex.functions import STANDARD_FUNCTIONS
+from data.Lex.keywords import ST_KEYWORDS
+
+LIBS_PATH = "../libs"
+# Converted POUs are split by Stage1 into T_<name>.xml files
+POU_INPUT_PATHS = ["LD/Inputs", "ST/Inputs"]
+
+# Call classes returned by Lexicon.classify_call
+KEYWORD = "keyword"
+STANDARD = "standard"
+LIBRARY = "library"
+PROJECT = "project"
+UNKNOWN = "unknown"
+
+def fold(name: str) -> str:
+    """Canonical form of an IEC identifier, identifiers are case-insensitive."""
+    return name.casefold()
+
+def fold_all(names: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(fold(name) for name in names if name)
+
+KEYWORDS = fold_all(ST_KEYWORDS)
+STANDARD_NAMES = fold_all(STANDARD_FUNCTIONS)
+
+class Lexicon:
+    """
+    Frozen name sets. extend() returns a new Lexicon, so a shared instance is
+    never mutated after it is built.
+    """
+    __slots__ = ("keywords", "standard", "library", "project")
+
+    def __init__(self, keywords: FrozenSet[str] = KEYWORDS, standard: FrozenSet[str] = STANDARD_NAMES,
+                 library: FrozenSet[str] = frozenset(), project: FrozenSet[str] = frozenset()):
+        self.keywords = keywords
+        self.standard = standard
+        self.library = library
+        self.project = project
+
+    def __repr__(self):
+        return (f"Lexicon(keywords={len(self.keywords)}, standard={len(self.standard)}, "
+                f"library={len(self.library)}, project={len(self.project)})")
+
+    def extend(self, library: Iterable[str] = (), project: Iterable[str] = ()) -> "Lexicon":
+        return Lexicon(self.keywords, self.standard, self.library | fold_all(library), self.project | fold_all(project))
+
+    def is_keyword(self, name: str) -> bool:
+        return fold(name) in self.keywords
+
+    def is_standard(self, name: str) -> bool:
+        """Standard function or function block (not a keyword)."""
+        return fold(name) in self.standard
+
+    def is_reserved(self, name: str) -> bool:
+        """Keyword or standard function, i.e. nothing the converter has to declare."""
+        name = fold(name)
+        return name in self.keywords or name in self.standard
+
+    def is_pou(self, name: str) -> bool:
+        name = fold(name)
+        return name in self.library or name in self.project
+
+    def classify_call(self, name: str) -> str:
+        name = fold(name)
+        if name in self.keywords:
+            return KEYWORD
+        if name in self.standard:
+            return STANDARD
+        if name in self.project:
+            return PROJECT
+        if name in self.library:
+            return LIBRARY
+        return UNKNOWN
+
+def _pou_name(path: str) -> str | None:
+    # only the root start tag is needed
+    for _, elem in ET.iterparse(path, events=("start",)):
+        return elem.get("name")
+    return None
+
+def library_pou_names(libs_path: str = LIBS_PATH) -> FrozenSet[str]:
+    """Names of the POUs shipped in libs/<library>/block/*.xml."""
+    names = []
+    for path in sorted(glob.glob(os.path.join(libs_path, "*", "block", "*.xml"))):
+        try:
+            names.append(_pou_name(path))
+        except ET.ParseError:
+            continue
+    return fold_all(names)
+
+def project_pou_names(paths: Iterable[str] = POU_INPUT_PATHS) -> FrozenSet[str]:
+    """Names of the project's POUs, taken from the T_<name>.xml files written by Stage1."""
+    names = []
+    for path in paths:
+        for file in glob.glob(os.path.join(path, "T_*.xml")):
+            names.append(os.path.basename(file)[len("T_"):-len(".xml")])
+    return fold_all(names)
+
+# Keywords and standard functions only, built at import
+LEXICON = Lexicon()
+
+@lru_cache(maxsize=None)
+def load_lexicon(libs_path: str = LIBS_PATH, pou_paths: tuple = tuple(POU_INPUT_PATHS)) -> Lexicon:
+    """LEXICON extended with library and project POU names, built once per process."""
+    return LEXICON.extend(library_pou_names(libs_path), project_pou_names(pou_paths))
@@ -0,0 +1,99 @@
+# manifest.py
+# Conversion manifest: every POU worker writes one JSON record describing the
+# POU it converted (one file per POU, so parallel workers never share a file)
+# and Stage3 merges the records into an index keyed by POU name.
+import glob
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Iterable, List, Optional
+
+MANIFEST_DIR = "ST/Outputs/manifest"
+INDEX_PATH = "../data/Inters/manifest.json"
+# pouType of a POU that another POU instantiates
+INSTANCE_POU_TYPE = "functionBlock"
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def make_record(name: str, pou_type: str, language: str, output: str, data: bytes,
+                globals_: Iterable[str] = (), instances: Iterable[str] = ()) -> dict:
+    """
+    Record of one converted POU: its pouType as converted, language, output
+    file with its size and mtime and sha256 of its content, the global
+    variables it references and the POUs it instantiates (those become
+    function blocks). output must already hold data.
+    """
+    stat = os.stat(output)
+    return {
+        "name": name,
+        "pouType": pou_type,
+        "language": language,
+        "output": output,
+        "stat": [stat.st_size, stat.st_mtime_ns],
+        "sha256": content_hash(data),
+        "globals": list(globals_),
+        "instances": list(instances),
+    }
+
+def write_record(record: dict, manifest_dir: str = MANIFEST_DIR) -> str:
+    os.makedirs(manifest_dir, exist_ok=True)
+    path = os.path.join(manifest_dir, f"{record['name']}.json")
+    fd, tmp = tempfile.mkstemp(dir=manifest_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return path
+
+def read_records(manifest_dir: str = MANIFEST_DIR) -> List[dict]:
+    records = []
+    for path in sorted(glob.glob(os.path.join(manifest_dir, "*.json"))):
+        with open(path, "r", encoding="utf-8") as f:
+            records.append(json.load(f))
+    return records
+
+def clear_records(manifest_dir: str = MANIFEST_DIR) -> None:
+    for path in glob.glob(os.path.join(manifest_dir, "*.json")):
+        os.remove(path)
+
+class ManifestIndex:
+    """
+    Records by POU name plus the set of instantiated POUs, so the final
+    pouType of a POU is two hash lookups.
+    """
+    __slots__ = ("records", "instances")
+
+    def __init__(self, records: Iterable[dict] = ()):
+        self.records: Dict[str, dict] = {}
+        instances = set()
+        for record in records:
+            self.records[record["name"]] = record
+            instances.update(record["instances"])
+        self.instances = frozenset(instances)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.records
+
+    def get(self, name: str) -> Optional[dict]:
+        return self.records.get(name)
+
+    def pou_type(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Final pouType: function block if any POU instantiates it, else the converted one."""
+        if name in self.instances:
+            return INSTANCE_POU_TYPE
+        record = self.records.get(name)
+        return record["pouType"] if record is not None else default
+
+    def to_dict(self) -> dict:
+        return {name: dict(record, finalPouType=self.pou_type(name)) for name, record in sorted(self.records.items())}
+
+def load_index(manifest_dir: str = MANIFEST_DIR) -> ManifestIndex:
+    return ManifestIndex(read_records(manifest_dir))
+
+def save_index(index: ManifestIndex, path: str = INDEX_PATH) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(index.to_dict(), f, ensure_ascii=False, indent=2)
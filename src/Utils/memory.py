@@ -0,0 +1,59 @@
+# memory.py
+# Memory budget of a bounded run (--max-memory, or PLC_MAX_MEMORY for the
+# stages started without arguments) and the RSS measurements used to keep
+# worker pools inside it.
+import os
+import re
+import sys
+from typing import Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows: no getrusage, the RSS is then reported as 0 and worker pools
+    # keep the requested size
+    resource = None
+
+MAX_MEMORY_ENV = "PLC_MAX_MEMORY"
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+SIZE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*$", re.IGNORECASE)
+
+def parse_size(text: str) -> int:
+    """Bytes of a size such as 1073741824, 512M, 1.5G or 2GiB (binary units)."""
+    match = SIZE_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"Invalid size: {text!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+def format_size(size: int) -> str:
+    return f"{size / (1 << 20):.1f} MiB"
+
+def max_memory_from_env() -> Optional[int]:
+    value = os.environ.get(MAX_MEMORY_ENV)
+    return parse_size(value) if value else None
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes, 0 if unknown."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+def peak_rss(children: bool = False) -> int:
+    """Peak RSS in bytes of this process, or of the largest waited-for child, 0 if unknown."""
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+def cap_workers(max_memory: int, used: int, per_worker: int, jobs: Optional[int] = None) -> int:
+    """
+    Workers that fit in max_memory next to `used` bytes, at least one, at most
+    jobs (or the CPUs). Without a measurement (per_worker 0) that is jobs.
+    """
+    limit = jobs or os.cpu_count() or 1
+    if per_worker <= 0:
+        return limit
+    return max(1, min(limit, (max_memory - used) // per_worker))
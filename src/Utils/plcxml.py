@@ -0,0 +1,100 @@
+# plcxml.py
+# Serializer of the converter's ElementTree elements in the form Beremiz reads:
+# <xhtml> is written as <xhtml:p>, text marked as CData (ST bodies) as a CDATA
+# section, and the PLCopen namespaces are declared on the element written.
+# Everything else is byte for byte what ElementTree.tostring writes.
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Optional
+
+PLCOPEN_NS = "http://www.plcopen.org/xml/tc6_0201"
+XSD_NS = "http://www.w3.org/2001/XMLSchema"
+XHTML_NS = "http://www.w3.org/1999/xhtml"
+# prefix -> namespace, in the order they are declared on <project>
+PROJECT_NAMESPACES = {"": PLCOPEN_NS, "xsd": XSD_NS, "xhtml": XHTML_NS, "ns1": PLCOPEN_NS}
+# a POU written on its own declares the xhtml prefix it uses, Stage3 drops it again
+FRAGMENT_NAMESPACES = {"xhtml": XHTML_NS}
+XHTML_TAG = "xhtml"
+XHTML_QNAME = "xhtml:p"
+ENCODING = "utf-8"
+
+class CData(str):
+    """Element text that is written as a CDATA section instead of escaped text."""
+    __slots__ = ()
+
+def escape_text(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+def escape_attribute(value: str) -> str:
+    value = escape_text(value)
+    if "\"" in value:
+        value = value.replace("\"", "&quot;")
+    if "\r" in value:
+        value = value.replace("\r", "&#13;")
+    if "\n" in value:
+        value = value.replace("\n", "&#10;")
+    if "\t" in value:
+        value = value.replace("\t", "&#09;")
+    return value
+
+def cdata_section(text: str) -> str:
+    # "]]>" cannot appear in a section, it is split over two
+    return "<![CDATA[" + text.replace("]]>", "]]]]><![CDATA[>") + "]]>"
+
+def namespace_declarations(namespaces: Dict[str, str]) -> str:
+    return "".join(f' xmlns{":" + prefix if prefix else ""}="{escape_attribute(uri)}"'
+                   for prefix, uri in namespaces.items())
+
+def _qname(tag: str, prefixes: Dict[str, str]) -> str:
+    if tag == XHTML_TAG:
+        return XHTML_QNAME
+    if tag[:1] != "{":
+        return tag
+    uri, local = tag[1:].split("}", 1)
+    if uri not in prefixes:
+        raise ValueError(f"No prefix for namespace {uri} of <{local}>")
+    prefix = prefixes[uri]
+    return f"{prefix}:{local}" if prefix else local
+
+def _serialize(write: Callable[[str], None], elem: ET.Element, prefixes: Dict[str, str], declarations: str = "") -> None:
+    tag = elem.tag
+    text = elem.text
+    if tag is ET.Comment:
+        write(f"<!--{text}-->")
+    elif tag is ET.ProcessingInstruction:
+        write(f"<?{text}?>")
+    else:
+        tag = _qname(tag, prefixes)
+        write("<" + tag + declarations)
+        for key, value in elem.items():
+            write(f' {_qname(key, prefixes)}="{escape_attribute(value)}"')
+        if text or len(elem):
+            write(">")
+            if text:
+                write(cdata_section(text) if isinstance(text, CData) else escape_text(text))
+            for child in elem:
+                _serialize(write, child, prefixes)
+            write("</" + tag + ">")
+        else:
+            write(" />")
+    if elem.tail:
+        write(escape_text(elem.tail))
+
+def tostring(elem: ET.Element, namespaces: Optional[Dict[str, str]] = None, encoding: str = ENCODING) -> bytes:
+    """
+    elem and its tail as bytes, namespaces (prefix -> uri) are declared on
+    elem and {uri}tag names are written with their prefix.
+    """
+    namespaces = namespaces or {}
+    # the first prefix declared for a namespace wins, as the default one for PLCopen
+    prefixes = {}
+    for prefix, uri in namespaces.items():
+        prefixes.setdefault(uri, prefix)
+    parts = []
+    _serialize(parts.append, elem, prefixes, namespace_declarations(namespaces))
+    return "".join(parts).encode(encoding)